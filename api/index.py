@@ -1,24 +1,41 @@
 # api/index.py
-from flask import Flask, request, jsonify, send_file, Response, stream_with_context
+from flask import Flask, request, jsonify, send_file, send_from_directory, Response, stream_with_context, redirect, g
 import json
 import os
+import sys
+import atexit
+import logging
+import logging.handlers
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 import urllib3
-import csv
 import re
 import tempfile
 import shutil
-import zipfile
 import uuid
 import io
 import base64
+import hashlib
+import hmac
+import math
+import random
+import queue
+import sqlite3
+import time
+import threading
+import weakref
+from contextlib import nullcontext
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+from bisect import bisect_left
+from urllib.parse import urlparse, urlencode
 from datetime import datetime
-from collections import defaultdict
-import cloudinary
-import cloudinary.uploader
-import cloudinary.api
-import cloudinary.exceptions
+from collections import defaultdict, deque
+
+# cloudinary, csv, zipfile, zoneinfo and PIL are imported where they are first
+# used, so light routes (app_opened, auth) don't pay for them on a cold start.
+# bench/import_budget.py checks that this stays true.
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
@@ -40,12 +57,37 @@ AUTH_HOST = "salep-auth.sce.manh.com"
 API_HOST = "salep.sce.manh.com"
 USERNAME_BASE = "sdtadmin@"
 CLIENT_ID = "omnicomponent.1.0.0"
-BULK_IMPORT_URL = f"https://{API_HOST}/item-master/api/item-master/item/bulkImport?stopOnFirstError=true"
+AUTH_URL = f"https://{AUTH_HOST}/oauth/token"
+TOKEN_REFRESH_MARGIN_SECONDS = 120  # Refresh cached tokens this long before they expire
+DEFAULT_TOKEN_TTL_SECONDS = 1800  # Used when the token response has no expires_in
+BULK_IMPORT_BASE_URL = f"https://{API_HOST}/item-master/api/item-master/item/bulkImport"
+BULK_IMPORT_URL = f"{BULK_IMPORT_BASE_URL}?stopOnFirstError=true"
+
+# --- Chunked WMS Bulk Import ---
+DEFAULT_WM_BATCH_SIZE = 250  # Items per bulkImport request in chunked mode
+MIN_WM_BATCH_SIZE = 10
+MAX_WM_BATCH_SIZE = 2000
+DEFAULT_WM_IN_FLIGHT = 3  # Chunk requests sent at once
+MAX_WM_IN_FLIGHT = 8
+WM_CHUNK_RETRIES = 2
+WM_SLOW_CHUNK_SECONDS = 20  # Chunks slower than this shrink the next batches
+WM_CSV_MAX_REJECTED_ROWS = 1000  # Rejected rows listed in a CSV upload's response (all are counted)
+WM_CSV_HEADER_NAMES = {"itemid", "item id", "item_id"}  # A first row starting with one of these is a header
 
 # --- xAI Grok API Configuration ---
 BASE_URL_GEN = "https://api.x.ai/v1"
 MODEL = "grok-3"
 API_KEY_GEN = os.getenv("XAI_API_KEY", "")
+GEN_TEMPERATURE = 0.1
+GEN_MAX_TOKENS = 1000  # Enough for roughly 60-80 product names
+GEN_SHARD_THRESHOLD = 60  # Larger counts are split into concurrent alphabetical shards
+GEN_SHARD_SIZE = 30  # Names asked of each shard (before overshoot)
+GEN_SHARD_MAX_NAMES = 60  # No single completion is asked for more than this
+GEN_SHARD_OVERSHOOT = 1.15  # Ask for extra names to absorb duplicates across shards
+GEN_SHARD_CONCURRENCY = 16
+GEN_TOP_UP_ROUNDS = 2  # Follow-up requests for names still missing after the first round
+GENERATE_CACHE_TTL_SECONDS = int(os.getenv("GENERATE_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+GENERATE_CACHE_MAX_BYTES = int(os.getenv("GENERATE_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
 
 # --- Google Custom Search API Configuration ---
 URL_DOWN = "https://www.googleapis.com/customsearch/v1"
@@ -57,6 +99,15 @@ CLOUD_NAME = os.getenv("CLOUDINARY_CLOUD_NAME", "com-manh-cp")
 API_KEY_CLOUD = os.getenv("CLOUDINARY_API_KEY", "")
 API_SECRET_CLOUD = os.getenv("CLOUDINARY_API_SECRET", "")
 
+# --- Cloudinary Upload Concurrency ---
+DEFAULT_UPLOAD_CONCURRENCY = 4  # In-flight uploads when parallel mode is requested
+MAX_UPLOAD_CONCURRENCY = 16
+CLOUDINARY_MANIFEST_TTL_SECONDS = 30 * 24 * 3600  # public_id -> content hash records
+CLOUDINARY_MANIFEST_MAX_BYTES = 16 * 1024 * 1024
+CLOUDINARY_LOOKUP_BATCH_SIZE = 100  # Admin API limit for resources_by_ids
+CLOUDINARY_SIGNATURE_TTL_SECONDS = 3600  # Cloudinary refuses signed uploads whose timestamp is older than this
+MAX_SIGNED_UPLOADS_PER_REQUEST = 200
+
 # --- Home Assistant Webhook Configuration ---
 HA_WEBHOOK_URL = "http://sidmsmith.zapto.org:8123/api/webhook/manhattan_pos_items"
 
@@ -73,6 +124,85 @@ DEFAULT_EXTRA_PROMPT = ""
 DEFAULT_IMAGE_FILTERS = ""
 DEFAULT_ITEM_NUMBERS_CSV = ""
 
+# --- Concurrency Configuration ---
+DEFAULT_MAX_WORKERS = 8  # Products processed at once in parallel mode
+DEFAULT_PER_HOST_LIMIT = 4  # Simultaneous requests to any single host
+MAX_WORKERS_LIMIT = 32
+
+# --- Google CSE Rate Governor (shared by all workers through CACHE_DIR) ---
+CSE_RATE_PER_SECOND = float(os.getenv("CSE_RATE_PER_SECOND", "1.5"))  # Sustained requests per second
+CSE_BURST = int(os.getenv("CSE_BURST", "5"))  # Requests allowed back-to-back after an idle period
+CSE_DAILY_QUOTA = int(os.getenv("CSE_DAILY_QUOTA", "10000"))  # 0 disables the daily cap
+CSE_QUOTA_TIMEZONE = "America/Los_Angeles"  # Google resets CSE quotas at midnight Pacific
+CSE_MAX_WAIT_SECONDS = 30  # Longest a request waits for a token before giving up
+CSE_BACKOFF_BASE_SECONDS = 1.0
+CSE_BACKOFF_MAX_SECONDS = 30.0
+
+CSE_PAGE_SIZE = 10  # Google API max results per request
+CSE_MAX_RESULTS = 100  # Google API serves nothing past start + num = 100
+CSE_PAGE_CONCURRENCY = 3  # Pages fetched at once when images_per_item > CSE_PAGE_SIZE
+
+# --- Image Pre-filter Configuration (uses CSE item metadata, before any download) ---
+MIN_IMAGE_BYTES = 1500  # Smaller downloads are treated as icons/spacers
+MIN_GIF_BYTES = 8000  # GIFs this small are usually animations or tracking pixels
+IMAGE_RANK_PIXEL_CAP = 1600 * 1600  # Beyond this resolution, search relevance decides the order
+IMAGE_MIME_ALIASES = {"jpg": "image/jpeg", "jpeg": "image/jpeg", "png": "image/png", "gif": "image/gif", "webp": "image/webp"}
+
+# --- Persistent Cache Configuration ---
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(tempfile.gettempdir(), "todolist_cache"))
+SEARCH_CACHE_TTL_SECONDS = int(os.getenv("SEARCH_CACHE_TTL_SECONDS", str(24 * 3600)))
+SEARCH_CACHE_MAX_BYTES = int(os.getenv("SEARCH_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+# --- Image Probe Configuration ---
+IMAGE_PROBE_BYTES = 4096  # Leading bytes read to sniff the real image format
+IMAGE_PROBE_FRESH_SECONDS = 3600  # Cached probes are trusted without revalidation this long
+IMAGE_PROBE_CACHE_TTL_SECONDS = 7 * 24 * 3600  # After freshness expires, revalidate with ETag/Last-Modified
+IMAGE_PROBE_CACHE_MAX_BYTES = 8 * 1024 * 1024
+
+# --- Image Download Configuration (every full image download goes through read_image_body) ---
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(25 * 1024 * 1024)))  # Reading stops once a body passes this
+IMAGE_SPOOL_BYTES = int(os.getenv("IMAGE_SPOOL_BYTES", str(512 * 1024)))  # Larger bodies spill from memory to a temp file
+IMAGE_READ_CHUNK_BYTES = 64 * 1024
+IMAGE_UNLABELLED_TYPES = {"", "application/octet-stream", "binary/octet-stream"}  # Accepted only if the body sniffs as an image
+
+# --- Thumbnail Configuration (/api/thumb; resizing needs the optional Pillow package) ---
+THUMB_CACHE_DIR = os.path.join(CACHE_DIR, "thumbs")
+THUMB_CACHE_MAX_BYTES = int(os.getenv("THUMB_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+THUMB_DEFAULT_WIDTH = 320
+THUMB_MAX_WIDTH = 1024
+THUMB_WIDTH_STEP = 64  # Requested widths round up to a multiple of this so few sizes get cached
+THUMB_QUALITY = 80
+THUMB_MAX_SOURCE_BYTES = 25 * 1024 * 1024  # Originals larger than this are not thumbnailed
+THUMB_MAX_AGE_SECONDS = 30 * 24 * 3600
+# /api/thumb only serves URLs signed by thumbnail_url; set the same key on every instance.
+# Without it the proxy is off and gallery previews link to the originals.
+THUMB_SIGNING_KEY = os.getenv("THUMB_SIGNING_KEY", "")
+
+# --- Background Job Configuration ---
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", str(6 * 3600)))  # Artifacts are deleted after this
+JOB_ARTIFACT_DIR = os.path.join(CACHE_DIR, "jobs")
+JOB_KEEPALIVE_SECONDS = 15
+
+# --- Logging Configuration ---
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()  # DEBUG shows the per-request Google search trace
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # "json" (one object per line) or "text"
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.1"))  # Share of sampled DEBUG lines kept
+
+# --- Metrics Configuration (/api/metrics) ---
+METRIC_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# --- HTTP Connection Pools (one keep-alive session per upstream) ---
+# pool_connections: number of distinct hosts kept alive; pool_maxsize: sockets per host
+HTTP_POOL_CONFIG = {
+    "google_cse": {"pool_connections": 2, "pool_maxsize": 16},
+    "xai": {"pool_connections": 2, "pool_maxsize": 4},
+    "wms_auth": {"pool_connections": 2, "pool_maxsize": 4, "verify": False},
+    "wms_api": {"pool_connections": 2, "pool_maxsize": 8, "verify": False},
+    "images": {"pool_connections": 64, "pool_maxsize": DEFAULT_PER_HOST_LIMIT * 2},
+    "webhook": {"pool_connections": 1, "pool_maxsize": 2}
+}
+
 # =============================================================================
 # MIME MAP FOR IMAGE EXTENSIONS
 # =============================================================================
@@ -88,16 +218,1059 @@ MIME_EXTENSION_MAP = {
     "image/svg+xml": ".svg"
 }
 
+# =============================================================================
+# LOGGING
+# =============================================================================
+
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per line: time, level, tag, message and any extra fields"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "tag": getattr(record, "tag", "api"),
+            "message": record.getMessage(),
+            "thread": record.threadName
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        return json.dumps(entry, default=str)
+
+class TextLogFormatter(logging.Formatter):
+    """Console layout close to the original: HH:MM:SS LEVEL [TAG] message"""
+
+    def format(self, record):
+        timestamp = datetime.fromtimestamp(record.created).strftime("%H:%M:%S")
+        tag = getattr(record, "tag", "api").upper()
+        line = f"{timestamp} {record.levelname} [{tag}] {record.getMessage()}"
+        fields = getattr(record, "fields", None)
+        return f"{line} {json.dumps(fields, default=str)}" if fields else line
+
+class DebugSampler(logging.Filter):
+    """Keep only a share of DEBUG records logged with extra={"sample": True}"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno <= logging.DEBUG and getattr(record, "sample", False):
+            return random.random() < self.rate
+        return True
+
+def configure_logging():
+    """Route the app logger through a queue so request threads never block on stdout"""
+    log = logging.getLogger("todolist")
+    if log.handlers:
+        return log
+    log.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+    log.propagate = False
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonLogFormatter() if LOG_FORMAT == "json" else TextLogFormatter())
+    records = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(records)
+    handler.addFilter(DebugSampler(LOG_DEBUG_SAMPLE_RATE))
+    listener = logging.handlers.QueueListener(records, output)
+    listener.start()
+    atexit.register(listener.stop)  # Flushes queued records on shutdown
+    log.addHandler(handler)
+    return log
+
+logger = configure_logging()
+GOOGLE_LOG = {"tag": "google-api"}
+GOOGLE_LOG_SAMPLED = {"tag": "google-api", "sample": True}
+
+# =============================================================================
+# METRICS
+# =============================================================================
+
+METRIC_DEFINITIONS = {
+    "todolist_http_requests_total": ("counter", "API requests handled, by route, method and status"),
+    "todolist_http_request_duration_seconds": ("histogram", "Time until the response is returned (streamed bodies excluded), by route"),
+    "todolist_upstream_requests_total": ("counter", "Calls to upstream services, by upstream and status (error = no response)"),
+    "todolist_upstream_request_duration_seconds": ("histogram", "Upstream call latency, by upstream"),
+    "todolist_upstream_bytes_received_total": ("counter", "Bytes downloaded from upstream services"),
+    "todolist_upstream_bytes_sent_total": ("counter", "Bytes uploaded to upstream services"),
+    "todolist_upstream_retries_total": ("counter", "Upstream calls repeated after a failure, 429 or expired token"),
+    "todolist_upstream_rate_limited_total": ("counter", "Upstream 429 responses"),
+    "todolist_cache_hits_total": ("counter", "Cache hits, by cache"),
+    "todolist_cache_misses_total": ("counter", "Cache misses, by cache"),
+    "todolist_cache_hit_ratio": ("gauge", "Cache hits / lookups since process start, by cache"),
+    "todolist_cache_bytes": ("gauge", "Bytes currently stored, by cache")
+}
+
+class _ShardOwner:
+    """Held in a thread's local storage; freed (and its shard retired) when the thread exits"""
+
+class MetricsRegistry:
+    """Counters and histograms recorded into per-thread shards
+
+    Recording touches only the calling thread's own dicts, so the hot path
+    takes no lock; shards are summed when /api/metrics is scraped. When a
+    thread exits its shard is folded into a retired total, so the shard list
+    tracks live threads only. Collectors add point-in-time samples (cache
+    stats) at scrape time.
+    """
+
+    def __init__(self, definitions, buckets=METRIC_LATENCY_BUCKETS):
+        self.definitions = definitions
+        self.buckets = buckets
+        self._local = threading.local()
+        self._shards = []
+        self._retired = self._new_shard()
+        self._shards_lock = threading.Lock()  # Not taken on the recording path once a thread has its shard
+        self._collectors = []
+
+    @staticmethod
+    def _new_shard():
+        return {"counters": {}, "histograms": {}}
+
+    def _merge(self, into, shard):
+        for key, value in shard["counters"].copy().items():
+            into["counters"][key] = into["counters"].get(key, 0) + value
+        for key, (buckets, total, count) in shard["histograms"].copy().items():
+            merged = into["histograms"].setdefault(key, [[0] * (len(self.buckets) + 1), 0.0, 0])
+            merged[0] = [a + b for a, b in zip(merged[0], buckets)]
+            merged[1] += total
+            merged[2] += count
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._new_shard()
+            owner = _ShardOwner()
+            weakref.finalize(owner, self._retire, shard)
+            self._local.owner = owner
+            self._local.shard = shard
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def _retire(self, shard):
+        with self._shards_lock:
+            self._merge(self._retired, shard)
+            self._shards = [live for live in self._shards if live is not shard]
+
+    def inc(self, name, amount=1, **labels):
+        counters = self._shard()["counters"]
+        key = (name, tuple(sorted(labels.items())))
+        counters[key] = counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        histograms = self._shard()["histograms"]
+        key = (name, tuple(sorted(labels.items())))
+        entry = histograms.get(key)
+        if entry is None:
+            entry = histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def register_collector(self, collector):
+        """collector() returns (name, labels dict, value) samples for names in definitions"""
+        self._collectors.append(collector)
+
+    @staticmethod
+    def _labels(labels):
+        if not labels:
+            return ""
+        def escape(value):
+            return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels) + "}"
+
+    def render(self):
+        """Render every metric in the Prometheus text exposition format"""
+        totals = self._new_shard()
+        with self._shards_lock:
+            # Merge under the lock so a shard retiring mid-scrape is not counted twice
+            self._merge(totals, self._retired)
+            for shard in self._shards:
+                self._merge(totals, shard)
+        counters = defaultdict(float, totals["counters"])
+        histograms = totals["histograms"]
+        for collector in self._collectors:
+            try:
+                for name, labels, value in collector():
+                    counters[(name, tuple(sorted(labels.items())))] = value
+            except Exception as e:
+                log_to_console(f"Metrics collector failed: {e}", "[WARNING]")
+
+        by_name = defaultdict(list)
+        for (name, labels), value in counters.items():
+            by_name[name].append(("value", labels, value))
+        for (name, labels), value in histograms.items():
+            by_name[name].append(("histogram", labels, value))
+
+        lines = []
+        for name in sorted(by_name):
+            metric_type, help_text = self.definitions.get(name, ("untyped", ""))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for kind, labels, value in sorted(by_name[name], key=lambda sample: sample[1]):
+                if kind == "value":
+                    lines.append(f"{name}{self._labels(labels)} {value:g}")
+                    continue
+                buckets, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), buckets):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    lines.append(f"{name}_bucket{self._labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{self._labels(labels)} {total:g}")
+                lines.append(f"{name}_count{self._labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry(METRIC_DEFINITIONS)
+
+def record_upstream_call(upstream, elapsed, status=None, received=0, sent=0):
+    """Record one upstream call (status None means no response was received)"""
+    metrics.inc("todolist_upstream_requests_total", upstream=upstream, status=str(status) if status is not None else "error")
+    metrics.observe("todolist_upstream_request_duration_seconds", elapsed, upstream=upstream)
+    if received:
+        metrics.inc("todolist_upstream_bytes_received_total", received, upstream=upstream)
+    if sent:
+        metrics.inc("todolist_upstream_bytes_sent_total", sent, upstream=upstream)
+    if status == 429:
+        metrics.inc("todolist_upstream_rate_limited_total", upstream=upstream)
+
+def record_upstream_retry(upstream):
+    metrics.inc("todolist_upstream_retries_total", upstream=upstream)
+
+# =============================================================================
+# SHARED HTTP CLIENT
+# =============================================================================
+
+class PooledHTTPClient:
+    """Keep-alive requests.Session for one upstream, with per-pool statistics"""
+
+    def __init__(self, name, pool_connections=4, pool_maxsize=8, verify=True):
+        self.name = name
+        self.session = requests.Session()
+        self.session.verify = verify
+        self.session.headers.update({"Accept-Encoding": "gzip, deflate"})
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.pool_maxsize = pool_maxsize
+        self._lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "errors": 0,
+            "bytes_received": 0,
+            "total_seconds": 0.0,
+            "status_codes": defaultdict(int)
+        }
+
+    def request(self, method, url, **kwargs):
+        started = time.perf_counter()
+        try:
+            r = self.session.request(method, url, **kwargs)
+        except Exception:
+            elapsed = time.perf_counter() - started
+            self._record(elapsed, error=True)
+            record_upstream_call(self.name, elapsed)
+            raise
+        # Streamed bodies are not read yet, so fall back to the declared length
+        if kwargs.get("stream"):
+            received = int(r.headers.get("content-length") or 0)
+        else:
+            received = len(r.content)
+        elapsed = time.perf_counter() - started
+        body = r.request.body
+        sent = len(body) if isinstance(body, (bytes, str)) else 0
+        self._record(elapsed, status=r.status_code, received=received)
+        record_upstream_call(self.name, elapsed, status=r.status_code, received=received, sent=sent)
+        return r
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def _record(self, elapsed, status=None, received=0, error=False):
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["total_seconds"] += elapsed
+            self._stats["bytes_received"] += received
+            if error:
+                self._stats["errors"] += 1
+            if status is not None:
+                self._stats["status_codes"][str(status)] += 1
+
+    def stats(self):
+        """Return a JSON-serializable snapshot of this pool's counters"""
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["status_codes"] = dict(self._stats["status_codes"])
+        snapshot["pool_maxsize"] = self.pool_maxsize
+        snapshot["avg_seconds"] = round(snapshot["total_seconds"] / snapshot["requests"], 4) if snapshot["requests"] else 0.0
+        snapshot["total_seconds"] = round(snapshot["total_seconds"], 4)
+        return snapshot
+
+HTTP_CLIENTS = {name: PooledHTTPClient(name, **cfg) for name, cfg in HTTP_POOL_CONFIG.items()}
+
+def http_client(name):
+    """Return the shared pooled client for an upstream (see HTTP_POOL_CONFIG)"""
+    return HTTP_CLIENTS[name]
+
+def http_pool_stats():
+    return {name: client.stats() for name, client in HTTP_CLIENTS.items()}
+
+# =============================================================================
+# PERSISTENT CACHE
+# =============================================================================
+
+class PersistentCache:
+    """SQLite-backed JSON cache with TTL expiry and size-bounded LRU eviction
+
+    Entries survive process restarts and are shared by every worker that
+    points at the same CACHE_DIR. Any storage error degrades to a cache miss.
+    """
+
+    def __init__(self, name, ttl_seconds, max_bytes, cache_dir=CACHE_DIR):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.path = os.path.join(cache_dir, f"{name}.sqlite3")
+        self._lock = threading.Lock()
+        self._conn = None
+        self._counters = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0, "errors": 0}
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+            self._conn = conn
+        return self._conn
+
+    def _count(self, counter, amount=1):
+        self._counters[counter] += amount
+
+    def get(self, key, accept=None):
+        """Return the cached value, or None on a miss or expired entry
+
+        When accept(value) is false the entry is kept but counted and returned as a miss.
+        """
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connect()
+                row = conn.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+                if row is None or now - row[1] > self.ttl_seconds:
+                    if row is not None:
+                        conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                        conn.commit()
+                    self._count("misses")
+                    return None
+                value = json.loads(row[0])
+                if accept is not None and not accept(value):
+                    self._count("misses")
+                    return None
+                conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+                conn.commit()
+                self._count("hits")
+                return value
+            except (sqlite3.Error, OSError, ValueError) as e:
+                self._count("errors")
+                self._count("misses")
+                log_to_console(f"Cache '{self.name}' read failed: {e}", "[WARNING]")
+                return None
+
+    def set(self, key, value):
+        payload = json.dumps(value)
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connect()
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, size, created, last_access) VALUES (?, ?, ?, ?, ?)",
+                    (key, payload, len(payload), now, now)
+                )
+                self._evict(conn, now)
+                conn.commit()
+                self._count("writes")
+            except (sqlite3.Error, OSError) as e:
+                self._count("errors")
+                log_to_console(f"Cache '{self.name}' write failed: {e}", "[WARNING]")
+
+    def _evict(self, conn, now):
+        """Drop expired entries, then least recently used ones until under max_bytes"""
+        expired = conn.execute("DELETE FROM entries WHERE created < ?", (now - self.ttl_seconds,)).rowcount
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        evicted = 0
+        if total > self.max_bytes:
+            for key, size in conn.execute("SELECT key, size FROM entries ORDER BY last_access ASC").fetchall():
+                if total <= self.max_bytes:
+                    break
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                total -= size
+                evicted += 1
+        self._count("evictions", max(expired, 0) + evicted)
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._counters)
+            try:
+                entries, size = self._connect().execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+                ).fetchone()
+            except (sqlite3.Error, OSError):
+                entries, size = 0, 0
+        lookups = snapshot["hits"] + snapshot["misses"]
+        snapshot.update({
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "hit_ratio": round(snapshot["hits"] / lookups, 4) if lookups else 0.0
+        })
+        return snapshot
+
+search_cache = PersistentCache("cse_search", SEARCH_CACHE_TTL_SECONDS, SEARCH_CACHE_MAX_BYTES)
+
+# =============================================================================
+# CSE RATE GOVERNOR
+# =============================================================================
+
+class RateGovernor:
+    """Token bucket with a daily quota, shared across processes through SQLite
+
+    Every worker pointing at the same CACHE_DIR draws from one bucket, so the
+    upstream sees a steady request rate instead of per-process bursts. A 429
+    blocks the whole bucket for Retry-After (or an exponential backoff with
+    jitter). Storage errors fail open: requests go out ungoverned.
+    """
+
+    def __init__(self, name, rate_per_second, burst, daily_quota=0, cache_dir=CACHE_DIR):
+        self.name = name
+        self.rate = rate_per_second
+        self.burst = burst
+        self.daily_quota = daily_quota
+        self.path = os.path.join(cache_dir, "rate_governor.sqlite3")
+        self._lock = threading.Lock()
+        self._conn = None
+        self._counters = {"acquired": 0, "waits": 0, "wait_seconds": 0.0, "rate_limited": 0,
+                          "quota_rejections": 0, "timeouts": 0, "errors": 0}
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, "
+                "blocked_until REAL NOT NULL, day TEXT NOT NULL, used INTEGER NOT NULL)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            self._counters[counter] += amount
+
+    @staticmethod
+    def _quota_day():
+        try:
+            from zoneinfo import ZoneInfo
+            return datetime.now(ZoneInfo(CSE_QUOTA_TIMEZONE)).strftime("%Y-%m-%d")
+        except Exception:
+            return time.strftime("%Y-%m-%d", time.gmtime())
+
+    def _try_take(self, now):
+        """Take a token if one is available
+
+        Returns:
+            float: 0 when a token was taken, seconds to wait otherwise, or -1 when the daily quota is spent
+        """
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                day = self._quota_day()
+                row = conn.execute(
+                    "SELECT tokens, updated, blocked_until, day, used FROM buckets WHERE name = ?", (self.name,)
+                ).fetchone()
+                tokens, updated, blocked_until, row_day, used = row or (self.burst, now, 0.0, day, 0)
+                if row_day != day:
+                    used = 0
+                tokens = min(self.burst, tokens + max(0.0, now - updated) * self.rate)
+
+                if self.daily_quota and used >= self.daily_quota:
+                    wait = -1
+                elif blocked_until > now:
+                    wait = blocked_until - now
+                elif tokens >= 1:
+                    tokens -= 1
+                    used += 1
+                    wait = 0
+                else:
+                    wait = (1 - tokens) / self.rate
+
+                conn.execute(
+                    "INSERT OR REPLACE INTO buckets (name, tokens, updated, blocked_until, day, used) VALUES (?, ?, ?, ?, ?, ?)",
+                    (self.name, tokens, now, blocked_until, day, used)
+                )
+                conn.execute("COMMIT")
+                return wait
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def acquire(self, max_wait=CSE_MAX_WAIT_SECONDS):
+        """Block until a request may be sent
+
+        Returns:
+            tuple: (allowed, error_message or None)
+        """
+        deadline = time.monotonic() + max_wait
+        waited = 0.0
+        while True:
+            try:
+                wait = self._try_take(time.time())
+            except (sqlite3.Error, OSError) as e:
+                self._count("errors")
+                log_to_console(f"Rate governor '{self.name}' unavailable, not throttling: {e}", "[WARNING]")
+                return True, None
+
+            if wait == 0:
+                self._count("acquired")
+                if waited:
+                    self._count("waits")
+                    self._count("wait_seconds", waited)
+                return True, None
+            if wait < 0:
+                self._count("quota_rejections")
+                return False, f"Daily Google API quota of {self.daily_quota} requests reached"
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._count("timeouts")
+                return False, "Google API busy (local rate limit) - try again shortly"
+            pause = min(wait, remaining)
+            time.sleep(pause)
+            waited += pause
+
+    def backoff(self, attempt, retry_after=None):
+        """Record a 429 and block the shared bucket for Retry-After or an exponential backoff with jitter"""
+        self._count("rate_limited")
+        delay = None
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except (TypeError, ValueError):
+                delay = None
+        if delay is None:
+            delay = random.uniform(0, min(CSE_BACKOFF_MAX_SECONDS, CSE_BACKOFF_BASE_SECONDS * (2 ** attempt)))
+        delay = min(delay, CSE_BACKOFF_MAX_SECONDS)
+        try:
+            with self._lock:
+                conn = self._connect()
+                conn.execute(
+                    "UPDATE buckets SET blocked_until = MAX(blocked_until, ?) WHERE name = ?",
+                    (time.time() + delay, self.name)
+                )
+        except (sqlite3.Error, OSError) as e:
+            self._count("errors")
+            log_to_console(f"Rate governor '{self.name}' could not record backoff: {e}", "[WARNING]")
+            time.sleep(delay)
+        return delay
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._counters)
+        snapshot["wait_seconds"] = round(snapshot["wait_seconds"], 3)
+        snapshot.update({"rate_per_second": self.rate, "burst": self.burst, "daily_quota": self.daily_quota})
+        try:
+            with self._lock:
+                row = self._connect().execute(
+                    "SELECT tokens, blocked_until, day, used FROM buckets WHERE name = ?", (self.name,)
+                ).fetchone()
+        except (sqlite3.Error, OSError):
+            row = None
+        if row:
+            snapshot.update({
+                "tokens": round(row[0], 3),
+                "blocked_for_seconds": round(max(0.0, row[1] - time.time()), 3),
+                "quota_day": row[2],
+                "used_today": row[3] if row[2] == self._quota_day() else 0
+            })
+        return snapshot
+
+cse_governor = RateGovernor("google_cse", CSE_RATE_PER_SECOND, CSE_BURST, CSE_DAILY_QUOTA)
+
+# =============================================================================
+# MANHATTAN TOKEN CACHE
+# =============================================================================
+
+class SingleFlight:
+    """Collapse concurrent calls that share a key into one execution
+
+    The first caller runs the function; callers arriving while it is in
+    flight wait for and share its result (or exception).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = Future()
+                self._calls[key] = call
+        if not leader:
+            return call.result()
+        try:
+            result = fn(*args, **kwargs)
+            call.set_result(result)
+            return result
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+class TokenCache:
+    """Per-ORG access token cache with refresh-ahead and single-flight grants
+
+    Tokens inside the refresh margin are still returned while one background
+    grant replaces them; expired or missing tokens block on a grant that is
+    shared by every concurrent caller for that ORG.
+    """
+
+    def __init__(self, fetch, refresh_margin=TOKEN_REFRESH_MARGIN_SECONDS):
+        self.fetch = fetch
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+        self._tokens = {}
+        self._refreshing = set()  # ORGs with a background grant in flight
+        self._flight = SingleFlight()
+
+    def get(self, org, force_refresh=False, stale_token=None):
+        """Return a valid token for org, or None if the grant fails
+
+        stale_token: a token the caller saw rejected; it is only replaced if
+        no one has refreshed it yet, so concurrent 401s cause a single grant.
+        """
+        key = org.strip().lower()
+        now = time.time()
+        start_refresh = False
+        with self._lock:
+            entry = self._tokens.get(key)
+            if (entry and not force_refresh and not stale_token and key not in self._refreshing
+                    and entry["expires_at"] - self.refresh_margin <= now < entry["expires_at"]):
+                self._refreshing.add(key)
+                start_refresh = True
+        if start_refresh:
+            threading.Thread(target=self._refresh_quietly, args=(key,), daemon=True).start()
+        if entry and now < entry["expires_at"]:
+            if stale_token and entry["token"] != stale_token:
+                return entry["token"]
+            if not force_refresh and not stale_token:
+                return entry["token"]
+        return self._flight.do(key, self._refresh, key)
+
+    def invalidate(self, org):
+        with self._lock:
+            self._tokens.pop(org.strip().lower(), None)
+
+    def _refresh(self, key):
+        token, expires_in = self.fetch(key)
+        if not token:
+            return None
+        try:
+            ttl = int(expires_in)
+        except (TypeError, ValueError):
+            ttl = DEFAULT_TOKEN_TTL_SECONDS
+        with self._lock:
+            self._tokens[key] = {"token": token, "expires_at": time.time() + ttl}
+        return token
+
+    def _refresh_quietly(self, key):
+        try:
+            self._flight.do(key, self._refresh, key)
+        except Exception as e:
+            log_to_console(f"Background token refresh failed for {key}: {e}", "[WARNING]")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+manhattan_tokens = TokenCache(lambda org: request_manhattan_token(org))
+
+# =============================================================================
+# IMAGE PROBING
+# =============================================================================
+
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+    (b"\x00\x00\x01\x00", "image/x-icon")
+]
+
+image_probe_cache = PersistentCache("image_probe", IMAGE_PROBE_CACHE_TTL_SECONDS, IMAGE_PROBE_CACHE_MAX_BYTES)
+image_flight = SingleFlight()
+
+def sniff_image_type(head):
+    """Identify an image format from its leading bytes, or None if it is not a known image"""
+    if not head:
+        return None
+    for signature, mime in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return mime
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    text = head[:1024].lstrip().lower()
+    if text.startswith(b"<svg") or (text.startswith(b"<?xml") and b"<svg" in text):
+        return "image/svg+xml"
+    return None
+
+def probe_image(url, timeout=10):
+    """Check that a URL serves an image without downloading it
+
+    Sends a ranged GET for the first IMAGE_PROBE_BYTES, sniffs the real format
+    from magic bytes and closes the response straight away. Results are cached
+    by URL; after IMAGE_PROBE_FRESH_SECONDS they are revalidated with
+    If-None-Match / If-Modified-Since so unchanged images cost one 304.
+
+    Returns:
+        dict: is_image, content_type (sniffed, else declared), declared_type, etag, last_modified
+    Raises:
+        requests.exceptions.RequestException on network or HTTP errors
+    """
+    now = time.time()
+    cached = image_probe_cache.get(url)
+    if cached and now - cached["checked"] < IMAGE_PROBE_FRESH_SECONDS:
+        return cached
+
+    headers = {"Range": f"bytes=0-{IMAGE_PROBE_BYTES - 1}"}
+    if cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    with http_client("images").get(url, headers=headers, timeout=timeout, stream=True) as r:
+        if r.status_code == 304 and cached:
+            cached["checked"] = now
+            image_probe_cache.set(url, cached)
+            return cached
+        r.raise_for_status()
+
+        declared_type = r.headers.get("content-type", "").split(";")[0].strip().lower()
+        # Servers that ignore Range send the whole body; only the first chunk is read either way
+        head = next(r.iter_content(IMAGE_PROBE_BYTES), b"")
+        sniffed_type = sniff_image_type(head)
+        probe = {
+            # Unknown formats are trusted when declared as images, unless the body is markup (an error page)
+            "is_image": bool(sniffed_type) or (declared_type.startswith("image/") and not head.lstrip().startswith(b"<")),
+            "content_type": sniffed_type or declared_type,
+            "declared_type": declared_type,
+            "etag": r.headers.get("etag"),
+            "last_modified": r.headers.get("last-modified"),
+            "checked": now
+        }
+
+    if probe["is_image"]:
+        image_probe_cache.set(url, probe)
+    return probe
+
+class ImageRejected(requests.exceptions.RequestException):
+    """An image response refused by read_image_body (not an image, or too large)"""
+
+class ImageBody:
+    """A downloaded image body held in a SpooledTemporaryFile
+
+    Up to IMAGE_SPOOL_BYTES stays in memory and anything larger lives on disk,
+    so memory per image is bounded. Coalesced callers share one body; every
+    chunks() call reads from the start independently. The temp file goes away
+    with the last reference.
+    """
+
+    def __init__(self, content_type, spool_bytes=IMAGE_SPOOL_BYTES):
+        self.content_type = content_type
+        self.size = 0
+        self._file = tempfile.SpooledTemporaryFile(max_size=spool_bytes)
+        self._lock = threading.Lock()
+
+    def write(self, chunk):
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    def chunks(self, chunk_size=IMAGE_READ_CHUNK_BYTES):
+        offset = 0
+        while True:
+            with self._lock:
+                self._file.seek(offset)
+                chunk = self._file.read(chunk_size)
+            if not chunk:
+                return
+            offset += len(chunk)
+            yield chunk
+
+    def read(self):
+        return b"".join(self.chunks())
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            for chunk in self.chunks():
+                f.write(chunk)
+
+def read_image_body(url, timeout=20, max_bytes=IMAGE_MAX_BYTES, host_limiter=None):
+    """Stream an image response into an ImageBody, chunk by chunk
+
+    The declared content-type is checked before any of the body is read, and
+    unlabelled responses (no type or octet-stream) must sniff as an image from
+    their first chunk. A Content-Length over max_bytes is refused up front and
+    reading stops as soon as the body passes max_bytes.
+
+    Returns:
+        ImageBody: content_type is the declared type, or the sniffed one for unlabelled responses
+    Raises:
+        ImageRejected for non-image or oversized responses,
+        requests.exceptions.RequestException on network or HTTP errors
+    """
+    with host_slot(host_limiter, url):
+        with http_client("images").get(url, timeout=timeout, stream=True) as r:
+            r.raise_for_status()
+            declared_type = r.headers.get("content-type", "").split(";")[0].strip().lower()
+            if not declared_type.startswith("image/") and declared_type not in IMAGE_UNLABELLED_TYPES:
+                raise ImageRejected(f"Not an image (content-type: {declared_type})")
+            if int(r.headers.get("content-length") or 0) > max_bytes:
+                raise ImageRejected(f"Image is larger than {max_bytes} bytes")
+
+            body = ImageBody(declared_type)
+            for chunk in r.iter_content(IMAGE_READ_CHUNK_BYTES):
+                if not body.size and not declared_type.startswith("image/"):
+                    sniffed_type = sniff_image_type(chunk)
+                    if not sniffed_type:
+                        raise ImageRejected(f"Not an image (content-type: {declared_type or 'none'})")
+                    body.content_type = sniffed_type
+                body.write(chunk)
+                if body.size > max_bytes:
+                    raise ImageRejected(f"Image is larger than {max_bytes} bytes")
+    return body
+
+def fetch_image_body(url, timeout=20):
+    """read_image_body for one URL; concurrent requests for the same URL share one GET"""
+    return image_flight.do(("get", url), read_image_body, url, timeout)
+
+# =============================================================================
+# THUMBNAILS
+# =============================================================================
+
+class ThumbnailCache:
+    """Size-bounded LRU cache of rendered thumbnails, one file per entry
+
+    Recency is the file mtime (refreshed on every hit), so workers sharing
+    THUMB_CACHE_DIR share the cache. Any storage error degrades to a miss.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0, "errors": 0}
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.thumb")
+
+    def get(self, key):
+        """Return the cached thumbnail bytes, or None on a miss"""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._counters["misses"] += 1
+            return None
+        except OSError as e:
+            with self._lock:
+                self._counters["errors"] += 1
+                self._counters["misses"] += 1
+            log_to_console(f"Thumbnail cache read failed: {e}", "[WARNING]")
+            return None
+        with self._lock:
+            self._counters["hits"] += 1
+        return data
+
+    def set(self, key, data):
+        path = self._path(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            with self._lock:
+                self._counters["writes"] += 1
+                self._evict()
+        except OSError as e:
+            with self._lock:
+                self._counters["errors"] += 1
+            log_to_console(f"Thumbnail cache write failed: {e}", "[WARNING]")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def _entries(self):
+        entries = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.endswith(".thumb"):
+                        try:
+                            st = entry.stat()
+                        except OSError:
+                            continue
+                        entries.append((st.st_mtime, st.st_size, entry.path))
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def _evict(self):
+        """Delete least recently used thumbnails until the directory is under max_bytes"""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self._counters["evictions"] += 1
+            except OSError:
+                pass
+            total -= size
+
+    def stats(self):
+        entries = self._entries()
+        with self._lock:
+            snapshot = dict(self._counters)
+        lookups = snapshot["hits"] + snapshot["misses"]
+        snapshot.update({
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+            "hit_ratio": round(snapshot["hits"] / lookups, 4) if lookups else 0.0
+        })
+        return snapshot
+
+thumb_cache = ThumbnailCache(THUMB_CACHE_DIR, THUMB_CACHE_MAX_BYTES)
+thumb_flight = SingleFlight()
+
+def load_pillow():
+    """Import Pillow on first use; returns None when it is not installed"""
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return None
+    return Image, ImageOps
+
+def thumbnail_width(value):
+    """Clamp a requested width and round it up to THUMB_WIDTH_STEP"""
+    try:
+        width = int(value) if value else THUMB_DEFAULT_WIDTH
+    except (TypeError, ValueError):
+        width = THUMB_DEFAULT_WIDTH
+    width = max(THUMB_WIDTH_STEP, min(width, THUMB_MAX_WIDTH))
+    return -(-width // THUMB_WIDTH_STEP) * THUMB_WIDTH_STEP
+
+def thumbnail_signature(image_url):
+    return hmac.new(THUMB_SIGNING_KEY.encode("utf-8"), f"thumb|{image_url}".encode("utf-8"), hashlib.sha256).hexdigest()[:32]
+
+_thumb_proxy_warned = threading.Event()
+
+def thumbnail_url(image_url, width=THUMB_DEFAULT_WIDTH):
+    """Gallery preview URL that serves image_url through /api/thumb, signed so the route is not an open proxy
+
+    Returns image_url itself when THUMB_SIGNING_KEY is not set.
+    """
+    if not image_url:
+        return ""
+    if not THUMB_SIGNING_KEY:
+        if not _thumb_proxy_warned.is_set():
+            _thumb_proxy_warned.set()
+            log_to_console("THUMB_SIGNING_KEY is not set; gallery previews use the original image URLs", "[WARNING]")
+        return image_url
+    return f"/api/thumb?{urlencode({'url': image_url, 'w': width, 'sig': thumbnail_signature(image_url)})}"
+
+def thumbnail_key(url, width, fmt):
+    return hashlib.sha256(f"{url}|{width}|{fmt}".encode("utf-8")).hexdigest()
+
+def fetch_thumbnail_source(url, timeout=20):
+    """Download an original for thumbnailing, refusing bodies over THUMB_MAX_SOURCE_BYTES"""
+    return read_image_body(url, timeout, max_bytes=THUMB_MAX_SOURCE_BYTES).read()
+
+def render_thumbnail(url, width, fmt, key):
+    """Fetch url, resize it to fit width x width and store it in thumb_cache
+
+    Returns:
+        bytes: the encoded thumbnail
+    Raises:
+        requests.exceptions.RequestException when the original cannot be fetched,
+        ImageRejected when it is not an image or too large,
+        ValueError/OSError when it is not a decodable image
+    """
+    Image, ImageOps = load_pillow()
+    source = fetch_thumbnail_source(url)
+    with Image.open(io.BytesIO(source)) as img:
+        img.draft("RGB", (width, width))  # Lets JPEG decode at a reduced scale
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((width, width))
+        if fmt == "jpeg" and img.mode != "RGB":
+            rgba = img.convert("RGBA")
+            img = Image.new("RGB", rgba.size, (255, 255, 255))
+            img.paste(rgba, mask=rgba.getchannel("A"))
+        elif fmt == "webp" and img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA")
+        out = io.BytesIO()
+        img.save(out, format=fmt.upper(), quality=THUMB_QUALITY)
+    data = out.getvalue()
+    thumb_cache.set(key, data)
+    return data
+
 # =============================================================================
 # HELPER FUNCTIONS
 # =============================================================================
 
-def get_manhattan_token(org):
-    """Get Manhattan WMS authentication token"""
+def get_manhattan_token(org, force_refresh=False, stale_token=None):
+    """Get Manhattan WMS authentication token (cached per ORG, see TokenCache)"""
     if not MANHATTAN_PASSWORD or not MANHATTAN_SECRET:
         return None
-    
-    url = f"https://{AUTH_HOST}/oauth/token"
+    return manhattan_tokens.get(org, force_refresh=force_refresh, stale_token=stale_token)
+
+def request_manhattan_token(org):
+    """Run the OAuth password grant for an ORG
+
+    Returns:
+        tuple: (access_token, expires_in seconds) or (None, None) on failure
+    """
+    url = AUTH_URL
     username = f"{USERNAME_BASE}{org.lower()}"
     data = {
         "grant_type": "password",
@@ -107,12 +1280,13 @@ def get_manhattan_token(org):
     headers = {"Content-Type": "application/x-www-form-urlencoded"}
     auth = HTTPBasicAuth(CLIENT_ID, MANHATTAN_SECRET)
     try:
-        r = requests.post(url, data=data, headers=headers, auth=auth, timeout=60, verify=False)
+        r = http_client("wms_auth").post(url, data=data, headers=headers, auth=auth, timeout=60, verify=False)
         if r.status_code == 200:
-            return r.json().get("access_token")
+            token_json = r.json()
+            return token_json.get("access_token"), token_json.get("expires_in")
     except Exception as e:
-        print(f"[AUTH] Error: {e}")
-    return None
+        log_to_console(f"Token request failed for ORG {org}: {e}", "[ERROR]")
+    return None, None
 
 def clean_url(url):
     """Clean URL by removing protocol and www"""
@@ -156,10 +1330,112 @@ def parse_image_filters(filter_str):
 
     return filters, None
 
-def log_to_console(message, prefix="[API]"):
-    """Log message for console output"""
-    timestamp = datetime.now().strftime("%H:%M:%S")
-    print(f"{timestamp} {prefix} {message}")
+def parse_image_criteria(data):
+    """Read the metadata pre-filter settings from a request payload
+
+    Keys: min_width, min_height, min_aspect, max_aspect (width / height),
+    max_bytes, allowed_mime (list or comma string, "png" or "image/png")
+    and rank_images (default True when any criterion is set).
+
+    Returns:
+        tuple: (criteria dict or None when nothing is set, error_message or None)
+    """
+    criteria = {}
+    try:
+        for key in ("min_width", "min_height", "max_bytes"):
+            if data.get(key):
+                criteria[key] = int(data[key])
+        for key in ("min_aspect", "max_aspect"):
+            if data.get(key):
+                criteria[key] = float(data[key])
+    except (TypeError, ValueError):
+        return None, "Image criteria must be numbers"
+
+    allowed = data.get("allowed_mime")
+    if allowed:
+        if isinstance(allowed, str):
+            allowed = allowed.split(",")
+        mimes = []
+        for m in allowed:
+            m = str(m).strip().lower()
+            if m:
+                mimes.append(m if "/" in m else IMAGE_MIME_ALIASES.get(m, f"image/{m}"))
+        criteria["allowed_mime"] = sorted(set(mimes))
+
+    if not criteria:
+        return None, None
+    criteria["rank"] = bool(data.get("rank_images", True))
+    return criteria, None
+
+def image_item_rejection(item, criteria):
+    """Return why a CSE item fails the criteria based on its metadata, or None to keep it
+
+    Items missing a piece of metadata are not rejected on that check.
+    """
+    meta = item.get("image", {}) or {}
+    width, height, size = meta.get("width"), meta.get("height"), meta.get("byteSize")
+    mime = (item.get("mime") or "").lower()
+
+    if mime and not mime.startswith("image/"):
+        return "mime"
+    if mime and criteria.get("allowed_mime") and mime not in criteria["allowed_mime"]:
+        return "mime"
+    if size:
+        if size < criteria.get("min_bytes", 0):
+            return "bytes"
+        if "gif" in mime and size < criteria.get("min_gif_bytes", 0):
+            return "bytes"
+        if criteria.get("max_bytes") and size > criteria["max_bytes"]:
+            return "bytes"
+    if width and width < criteria.get("min_width", 0):
+        return "resolution"
+    if height and height < criteria.get("min_height", 0):
+        return "resolution"
+    if width and height:
+        aspect = width / height
+        if aspect < criteria.get("min_aspect", 0):
+            return "aspect"
+        if criteria.get("max_aspect") and aspect > criteria["max_aspect"]:
+            return "aspect"
+    return None
+
+def image_rank_score(item):
+    meta = item.get("image", {}) or {}
+    pixels = (meta.get("width") or 0) * (meta.get("height") or 0)
+    return min(pixels, IMAGE_RANK_PIXEL_CAP)
+
+def rank_search_items(items, criteria):
+    """Filter CSE items on their metadata and order the best candidates first
+
+    Ranking prefers higher resolution (capped at IMAGE_RANK_PIXEL_CAP) and keeps
+    search order for ties.
+
+    Returns:
+        list: (original_index, item) pairs, so callers can keep numbering stable
+    """
+    candidates = list(enumerate(items))
+    if not criteria:
+        return candidates
+
+    kept = [(idx, item) for idx, item in candidates if image_item_rejection(item, criteria) is None]
+    if len(kept) < len(candidates):
+        logger.debug("Pre-filter dropped %s of %s search results", len(candidates) - len(kept), len(candidates), extra=GOOGLE_LOG_SAMPLED)
+    if criteria.get("rank"):
+        kept.sort(key=lambda pair: image_rank_score(pair[1]), reverse=True)
+    return kept
+
+LOG_PREFIX_LEVELS = {"[ERROR]": logging.ERROR, "[WARNING]": logging.WARNING, "[INFO]": logging.INFO, "[SUCCESS]": logging.INFO}
+
+def log_to_console(message, prefix="[API]", **fields):
+    """Log through the structured logger
+
+    Level prefixes ([ERROR], [WARNING], [INFO], [SUCCESS]) set the level; any
+    other prefix (e.g. [JOB]) becomes the tag of an INFO record.
+    """
+    level = LOG_PREFIX_LEVELS.get(prefix, logging.INFO)
+    if logger.isEnabledFor(level):
+        tag = "api" if prefix in LOG_PREFIX_LEVELS else prefix.strip("[]").lower()
+        logger.log(level, message, extra={"tag": tag, "fields": fields})
 
 def ensure_prefix_url(prefix):
     if not prefix:
@@ -172,160 +1448,242 @@ def get_extension_from_headers(content_type, fallback=".jpg"):
     content_type = content_type.split(";")[0].strip().lower()
     return MIME_EXTENSION_MAP.get(content_type, fallback)
 
-def fetch_image_variants(product_name, item_id, sites, images_per_item, filters, start=1):
-    """Fetch image metadata for a product without writing to disk
-    
-    Args:
-        product_name: Product name to search for
-        item_id: Item identifier
-        sites: List of sites to search
-        images_per_item: Number of images to fetch
-        filters: Image filter parameters
-        start: Starting index for pagination (1-based, default=1)
-    """
-    log_to_console(f"[GOOGLE-API] fetch_image_variants called: product='{product_name}', item_id={item_id}, count={images_per_item}, start={start}", "[INFO]")
-    
-    # Check API key
-    if not API_KEY_DOWN:
-        log_to_console(f"[GOOGLE-API] ERROR: GOOGLE_API_KEY environment variable not set!", "[ERROR]")
-        return [], "Google API key not configured"
-    
-    log_to_console(f"[GOOGLE-API] API key present: {API_KEY_DOWN[:10]}...", "[INFO]")
-    log_to_console(f"[GOOGLE-API] CX (Search Engine ID): {CX}", "[INFO]")
-    
-    site_query = " OR ".join(f"site:{s}" for s in sites) if sites else ""
-    query = f"{product_name} ({site_query})" if site_query else product_name
-    log_to_console(f"[GOOGLE-API] Query: '{query}'", "[INFO]")
-    log_to_console(f"[GOOGLE-API] Sites: {sites}", "[INFO]")
-
-    params = {
-        "key": API_KEY_DOWN,
-        "cx": CX,
-        "q": query,
-        "searchType": "image",
-        "num": min(10, images_per_item),  # Google API max is 10 per request
-        "start": start  # Pagination: start index (1-based)
+def cse_cache_key(product_name, sites, filters, start, num):
+    """Build a normalized search cache key so equivalent queries share an entry"""
+    normalized = {
+        "q": " ".join((product_name or "").lower().split()),
+        "sites": sorted(sites or []),
+        "filters": sorted((filters or {}).items()),
+        "start": int(start),
+        "num": int(num),
+        "cx": CX
     }
-    if filters:
-        params.update(filters)
-        log_to_console(f"[GOOGLE-API] Filters applied: {filters}", "[INFO]")
-    
-    log_to_console(f"[GOOGLE-API] Request params: num={params['num']}, start={params['start']}, searchType={params['searchType']}", "[INFO]")
-    log_to_console(f"[GOOGLE-API] Making request to: {URL_DOWN}", "[INFO]")
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode("utf-8")).hexdigest()
 
-    last_error = None
+def build_search_variants(items, product_name, item_id, start, images_per_item, criteria=None):
+    """Turn Google image search items into gallery variant dicts
+
+    With criteria, items are pre-filtered and ranked on their metadata; file
+    names still follow each item's position in the search results.
+    """
     variants = []
+    filename_base = re.sub(r'[\\/:*?"<>|]', "", item_id)
+
+    for idx, item in rank_search_items(items, criteria):
+        img_url = item.get("link")
+        if not img_url:
+            continue
+        thumb_url = item.get("image", {}).get("thumbnailLink") or img_url
+
+        try:
+            parsed_source = urlparse(img_url).netloc.lower().replace("www.", "")
+        except Exception:
+            parsed_source = ""
+
+        # Use start index + current position to ensure unique fileNames across pagination
+        # start is 1-based, idx is 0-based, so variant number = start + idx
+        variant_number = start + idx
+        file_name = f"{filename_base}_v{variant_number:02d}"
+
+        variants.append({
+            "fileName": file_name,
+            "originalUrl": img_url,
+            "previewUrl": thumb_url,
+            "source": parsed_source,
+            "shortDescription": product_name,
+            "description": product_name,
+            "itemId": item_id
+        })
+
+        if len(variants) >= images_per_item:
+            break
+
+    return variants
+
+cse_flight = SingleFlight()
 
+def request_search_items(params, cache_key):
+    """Run one Google image search with retries and store the items in search_cache
+
+    Returns:
+        tuple: (items list, error_message or None)
+    """
+    last_error = None
     for attempt in range(3):
+        if attempt:
+            record_upstream_retry("google_cse")
         try:
-            log_to_console(f"[GOOGLE-API] Attempt {attempt + 1}/3", "[INFO]")
-            r = requests.get(URL_DOWN, params=params, timeout=15)
-            log_to_console(f"[GOOGLE-API] Response status: {r.status_code}", "[INFO]" if r.status_code == 200 else "[WARNING]")
+            allowed, governor_error = cse_governor.acquire()
+            if not allowed:
+                last_error = governor_error
+                break
+            r = http_client("google_cse").get(URL_DOWN, params=params, timeout=15)
+            logger.debug("CSE attempt %s/3 status %s (q=%r start=%s)", attempt + 1, r.status_code, params["q"], params["start"], extra=GOOGLE_LOG_SAMPLED)
             
             if r.status_code == 429:
                 last_error = "Google API rate limited (429)"
-                log_to_console(f"[GOOGLE-API] Rate limited (429), will retry", "[WARNING]")
+                delay = cse_governor.backoff(attempt, r.headers.get("Retry-After"))
+                logger.debug("CSE rate limited (429), retrying after %.1fs", delay, extra=GOOGLE_LOG)
                 continue
             r.raise_for_status()
             data = r.json()
-            
-            # Log response structure
-            log_to_console(f"[GOOGLE-API] Response keys: {list(data.keys())}", "[INFO]")
+
             if "error" in data:
-                log_to_console(f"[GOOGLE-API] API Error: {data['error']}", "[ERROR]")
+                logger.debug("CSE API error: %s", data["error"], extra=GOOGLE_LOG)
                 last_error = f"Google API error: {data['error']}"
                 break
             
             items = data.get("items", [])
-            log_to_console(f"[GOOGLE-API] Found {len(items)} items in response", "[INFO]")
             if not items:
                 last_error = "No images returned"
-                log_to_console(f"[GOOGLE-API] No items in response, searchInfo: {data.get('searchInformation', {})}", "[WARNING]")
+                logger.debug("CSE returned no items, searchInfo: %s", data.get("searchInformation", {}), extra=GOOGLE_LOG)
                 break
 
-            for idx, item in enumerate(items):
-                # Calculate variant number based on start position + index
-                # This ensures unique fileNames across pagination calls
-                variant_number = start + idx
-                img_url = item.get("link")
-                if not img_url:
-                    continue
-                thumb_url = item.get("image", {}).get("thumbnailLink") or img_url
-
-                parsed_source = ""
-                try:
-                    from urllib.parse import urlparse
-                    parsed = urlparse(img_url)
-                    parsed_source = parsed.netloc.lower().replace("www.", "")
-                except:
-                    parsed_source = ""
-
-                filename_base = re.sub(r'[\\/:*?"<>|]', "", item_id)
-                # Use start index + current position to ensure unique fileNames across pagination
-                # start is 1-based, idx is 0-based, so variant number = start + idx
-                variant_number = start + idx
-                file_name = f"{filename_base}_v{variant_number:02d}"
-
-                variants.append({
-                    "fileName": file_name,
-                    "originalUrl": img_url,
-                    "previewUrl": thumb_url,
-                    "source": parsed_source,
-                    "shortDescription": product_name,
-                    "description": product_name,
-                    "itemId": item_id
-                })
-
-                if len(variants) >= images_per_item:
-                    break
-            
-            log_to_console(f"[GOOGLE-API] Successfully processed {len(variants)} variants", "[SUCCESS]")
-            break
+            search_cache.set(cache_key, items)
+            return items, None
         except requests.exceptions.Timeout:
             last_error = "Google API timeout"
-            log_to_console(f"[GOOGLE-API] Timeout on attempt {attempt + 1}", "[ERROR]")
+            logger.debug("CSE timeout on attempt %s", attempt + 1, extra=GOOGLE_LOG)
         except requests.exceptions.RequestException as e:
             last_error = f"Google API error: {str(e)[:80]}"
-            log_to_console(f"[GOOGLE-API] Request exception on attempt {attempt + 1}: {last_error}", "[ERROR]")
+            logger.debug("CSE request exception on attempt %s: %s", attempt + 1, last_error, extra=GOOGLE_LOG)
             break
         except Exception as e:
             last_error = f"Unexpected error: {str(e)[:80]}"
-            log_to_console(f"[GOOGLE-API] Unexpected exception on attempt {attempt + 1}: {last_error}", "[ERROR]")
+            logger.debug("CSE unexpected exception on attempt %s: %s", attempt + 1, last_error, extra=GOOGLE_LOG)
             break
 
-    if last_error:
-        log_to_console(f"[GOOGLE-API] Returning {len(variants)} variants with error: {last_error}", "[WARNING]")
-    else:
-        log_to_console(f"[GOOGLE-API] ✓ Returning {len(variants)} variants successfully", "[SUCCESS]")
-    
-    return variants, last_error
+    return [], last_error
 
-def download_image_from_url(image_url, item_id, url_type="URL1"):
-    """Download an image from a URL and return variant metadata
+def fetch_image_variants(product_name, item_id, sites, images_per_item, filters, start=1, use_cache=True, criteria=None):
+    """Fetch image metadata for a product without writing to disk
     
     Args:
-        image_url: URL of the image to download
+        product_name: Product name to search for
         item_id: Item identifier
-        url_type: Type of URL (URL1 or URL2) for labeling
-    
-    Returns:
-        tuple: (variant_dict or None, error_message or None)
-        If successful, returns variant dict. If failed, returns None and error message.
+        sites: List of sites to search
+        images_per_item: Number of images to fetch
+        filters: Image filter parameters
+        start: Starting index for pagination (1-based, default=1)
+        use_cache: Serve results from the persistent search cache; fresh results are always stored (default=True)
+        criteria: Optional metadata pre-filter/ranking settings from parse_image_criteria
     """
-    if not image_url or not image_url.strip():
+    # Check API key
+    if not API_KEY_DOWN:
+        log_to_console("GOOGLE_API_KEY environment variable not set", "[ERROR]")
+        return [], "Google API key not configured"
+
+    site_query = " OR ".join(f"site:{s}" for s in sites) if sites else ""
+    query = f"{product_name} ({site_query})" if site_query else product_name
+
+    params = {
+        "key": API_KEY_DOWN,
+        "cx": CX,
+        "q": query,
+        "searchType": "image",
+        "num": min(10, images_per_item),  # Google API max is 10 per request
+        "start": start  # Pagination: start index (1-based)
+    }
+    if filters:
+        params.update(filters)
+    logger.debug("fetch_image_variants item_id=%s q=%r num=%s start=%s filters=%s",
+                 item_id, query, params["num"], start, filters, extra=GOOGLE_LOG_SAMPLED)
+
+    last_error = None
+    variants = []
+
+    cache_key = cse_cache_key(product_name, sites, filters, start, params["num"])
+    cached_items = search_cache.get(cache_key) if use_cache else None
+    if cached_items is not None:
+        variants = build_search_variants(cached_items, product_name, item_id, start, images_per_item, criteria)
+        logger.debug("CSE cache hit: %s variants for %r (start=%s)", len(variants), product_name, start, extra=GOOGLE_LOG_SAMPLED)
+        return variants, None
+
+    # Identical searches already in flight (from this or another request) share one upstream call
+    items, last_error = cse_flight.do(cache_key, request_search_items, params, cache_key)
+    if items:
+        variants = build_search_variants(items, product_name, item_id, start, images_per_item, criteria)
+
+    logger.debug("Returning %s variants for %r, error: %s", len(variants), product_name, last_error, extra=GOOGLE_LOG_SAMPLED)
+    return variants, last_error
+
+def fetch_paged_image_variants(product_name, item_id, sites, images_per_item, filters, start=1, use_cache=True, criteria=None):
+    """Fetch up to images_per_item variants, requesting several CSE pages at once when needed
+
+    Page offsets are fixed (start, start + 10, ...), so pages run concurrently
+    and file names keep their search-position numbering. Pages are merged in
+    order, duplicates are dropped by originalUrl, and pages that are no longer
+    needed are cancelled once enough variants have arrived.
+
+    Returns:
+        tuple: (variants, error_message or None)
+    """
+    if images_per_item <= CSE_PAGE_SIZE:
+        return fetch_image_variants(product_name, item_id, sites, images_per_item, filters,
+                                    start=start, use_cache=use_cache, criteria=criteria)
+
+    pages = []
+    last_wanted = min(start + images_per_item - 1, CSE_MAX_RESULTS)
+    for page_start in range(start, last_wanted + 1, CSE_PAGE_SIZE):
+        pages.append((page_start, min(CSE_PAGE_SIZE, last_wanted - page_start + 1)))
+    if not pages:
+        return [], "Start index is beyond the last available search result"
+
+    logger.debug("Fetching %s CSE pages for %r (images_per_item=%s)", len(pages), product_name, images_per_item, extra=GOOGLE_LOG)
+    variants = []
+    seen_urls = set()
+    last_error = None
+    executor = ThreadPoolExecutor(max_workers=min(CSE_PAGE_CONCURRENCY, len(pages)), thread_name_prefix="cse-page")
+    try:
+        futures = [
+            executor.submit(fetch_image_variants, product_name, item_id, sites, batch_size, filters,
+                            start=page_start, use_cache=use_cache, criteria=criteria)
+            for page_start, batch_size in pages
+        ]
+        for (page_start, batch_size), future in zip(pages, futures):
+            page_variants, page_error = future.result()
+            if page_error:
+                last_error = page_error
+                if not page_variants:
+                    break
+            for v in page_variants:
+                if v["originalUrl"] not in seen_urls:
+                    seen_urls.add(v["originalUrl"])
+                    variants.append(v)
+            if len(variants) >= images_per_item:
+                break
+            # A short page means the results ran out (unless the pre-filter dropped some)
+            if len(page_variants) < batch_size and not criteria:
+                break
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return variants[:images_per_item], last_error
+
+def download_image_from_url(image_url, item_id, url_type="URL1"):
+    """Verify an image URL with a lightweight probe and return variant metadata
+    
+    Args:
+        image_url: URL of the image to download
+        item_id: Item identifier
+        url_type: Type of URL (URL1 or URL2) for labeling
+    
+    Returns:
+        tuple: (variant_dict or None, error_message or None)
+        If successful, returns variant dict. If failed, returns None and error message.
+    """
+    if not image_url or not image_url.strip():
         return None, "Empty URL"
     
     try:
-        # Try to download the image to verify it's accessible
-        r = requests.get(image_url, timeout=10, stream=True)
-        r.raise_for_status()
-        
-        # Check if it's actually an image
-        content_type = r.headers.get("content-type", "").lower()
-        if not content_type.startswith("image/"):
-            return None, f"URL does not point to an image (content-type: {content_type})"
+        # Probe the image (first few KB only) to verify it's accessible and really an image;
+        # concurrent probes of the same URL share one request
+        probe = image_flight.do(("probe", image_url), probe_image, image_url)
+        content_type = probe["content_type"]
+        if not probe["is_image"]:
+            return None, f"URL does not point to an image (content-type: {probe['declared_type']})"
         
-        # Get file extension from content-type or URL
+        # Get file extension from the sniffed content-type
         extension = get_extension_from_headers(content_type, ".jpg")
         
         # Create filename
@@ -335,16 +1693,15 @@ def download_image_from_url(image_url, item_id, url_type="URL1"):
         # Parse source from URL
         parsed_source = ""
         try:
-            from urllib.parse import urlparse
             parsed = urlparse(image_url)
             parsed_source = parsed.netloc.lower().replace("www.", "")
-        except:
+        except Exception:
             parsed_source = "Direct URL"
         
         variant = {
             "fileName": file_name,
             "originalUrl": image_url,
-            "previewUrl": image_url,  # Use same URL for preview
+            "previewUrl": thumbnail_url(image_url),  # Small resized copy for the gallery tile
             "source": parsed_source,
             "shortDescription": f"{url_type} Image",
             "description": f"{url_type} Image from {parsed_source}",
@@ -368,26 +1725,1570 @@ def create_placeholder_variant(item_id, url_type="URL1"):
         url_type: Type of URL (URL1 or URL2) for labeling
     
     Returns:
-        dict: Placeholder variant metadata
+        dict: Placeholder variant metadata
+    """
+    filename_base = re.sub(r'[\\/:*?"<>|]', "", item_id)
+    file_name = f"{filename_base}_{url_type.lower()}_placeholder"
+    
+    return {
+        "fileName": file_name,
+        "originalUrl": "",
+        "previewUrl": "",
+        "source": "Failed",
+        "shortDescription": f"{url_type} Image",
+        "description": f"{url_type} Image - Failed to load",
+        "itemId": item_id,
+        "isPlaceholder": True
+    }
+
+# =============================================================================
+# CONCURRENT PRODUCT DOWNLOADS
+# =============================================================================
+
+class HostLimiter:
+    """Bound the number of simultaneous requests made to any single host"""
+
+    def __init__(self, per_host_limit=DEFAULT_PER_HOST_LIMIT):
+        self.per_host_limit = max(1, int(per_host_limit))
+        self._lock = threading.Lock()
+        self._semaphores = {}
+
+    def slot(self, url):
+        """Return a context manager holding one request slot for the URL's host"""
+        host = urlparse(url).netloc.lower()
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.per_host_limit)
+                self._semaphores[host] = semaphore
+        return semaphore
+
+def host_slot(host_limiter, url):
+    """Acquire a host slot when a limiter is active, otherwise do nothing"""
+    return host_limiter.slot(url) if host_limiter else nullcontext()
+
+def search_product_images(query, images_per_item, filters, host_limiter=None, criteria=None):
+    """Run the Google image search for one download_images query
+
+    With user criteria, a full page of results is requested so the pre-filter
+    has spare candidates to choose from.
+
+    Returns:
+        tuple: (items, error_message or None). items is None when the search failed.
+    """
+    params = {
+        "key": API_KEY_DOWN,
+        "cx": CX,
+        "q": query,
+        "searchType": "image",
+        "num": max(images_per_item, 10) if criteria else images_per_item
+    }
+    if filters:
+        params.update(filters)
+
+    last_error = None
+    for attempt in range(3):
+        if attempt:
+            record_upstream_retry("google_cse")
+        try:
+            allowed, governor_error = cse_governor.acquire()
+            if not allowed:
+                last_error = governor_error
+                break
+            with host_slot(host_limiter, URL_DOWN):
+                r = http_client("google_cse").get(URL_DOWN, params=params, timeout=15)
+            if r.status_code == 429:
+                last_error = "Rate limited (429) - retrying"
+                cse_governor.backoff(attempt, r.headers.get("Retry-After"))
+                continue
+            r.raise_for_status()
+            return r.json().get("items", []), None
+        except requests.exceptions.Timeout:
+            last_error = "Timeout - retrying"
+        except requests.exceptions.RequestException as e:
+            last_error = f"API error: {str(e)[:60]}"
+            break
+
+    return None, last_error
+
+def download_criteria(criteria):
+    """Merge user criteria with the checks download_images applies after downloading anyway"""
+    merged = {"min_bytes": MIN_IMAGE_BYTES, "min_gif_bytes": MIN_GIF_BYTES}
+    merged.update(criteria or {})
+    return merged
+
+def fetch_product_images(items, images_per_item, host_limiter=None, criteria=None):
+    """Download search results until images_per_item valid images are collected
+
+    Items whose metadata already fails the checks are skipped without a download.
+
+    Returns:
+        list: dicts with "body" (ImageBody), "ext" and "url" for each accepted image, in
+        search order (or ranked order when criteria ask for ranking)
+    """
+    images = []
+    merged_criteria = download_criteria(criteria)
+    candidates = rank_search_items(items, merged_criteria)
+    # A body past the user's max_bytes would be rejected anyway, so stop reading it there
+    max_bytes = min(IMAGE_MAX_BYTES, merged_criteria.get("max_bytes") or IMAGE_MAX_BYTES)
+    search_idx = 0
+
+    while len(images) < images_per_item and search_idx < len(candidates):
+        item = candidates[search_idx][1]
+        search_idx += 1
+        img_url = item["link"]
+
+        try:
+            body = read_image_body(img_url, max_bytes=max_bytes, host_limiter=host_limiter)
+
+            if body.size < MIN_IMAGE_BYTES:
+                continue
+
+            if "gif" in body.content_type and body.size < MIN_GIF_BYTES:
+                continue
+
+            ext = os.path.splitext(item.get("image", {}).get("thumbnailLink", ""))[1]
+            if ext.lower() not in {'.jpg','.jpeg','.png','.gif','.webp'}:
+                ext = ".jpg"
+
+            images.append({"body": body, "ext": ext, "url": img_url})
+        except Exception:
+            continue
+
+    return images
+
+def collect_product_images(query, images_per_item, filters, host_limiter=None, criteria=None):
+    """Search and download the images for one product (safe to run in a worker thread)"""
+    items, last_error = search_product_images(query, images_per_item, filters, host_limiter, criteria)
+    if items is None:
+        return {"success": False, "last_error": last_error, "images": []}
+    return {
+        "success": True,
+        "last_error": None,
+        "images": fetch_product_images(items, images_per_item, host_limiter, criteria)
+    }
+
+def iter_product_results(queries, images_per_item, filters, parallel=False,
+                         max_workers=DEFAULT_MAX_WORKERS, per_host_limit=DEFAULT_PER_HOST_LIMIT, criteria=None):
+    """Yield collect_product_images results in the same order as queries
+
+    In parallel mode products run on a bounded worker pool with a per-host
+    request limit; results are still yielded in input order.
+    """
+    if not parallel or len(queries) < 2:
+        for q in queries:
+            yield collect_product_images(q, images_per_item, filters, criteria=criteria)
+        return
+
+    host_limiter = HostLimiter(per_host_limit)
+    workers = max(1, min(int(max_workers), MAX_WORKERS_LIMIT, len(queries)))
+    log_to_console(f"Parallel download: {len(queries)} products, {workers} workers, {host_limiter.per_host_limit} per host")
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="download") as executor:
+        futures = [
+            executor.submit(collect_product_images, q, images_per_item, filters, host_limiter, criteria)
+            for q in queries
+        ]
+        for future in futures:
+            yield future.result()
+
+def unique_file_name(base_fn, used_names):
+    """Return base_fn, or base_fn with a _copyN suffix if the name is already taken"""
+    final_fn = base_fn
+    counter = 1
+    while final_fn in used_names:
+        name, e = os.path.splitext(base_fn)
+        final_fn = f"{name}_copy{counter}{e}"
+        counter += 1
+    used_names.add(final_fn)
+    return final_fn
+
+def parse_download_options(data):
+    """Validate a download_images payload
+
+    Returns:
+        tuple: (options dict or None, error_message or None)
+    """
+    products = data.get('products', [])
+    if not products:
+        return None, "No products provided"
+
+    filters, filter_error = parse_image_filters(data.get('image_filters', '').strip())
+    if filter_error:
+        return None, filter_error
+
+    criteria, criteria_error = parse_image_criteria(data)
+    if criteria_error:
+        return None, criteria_error
+
+    sites = clean_sites(data.get('sites', DEFAULT_SITES))
+    site_query = " OR ".join(f"site:{s}" for s in sites)
+
+    return {
+        "queries": [f"{p} ({site_query})" for p in products],
+        "images_per_item": int(data.get('images_per_item', DEFAULT_IMAGES_PER_ITEM)),
+        "prefix": data.get('prefix', DEFAULT_PREFIX).strip(),
+        "item_numbers": data.get('item_numbers', []),
+        "filters": filters,
+        "criteria": criteria,
+        "parallel": bool(data.get('parallel', False)),  # Opt-in concurrent product fan-out
+        "max_workers": int(data.get('max_workers', DEFAULT_MAX_WORKERS)),
+        "per_host_limit": int(data.get('per_host_limit', DEFAULT_PER_HOST_LIMIT))
+    }, None
+
+def iter_download_results(options):
+    return iter_product_results(
+        options["queries"], options["images_per_item"], options["filters"],
+        parallel=options["parallel"], max_workers=options["max_workers"], per_host_limit=options["per_host_limit"],
+        criteria=options.get("criteria")
+    )
+
+DOWNLOAD_CSV_HEADERS = [
+    "ItemId", "ShortDescription", "Description", "ImageUrl",
+    "", "", "", "", "", "", "", "", "", "", "", "Source"
+]
+
+def assemble_download_rows(queries, product_results, images_per_item, item_numbers, prefix, csv_rows):
+    """Build download_images CSV rows in query order, yielding (file_name, ImageBody) per image
+
+    Rows (including FAILED/DL_FAILED placeholders and trailing unused item
+    numbers) are appended to csv_rows as products are consumed.
+    """
+    item_counter = 0
+    used_names = set()
+
+    # Rows are assembled in query order, so item_counter numbering is the same in serial and parallel modes
+    for q, result in zip(queries, product_results):
+        original_name = q.split(" (")[0].strip()
+        clean_name = re.sub(r'[\\/:*?"<>|]', "", original_name).strip().replace(" ", "_")
+        item_counter += 1
+
+        if not result["success"]:
+            for i in range(1, images_per_item + 1):
+                row = [""] * 16
+                if item_counter <= len(item_numbers):
+                    row[0] = item_numbers[item_counter - 1]
+                row[1] = original_name
+                row[2] = original_name
+                row[3] = f"FAILED: {result['last_error'] or 'Unknown'}"
+                csv_rows.append(row)
+            continue
+
+        valid_count = 0
+
+        for image in result["images"]:
+            final_fn = unique_file_name(f"{clean_name}_v{valid_count + 1}{image['ext']}", used_names)
+
+            public_url = prefix + final_fn if prefix else ""
+            item_id = item_numbers[item_counter - 1] if item_counter <= len(item_numbers) else f"ITEM{item_counter:03d}"
+
+            row = [""] * 16
+            row[0] = item_id
+            row[1] = original_name
+            row[2] = original_name
+            row[3] = public_url
+            row[15] = urlparse(image["url"]).netloc.lower().replace("www.", "")
+            csv_rows.append(row)
+
+            valid_count += 1
+            yield final_fn, image["body"]
+
+        while valid_count < images_per_item:
+            row = [""] * 16
+            if item_counter <= len(item_numbers):
+                row[0] = item_numbers[item_counter - 1]
+            row[1] = original_name
+            row[2] = original_name
+            row[3] = "DL_FAILED: No valid image"
+            csv_rows.append(row)
+            valid_count += 1
+            item_counter += 1
+
+    for i in range(item_counter, len(item_numbers) + 1):
+        if i > len(item_numbers):
+            break
+        row = [""] * 16
+        row[0] = item_numbers[i - 1]
+        row[1] = ""
+        row[2] = ""
+        row[3] = ""
+        csv_rows.append(row)
+
+def render_download_csv(csv_rows):
+    """Render download_images rows (with headers) as CSV text"""
+    import csv
+    csv_buffer = io.StringIO()
+    w = csv.writer(csv_buffer)
+    w.writerow(DOWNLOAD_CSV_HEADERS)
+    w.writerows(csv_rows)
+    csv_content = csv_buffer.getvalue()
+    csv_buffer.close()
+    return csv_content
+
+def count_downloaded_images(csv_rows):
+    return len([r for r in csv_rows if r[3] and not r[3].startswith("FAILED") and not r[3].startswith("DL_FAILED")])
+
+# =============================================================================
+# ZIP ARCHIVE STREAMING
+# =============================================================================
+
+ZIP_STREAM_CHUNK_SIZE = 64 * 1024
+ZIP_MANIFEST_NAME = "manifest.json"
+
+class ZipStreamBuffer(io.RawIOBase):
+    """Write-only, unseekable sink so zipfile emits data descriptors and can stream
+
+    zipfile writes into the buffer and the response generator drains it after
+    every chunk, so at most one chunk of compressed output is held at a time.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def iter_zip_stream(entries):
+    """Yield ZIP archive bytes while entries are written
+
+    Args:
+        entries: iterable of (arcname, iterable of bytes chunks). Entries are
+            consumed lazily, so each one is compressed as its bytes arrive.
+    """
+    import zipfile
+    sink = ZipStreamBuffer()
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as zipf:
+        for arcname, chunks in entries:
+            zinfo = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+            zinfo.compress_type = zipfile.ZIP_DEFLATED
+            with zipf.open(zinfo, "w") as dest:
+                for chunk in chunks:
+                    dest.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    yield sink.drain()
+
+def zip_stream_response(entries, zip_filename, headers=None):
+    """Wrap a streamed archive in an application/zip attachment response"""
+    response_headers = {"Content-Disposition": f'attachment; filename="{zip_filename}"'}
+    response_headers.update(headers or {})
+    return Response(
+        stream_with_context(iter_zip_stream(entries)),
+        mimetype="application/zip",
+        headers=response_headers
+    )
+
+def stream_download_zip(queries, product_results, images_per_item, item_numbers, prefix):
+    """Stream download_images output as a ZIP of images, the CSV and a trailer manifest"""
+    zip_filename = f"downloaded_items_{uuid.uuid4().hex[:8]}.zip"
+    csv_filename = "imagedownload.csv"
+
+    def entries():
+        csv_rows = []
+        for final_fn, body in assemble_download_rows(queries, product_results, images_per_item, item_numbers, prefix, csv_rows):
+            yield final_fn, body.chunks()
+        yield csv_filename, (render_download_csv(csv_rows).encode("utf-8"),)
+        manifest = {
+            "success": True,
+            "zip_filename": zip_filename,
+            "csv_filename": csv_filename,
+            "row_count": len(csv_rows),
+            "image_count": count_downloaded_images(csv_rows)
+        }
+        yield ZIP_MANIFEST_NAME, (json.dumps(manifest, indent=2).encode("utf-8"),)
+        log_to_console(f"Streamed images for {len(queries)} products, CSV with {len(csv_rows)} rows in ZIP package {zip_filename}")
+
+    return zip_stream_response(entries(), zip_filename, {
+        "X-Product-Count": str(len(queries)),
+        "X-Manifest-Entry": ZIP_MANIFEST_NAME
+    })
+
+def gallery_image_name(file_name, content_type):
+    """Make a gallery selection's fileName end with the extension of its content-type"""
+    extension = get_extension_from_headers(content_type, ".jpg")
+    if not file_name.lower().endswith(extension):
+        file_name = re.sub(r'\.[^.]+$', '', file_name)
+        file_name = f"{file_name}{extension}"
+    return file_name
+
+def parse_finalize_selections(selections):
+    """Validate gallery_finalize selections into an itemId -> selection map
+
+    Returns:
+        tuple: (selection_map or None, error_message or None)
+    """
+    if not selections:
+        return None, "No selections were provided."
+    selection_map = {s.get('itemId'): s for s in selections if s.get('itemId')}
+    missing_urls = [item_id for item_id, s in selection_map.items() if not s.get('originalUrl')]
+    if missing_urls:
+        return None, f"No image URL provided for {missing_urls[0]}"
+    return selection_map, None
+
+def stream_gallery_zip(selection_map):
+    """Stream gallery_finalize output, writing each image entry as its bytes arrive"""
+    timestamp = datetime.now().strftime('%y%m%d-%H%M')
+    zip_filename = f"downloaded_items_{timestamp}.zip"
+
+    def entries():
+        written = []
+        failed = []
+        used_names = set()
+        for item_id, selection in selection_map.items():
+            file_name = selection.get('fileName') or item_id
+            try:
+                body = fetch_image_body(selection['originalUrl'])
+            except requests.exceptions.RequestException as e:
+                failed.append({"itemId": item_id, "error": f"Failed to download: {str(e)[:80]}"})
+                continue
+
+            file_name = unique_file_name(gallery_image_name(file_name, body.content_type), used_names)
+            yield file_name, body.chunks()
+            written.append({"itemId": item_id, "fileName": file_name})
+
+        manifest = {
+            "success": not failed,
+            "zip_filename": zip_filename,
+            "image_count": len(written),
+            "images": written,
+            "failed": failed
+        }
+        yield ZIP_MANIFEST_NAME, (json.dumps(manifest, indent=2).encode("utf-8"),)
+        log_to_console(f"Gallery finalize streamed {len(written)} images ({len(failed)} failed) in {zip_filename}", "[API]")
+
+    return zip_stream_response(entries(), zip_filename, {
+        "X-Item-Count": str(len(selection_map)),
+        "X-Manifest-Entry": ZIP_MANIFEST_NAME
+    })
+
+# =============================================================================
+# BACKGROUND JOBS
+# =============================================================================
+
+JOB_TERMINAL_STATES = {"completed", "failed"}
+
+class Job:
+    """A long-running catalog build with an event log and an on-disk artifact directory
+
+    job.json and events.jsonl are written next to the artifacts, so a job can
+    still be polled (read-only) from another worker process until it expires.
+    """
+
+    def __init__(self, kind, job_id=None, live=True):
+        self.id = job_id or uuid.uuid4().hex
+        self.kind = kind
+        self.status = "queued"
+        self.created = time.time()
+        self.updated = self.created
+        self.progress = {"done": 0, "total": 0}
+        self.result = None
+        self.error = None
+        self.events = []
+        self.live = live
+        self.dir = os.path.join(JOB_ARTIFACT_DIR, self.id)
+        self.artifact_dir = os.path.join(self.dir, "artifacts")
+        self._cond = threading.Condition()
+        if live:
+            os.makedirs(self.artifact_dir, exist_ok=True)
+
+    @property
+    def finished(self):
+        return self.status in JOB_TERMINAL_STATES
+
+    def emit(self, event_type, **fields):
+        """Record an event, persist it and wake up any SSE listeners"""
+        with self._cond:
+            event = {"id": len(self.events) + 1, "type": event_type, "time": round(time.time(), 3)}
+            event.update(fields)
+            self.events.append(event)
+            self.updated = time.time()
+            with open(os.path.join(self.dir, "events.jsonl"), "a", encoding="utf-8") as f:
+                f.write(json.dumps(event) + "\n")
+            self._cond.notify_all()
+        return event
+
+    def set_status(self, status, **fields):
+        # The event is appended before the status flips, so a listener that sees
+        # a finished job has already been handed its final event
+        with self._cond:
+            self.emit(status, **fields)
+            self.status = status
+            self.save()
+
+    def set_progress(self, done, total, **fields):
+        self.progress = {"done": done, "total": total}
+        self.save()
+        self.emit("progress", done=done, total=total, **fields)
+
+    def add_artifact(self, name, chunks):
+        """Write an artifact from an iterable of byte chunks and announce it"""
+        name = os.path.basename(name)
+        path = os.path.join(self.artifact_dir, name)
+        size = 0
+        with open(path + ".part", "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+        os.replace(path + ".part", path)
+        self.emit("artifact", name=name, size=size)
+        return name
+
+    def artifacts(self):
+        if not os.path.isdir(self.artifact_dir):
+            return []
+        return sorted(n for n in os.listdir(self.artifact_dir) if not n.endswith(".part"))
+
+    def wait_for_events(self, last_id, timeout):
+        """Return events newer than last_id, waiting up to timeout seconds for one"""
+        if not self.live:
+            pending = [e for e in self.events if e["id"] > last_id]
+            if not pending and not self.finished:
+                time.sleep(min(timeout, 1.0))
+            return pending
+        with self._cond:
+            if len(self.events) <= last_id and not self.finished:
+                self._cond.wait(timeout)
+            return self.events[last_id:]
+
+    def snapshot(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "created": self.created,
+            "updated": self.updated,
+            "progress": self.progress,
+            "result": self.result,
+            "error": self.error,
+            "artifacts": self.artifacts(),
+            "last_event_id": len(self.events)
+        }
+
+    def save(self):
+        self.updated = time.time()
+        path = os.path.join(self.dir, "job.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, job_id):
+        """Read a job written by any process, or None if it does not exist"""
+        if not re.fullmatch(r"[0-9a-f]{32}", job_id or ""):
+            return None
+        job_dir = os.path.join(JOB_ARTIFACT_DIR, job_id)
+        try:
+            with open(os.path.join(job_dir, "job.json"), encoding="utf-8") as f:
+                state = json.load(f)
+            job = cls(state["kind"], job_id=job_id, live=False)
+            for key in ("status", "created", "updated", "progress", "result", "error"):
+                setattr(job, key, state.get(key))
+            events_path = os.path.join(job_dir, "events.jsonl")
+            if os.path.exists(events_path):
+                with open(events_path, encoding="utf-8") as f:
+                    job.events = [json.loads(line) for line in f if line.strip()]
+            return job
+        except (OSError, ValueError, KeyError):
+            return None
+
+class JobManager:
+    """Run jobs on a small worker pool and expire their artifacts after JOB_TTL_SECONDS"""
+
+    def __init__(self, workers=JOB_WORKERS, ttl_seconds=JOB_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+
+    def submit(self, kind, runner, options):
+        self.expire()
+        job = Job(kind)
+        job.save()
+        job.emit("queued")
+        with self._lock:
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, runner, options)
+        log_to_console(f"Job {job.id} queued ({kind})", "[JOB]")
+        return job
+
+    def _run(self, job, runner, options):
+        job.set_status("running")
+        try:
+            job.result = runner(job, options)
+            job.set_status("completed", result=job.result)
+            log_to_console(f"Job {job.id} completed", "[JOB]")
+        except Exception as e:
+            job.error = str(e)
+            job.set_status("failed", error=job.error)
+            log_to_console(f"Job {job.id} failed: {e}", "[ERROR]")
+
+    def get(self, job_id):
+        """Return a live job from this process, or a read-only copy from disk"""
+        self.expire()
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job or Job.load(job_id)
+
+    def expire(self):
+        """Delete jobs (and their artifacts) whose last update is older than the TTL"""
+        now = time.time()
+        if now - self._last_sweep < 60:
+            return
+        self._last_sweep = now
+        cutoff = now - self.ttl_seconds
+        with self._lock:
+            for job_id, job in list(self._jobs.items()):
+                if job.finished and job.updated < cutoff:
+                    del self._jobs[job_id]
+        if not os.path.isdir(JOB_ARTIFACT_DIR):
+            return
+        for job_id in os.listdir(JOB_ARTIFACT_DIR):
+            job_dir = os.path.join(JOB_ARTIFACT_DIR, job_id)
+            try:
+                if os.path.getmtime(os.path.join(job_dir, "job.json")) < cutoff:
+                    shutil.rmtree(job_dir, ignore_errors=True)
+            except OSError:
+                continue
+
+job_manager = JobManager()
+
+def run_download_images_job(job, options):
+    """download_images as a job: each image is stored as an artifact as soon as it is accepted"""
+    queries = options["queries"]
+    job.set_progress(0, len(queries))
+
+    def tracked_results():
+        for done, (q, result) in enumerate(zip(queries, iter_download_results(options)), 1):
+            job.set_progress(done, len(queries), product=q.split(" (")[0].strip(), images=len(result["images"]))
+            yield result
+
+    csv_rows = []
+    for final_fn, body in assemble_download_rows(queries, tracked_results(), options["images_per_item"],
+                                                 options["item_numbers"], options["prefix"], csv_rows):
+        job.add_artifact(final_fn, body.chunks())
+
+    csv_filename = job.add_artifact("imagedownload.csv", (render_download_csv(csv_rows).encode("utf-8"),))
+    return {
+        "csv_filename": csv_filename,
+        "row_count": len(csv_rows),
+        "image_count": count_downloaded_images(csv_rows)
+    }
+
+def run_gallery_finalize_job(job, selection_map):
+    """gallery_finalize as a job: each selected image is streamed straight into an artifact"""
+    written = []
+    failed = []
+    used_names = set()
+    total = len(selection_map)
+    job.set_progress(0, total)
+
+    for done, (item_id, selection) in enumerate(selection_map.items(), 1):
+        file_name = selection.get('fileName') or item_id
+        try:
+            body = fetch_image_body(selection['originalUrl'])
+            file_name = unique_file_name(gallery_image_name(file_name, body.content_type), used_names)
+            job.add_artifact(file_name, body.chunks())
+            written.append({"itemId": item_id, "fileName": file_name})
+        except requests.exceptions.RequestException as e:
+            failed.append({"itemId": item_id, "error": f"Failed to download: {str(e)[:80]}"})
+        job.set_progress(done, total, itemId=item_id)
+
+    return {"image_count": len(written), "images": written, "failed": failed}
+
+JOB_KINDS = {
+    "download_images": (parse_download_options, run_download_images_job),
+    "gallery_finalize": (lambda payload: parse_finalize_selections(payload.get('selections', [])), run_gallery_finalize_job)
+}
+
+# =============================================================================
+# CLOUDINARY UPLOADS
+# =============================================================================
+
+CLOUDINARY_IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp'}
+
+_cloudinary_config_lock = threading.Lock()
+_cloudinary = None
+
+def cloudinary_credentials():
+    """Credentials passed explicitly on every call, so uploads never depend on shared global config"""
+    return {"cloud_name": CLOUD_NAME, "api_key": API_KEY_CLOUD, "api_secret": API_SECRET_CLOUD}
+
+def configure_cloudinary():
+    """Import the Cloudinary SDK and apply its configuration, once per process
+
+    Returns:
+        module: the configured cloudinary package, with uploader, api, exceptions and utils loaded
+    """
+    global _cloudinary
+    if _cloudinary is not None:
+        return _cloudinary
+    with _cloudinary_config_lock:
+        if _cloudinary is None:
+            import cloudinary
+            import cloudinary.api
+            import cloudinary.exceptions
+            import cloudinary.uploader
+            import cloudinary.utils
+            cloudinary.config(**cloudinary_credentials())
+            _cloudinary = cloudinary
+    return _cloudinary
+
+def form_flag(value):
+    """Interpret a multipart form field as a boolean flag"""
+    return str(value or "").strip().lower() in {"1", "true", "yes", "on"}
+
+def filter_image_files(files):
+    """Keep only uploaded files with a supported image extension"""
+    return [f for f in files if any(f.filename.lower().endswith(ext) for ext in CLOUDINARY_IMAGE_EXTENSIONS)]
+
+def cloudinary_public_id(filename_only, upload_folder):
+    """Use folder in public_id: "folder/filename" (without extension), ignoring any client directory path"""
+    name_without_ext = os.path.splitext(filename_only)[0]
+    return f"{upload_folder}/{name_without_ext}" if upload_folder else name_without_ext
+
+cloudinary_manifest = PersistentCache("cloudinary_manifest", CLOUDINARY_MANIFEST_TTL_SECONDS, CLOUDINARY_MANIFEST_MAX_BYTES)
+
+def content_hash(img_file):
+    """MD5 of an uploaded file's bytes (the same digest Cloudinary reports as etag)"""
+    digest = hashlib.md5()
+    img_file.seek(0)
+    for chunk in iter(lambda: img_file.read(1024 * 1024), b""):
+        digest.update(chunk)
+    img_file.seek(0)
+    return digest.hexdigest()
+
+def manifest_key(public_id):
+    return f"{CLOUD_NAME}:public_id:{public_id}"
+
+def record_cloudinary_upload(file_hash, public_id, secure_url):
+    """Remember what public_id now holds, replacing any earlier record
+
+    file_hash None means the stored bytes are unknown (e.g. a preset
+    transformed them), so the next upload to public_id is never skipped.
+    """
+    cloudinary_manifest.set(manifest_key(public_id), {"hash": file_hash, "secure_url": secure_url})
+
+def fetch_cloudinary_resource(cloudinary, public_id):
+    """Admin API details for one resource (the listing endpoint may omit etag), or None"""
+    started = time.perf_counter()
+    try:
+        resource = cloudinary.api.resource(public_id, **cloudinary_credentials())
+        record_upstream_call("cloudinary_admin", time.perf_counter() - started, status=200)
+        return resource
+    except Exception as e:
+        record_upstream_call("cloudinary_admin", time.perf_counter() - started, status=getattr(e, "http_code", None))
+        log_to_console(f"Cloudinary details lookup failed for {public_id}: {str(e)[:120]}", "[WARNING]")
+        return None
+
+def lookup_cloudinary_resources(public_ids):
+    """Fetch existing resources by public_id in batches: {public_id: resource}
+
+    Resources the listing returns without an etag are fetched again from the
+    details endpoint, so every returned resource can be compared by content.
+    Lookup failures (rate limits, missing Admin API rights) only disable the
+    remote check; the local manifest still applies.
+    """
+    cloudinary = configure_cloudinary()
+    found = {}
+    for i in range(0, len(public_ids), CLOUDINARY_LOOKUP_BATCH_SIZE):
+        batch = public_ids[i:i + CLOUDINARY_LOOKUP_BATCH_SIZE]
+        started = time.perf_counter()
+        try:
+            response = cloudinary.api.resources_by_ids(batch, max_results=len(batch), **cloudinary_credentials())
+            record_upstream_call("cloudinary_admin", time.perf_counter() - started, status=200)
+        except Exception as e:
+            record_upstream_call("cloudinary_admin", time.perf_counter() - started, status=getattr(e, "http_code", None))
+            log_to_console(f"Cloudinary existence lookup failed, using local manifest only: {str(e)[:120]}", "[WARNING]")
+            break
+        for resource in response.get("resources", []):
+            if not resource.get("etag"):
+                resource = fetch_cloudinary_resource(cloudinary, resource.get("public_id")) or resource
+            found[resource.get("public_id")] = resource
+    return found
+
+def find_uploaded_copies(targets):
+    """Find targets whose public_id already holds identical bytes
+
+    Args:
+        targets: {key: (content hash, public_id)}
+    Returns:
+        dict: {key: secure_url} for targets that need no upload
+    """
+    skipped = {}
+    unknown = {}
+    for key, (file_hash, public_id) in targets.items():
+        known = cloudinary_manifest.get(manifest_key(public_id))
+        if known and known["hash"] == file_hash:
+            skipped[key] = known["secure_url"]
+        else:
+            unknown[key] = (file_hash, public_id)
+
+    if unknown:
+        resources = lookup_cloudinary_resources(sorted({public_id for _, public_id in unknown.values()}))
+        for key, (file_hash, public_id) in unknown.items():
+            resource = resources.get(public_id)
+            if resource and resource.get("etag") == file_hash:
+                secure_url = resource.get("secure_url") or resource.get("url", "")
+                skipped[key] = secure_url
+                record_cloudinary_upload(file_hash, public_id, secure_url)
+    return skipped
+
+def plan_cloudinary_dedup(image_files, upload_folder):
+    """Hash every file and find the ones whose target public_id already holds identical bytes
+
+    Returns:
+        tuple: ({index: content hash}, {index: secure_url} for files that can be skipped)
+    """
+    hashes = {idx: content_hash(img_file) for idx, img_file in enumerate(image_files, 1)}
+    skipped = find_uploaded_copies({
+        idx: (hashes[idx], cloudinary_public_id(os.path.basename(img_file.filename), upload_folder))
+        for idx, img_file in enumerate(image_files, 1)
+    })
+    if skipped:
+        log_to_console(f"Deduplicated {len(skipped)}/{len(image_files)} files already on Cloudinary")
+    return hashes, skipped
+
+def deduplicated_result(idx, total, img_file, upload_folder, secure_url):
+    filename = img_file.filename
+    filename_only = os.path.basename(filename)
+    return {
+        "filename": filename,
+        "filename_only": filename_only,
+        "cloudinary_url": secure_url,
+        "public_id": cloudinary_public_id(filename_only, upload_folder),
+        "success": True,
+        "status": "deduplicated",
+        "deduplicated": True,
+        "duration": 0.0,
+        "index": idx,
+        "total": total
+    }
+
+def upload_one_to_cloudinary(idx, total, img_file, upload_folder, upload_preset, file_hash=None):
+    """Upload a single file and return its result dict (never raises)
+
+    Safe to run in a worker thread: each FileStorage wraps its own stream and
+    credentials are passed per call.
+    """
+    cloudinary = configure_cloudinary()
+    file_start_time = datetime.now()
+    filename = img_file.filename
+    # Extract just the filename (basename) to ignore any directory structure
+    filename_only = os.path.basename(filename) if filename else "unknown"
+    try:
+        log_to_console(f"Uploading {idx}/{total}: {filename_only} (from {filename})")
+
+        upload_options = {"public_id": cloudinary_public_id(filename_only, upload_folder)}
+        if upload_preset:
+            upload_options['upload_preset'] = upload_preset
+
+        img_file.seek(0)
+        file_content = img_file.read()
+
+        upload_started = time.perf_counter()
+        try:
+            result = cloudinary.uploader.upload(file_content, **upload_options, **cloudinary_credentials())
+        except Exception as e:
+            record_upstream_call("cloudinary_upload", time.perf_counter() - upload_started,
+                                 status=getattr(e, "http_code", None), sent=len(file_content))
+            raise
+        record_upstream_call("cloudinary_upload", time.perf_counter() - upload_started, status=200, sent=len(file_content))
+
+        duration = (datetime.now() - file_start_time).total_seconds()
+        log_to_console(f"✓ Successfully uploaded {idx}/{total}: {filename_only} ({duration:.2f}s)")
+        cloudinary_url = result.get('secure_url') or result.get('url', '')
+        # Every upload replaces the record, or a later dedup check could match the
+        # bytes public_id held before. Presets may transform the asset, so their
+        # uploads keep only the etag Cloudinary reports for what it stored.
+        stored_hash = result.get('etag') or (None if upload_preset else file_hash)
+        record_cloudinary_upload(stored_hash, result.get('public_id', ''), cloudinary_url)
+        return {
+            "filename": filename,
+            "filename_only": filename_only,
+            "cloudinary_url": cloudinary_url,
+            "public_id": result.get('public_id', ''),
+            "success": True,
+            "status": "uploaded",
+            "duration": round(duration, 2),
+            "index": idx,
+            "total": total
+        }
+    except Exception as e:
+        duration = (datetime.now() - file_start_time).total_seconds()
+        error_msg = str(e)
+        label = "Failed to upload" if isinstance(e, cloudinary.exceptions.Error) else "Error uploading"
+        log_to_console(f"✗ {label} {idx}/{total}: {filename_only} ({duration:.2f}s) - {error_msg}", "[ERROR]")
+        return {
+            "filename": filename,
+            "filename_only": filename_only,
+            "error": error_msg,
+            "success": False,
+            "status": "failed",
+            "duration": round(duration, 2),
+            "index": idx,
+            "total": total
+        }
+
+def iter_cloudinary_uploads(image_files, upload_folder, upload_preset, parallel=False,
+                            concurrency=DEFAULT_UPLOAD_CONCURRENCY, dedup=True):
+    """Upload files and yield ("progress", info) when each starts and ("result", result) when it finishes
+
+    With dedup, files whose public_id already holds identical bytes are not
+    re-sent and are reported first with status "deduplicated". In parallel
+    mode at most `concurrency` uploads are in flight and events arrive in
+    completion order; every event carries the file's 1-based index.
+    """
+    total = len(image_files)
+    hashes, skipped = plan_cloudinary_dedup(image_files, upload_folder) if dedup else ({}, {})
+
+    for idx, secure_url in sorted(skipped.items()):
+        yield "result", deduplicated_result(idx, total, image_files[idx - 1], upload_folder, secure_url)
+
+    pending = [(idx, img_file) for idx, img_file in enumerate(image_files, 1) if idx not in skipped]
+
+    if not parallel or len(pending) < 2:
+        for idx, img_file in pending:
+            yield "progress", {"index": idx, "total": total, "filename_only": os.path.basename(img_file.filename)}
+            yield "result", upload_one_to_cloudinary(idx, total, img_file, upload_folder, upload_preset, hashes.get(idx))
+        return
+
+    events = queue.Queue()
+
+    def worker(idx, img_file):
+        events.put(("progress", {"index": idx, "total": total, "filename_only": os.path.basename(img_file.filename)}))
+        events.put(("result", upload_one_to_cloudinary(idx, total, img_file, upload_folder, upload_preset, hashes.get(idx))))
+
+    workers = max(1, min(int(concurrency), MAX_UPLOAD_CONCURRENCY, len(pending)))
+    log_to_console(f"Parallel upload: {len(pending)} files, {workers} in flight")
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cloudinary") as executor:
+        for idx, img_file in pending:
+            executor.submit(worker, idx, img_file)
+        finished = 0
+        while finished < len(pending):
+            event = events.get()
+            if event[0] == "result":
+                finished += 1
+            yield event
+
+def sign_cloudinary_uploads(files, upload_folder, upload_preset, dedup=True):
+    """Issue signed upload parameters so the browser can send files straight to Cloudinary
+
+    Each file is {"filename", "hash" (optional MD5 hex of its bytes)}. The
+    public_id follows the same rules as server-side uploads and is covered by
+    the signature, so the browser cannot change it. With dedup, files whose
+    hash matches what their public_id already holds are answered with the
+    existing URL instead of a signature.
+
+    Returns:
+        dict: upload_url, timestamp, expires_at and one "uploads" entry per file
+        with status "signed" (plus the form fields to post), "deduplicated" or "rejected"
+    """
+    cloudinary = configure_cloudinary()
+    timestamp = int(time.time())
+    uploads = []
+    targets = {}
+    for idx, entry in enumerate(files, 1):
+        filename = str((entry or {}).get("filename") or "")
+        filename_only = os.path.basename(filename)
+        upload = {"index": idx, "filename": filename}
+        uploads.append(upload)
+        if not filename_only or not any(filename_only.lower().endswith(ext) for ext in CLOUDINARY_IMAGE_EXTENSIONS):
+            upload.update(status="rejected", error="Not a supported image file. Supported formats: JPG, PNG, GIF, WebP, BMP")
+            continue
+        upload["public_id"] = cloudinary_public_id(filename_only, upload_folder)
+        file_hash = str(entry.get("hash") or "").lower()
+        if dedup and re.fullmatch(r"[0-9a-f]{32}", file_hash):
+            targets[idx] = (file_hash, upload["public_id"])
+
+    skipped = find_uploaded_copies(targets) if targets else {}
+    for upload in uploads:
+        if "public_id" not in upload:
+            continue
+        if upload["index"] in skipped:
+            upload.update(status="deduplicated", cloudinary_url=skipped[upload["index"]])
+            continue
+        params = {"public_id": upload["public_id"], "timestamp": timestamp}
+        if upload_preset:
+            params["upload_preset"] = upload_preset
+        signature = cloudinary.utils.api_sign_request(params, API_SECRET_CLOUD)
+        upload.update(status="signed", fields=dict(params, signature=signature, api_key=API_KEY_CLOUD))
+        # The browser may overwrite public_id without reporting back, so stop trusting its record
+        record_cloudinary_upload(None, upload["public_id"], "")
+
+    return {
+        "upload_url": cloudinary.utils.cloudinary_api_url("upload", resource_type="image", cloud_name=CLOUD_NAME),
+        "timestamp": timestamp,
+        "expires_at": timestamp + CLOUDINARY_SIGNATURE_TTL_SECONDS,
+        "uploads": uploads
+    }
+
+def verify_direct_upload(result):
+    """Check the signature on a Cloudinary upload response relayed by the browser
+
+    Returns:
+        str or None: error message, or None when the signature is ours
+    """
+    cloudinary = configure_cloudinary()
+    public_id = str(result.get("public_id") or "")
+    version = result.get("version")
+    if not public_id or not version or not result.get("signature"):
+        return "public_id, version and signature are required"
+    expected = cloudinary.utils.api_sign_request({"public_id": public_id, "version": version}, API_SECRET_CLOUD)
+    if not hmac.compare_digest(expected, str(result["signature"])):
+        return "Signature does not match"
+    return None
+
+def record_direct_uploads(public_ids):
+    """Add verified direct uploads to the manifest
+
+    The signature only covers public_id and version, so the etag and URL are
+    taken from Cloudinary itself rather than from the browser. Uploads the
+    lookup cannot see are left out of the manifest.
+    """
+    resources = lookup_cloudinary_resources(public_ids)
+    for public_id in public_ids:
+        resource = resources.get(public_id) or {}
+        if resource.get("etag") and resource.get("secure_url"):
+            record_cloudinary_upload(resource["etag"], public_id, resource["secure_url"])
+
+# =============================================================================
+# WMS BULK IMPORT
+# =============================================================================
+
+def wm_item_from_row(row):
+    """Convert one CSV row (ItemId, ShortDescription, Description, ImageUrl, ...) into a bulkImport item
+
+    Returns:
+        tuple: (item dict or None, error_message or None)
+    """
+    if len(row) < 4:
+        return None, f"Expected at least 4 columns, found {len(row)}"
+    if not row[0].strip():
+        return None, "Missing ItemId"
+    if not row[3].strip():
+        return None, "Missing ImageUrl"
+    return {
+        "ItemId": row[0].strip(),
+        "ShortDescription": row[1].strip(),
+        "Description": row[2].strip(),
+        "ImageUrl": row[3].strip()
+    }, None
+
+def build_wm_payload(csv_data):
+    """Convert CSV rows into bulkImport items, keeping rows with an ItemId and ImageUrl"""
+    data_payload = []
+    for row in csv_data:
+        item, _ = wm_item_from_row(row)
+        if item:
+            data_payload.append(item)
+    return data_payload
+
+class WmCsvIngest:
+    """Parse an uploaded item CSV incrementally into bulkImport items
+
+    items() reads one row at a time from a text stream, so it can be handed
+    straight to ChunkedBulkImporter.run and only in-flight chunks are held in
+    memory. A header row and blank rows are skipped. Invalid rows are counted
+    and the first WM_CSV_MAX_REJECTED_ROWS are kept with their line numbers.
+    """
+
+    def __init__(self, text_stream):
+        self.text_stream = text_stream
+        self.rows = 0
+        self.rejected = []
+        self.rejected_count = 0
+
+    def items(self):
+        import csv
+        reader = csv.reader(self.text_stream)
+        first = True
+        while True:
+            line = reader.line_num + 1  # Where this record starts; quoted fields may span lines
+            try:
+                row = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as e:
+                raise ValueError(f"CSV line {line}: {e}")
+            if not any(cell.strip() for cell in row):
+                continue
+            if first:
+                first = False
+                if row[0].strip().lower() in WM_CSV_HEADER_NAMES:
+                    continue
+            self.rows += 1
+            item, error = wm_item_from_row(row)
+            if item:
+                yield item
+                continue
+            self.rejected_count += 1
+            if len(self.rejected) < WM_CSV_MAX_REJECTED_ROWS:
+                self.rejected.append({"line": line, "itemId": row[0].strip(), "error": error})
+
+    def report(self):
+        return {"rows_read": self.rows, "rejected_count": self.rejected_count, "rejected_rows": self.rejected}
+
+def wm_headers(org, token):
+    return {
+        "Authorization": f"Bearer {token}",
+        "Content-Type": "application/json",
+        "selectedOrganization": org.upper(),
+        "selectedLocation": f"{org.upper()}-DM1"
+    }
+
+def parse_bulk_import_response(r):
+    """Extract (success, messages, exceptions) from a bulkImport response"""
+    success = False
+    messages = []
+    exceptions = []
+    try:
+        resp_json = r.json()
+        success = bool(resp_json.get("success"))
+        msg_list = resp_json.get("messages", {}).get("Message", [])
+        messages = [m.get("Description", "") for m in msg_list if m.get("Description")]
+        exceptions = [
+            f"{e.get('messageKey', 'Error')}: {e.get('message', '')}"
+            for e in resp_json.get("exceptions", [])
+        ]
+    except Exception:
+        messages = [r.text[:500]]
+    return success, messages, exceptions
+
+def chunked_import_options(data):
+    """Read chunked import settings from a request payload (JSON, form fields or query parameters)"""
+    stop_on_first_error = data.get('stop_on_first_error', False)
+    return {
+        "batch_size": int(data.get('batch_size') or DEFAULT_WM_BATCH_SIZE),
+        "max_in_flight": int(data.get('max_in_flight') or DEFAULT_WM_IN_FLIGHT),
+        "max_retries": int(data.get('max_retries', WM_CHUNK_RETRIES)),
+        "stop_on_first_error": form_flag(stop_on_first_error) if isinstance(stop_on_first_error, str) else bool(stop_on_first_error)
+    }
+
+def post_bulk_import_chunk(items, headers, stop_on_first_error=False):
+    """Send one bulkImport request and describe the outcome (never raises)"""
+    started = time.perf_counter()
+    result = {
+        "count": len(items),
+        "status_code": None,
+        "success": False,
+        "trace_id": "N/A",
+        "messages": [],
+        "exceptions": [],
+        "retryable": False,
+        "requires_reauth": False,
+        "error": None
+    }
+    try:
+        r = http_client("wms_api").post(
+            BULK_IMPORT_BASE_URL,
+            params={"stopOnFirstError": "true" if stop_on_first_error else "false"},
+            json={"Data": items},
+            headers=headers,
+            timeout=60,
+            verify=False
+        )
+        result["status_code"] = r.status_code
+        result["trace_id"] = r.headers.get("CP-TRACE-ID", "N/A")
+        if r.status_code == 401:
+            result["requires_reauth"] = True
+            result["error"] = "Token expired"
+        elif r.status_code == 429 or r.status_code >= 500:
+            result["retryable"] = True
+            result["error"] = f"HTTP {r.status_code}"
+        else:
+            result["success"], result["messages"], result["exceptions"] = parse_bulk_import_response(r)
+    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+        result["retryable"] = True
+        result["error"] = f"Request failed: {str(e)[:80]}"
+    except Exception as e:
+        result["error"] = f"Error: {str(e)[:80]}"
+    result["duration"] = round(time.perf_counter() - started, 3)
+    return result
+
+class ChunkedBulkImporter:
+    """Send bulkImport items as concurrent chunks, shrinking batches when WMS struggles
+
+    Slow or failed chunks halve the batch size for later chunks (down to
+    MIN_WM_BATCH_SIZE); healthy chunks grow it back toward the requested size.
+    Retryable failures (timeouts, 429, 5xx) are split to the current size and
+    retried up to max_retries times. Items are pulled from the source iterable
+    lazily, so only in-flight chunks are held in memory. A 401 refreshes the
+    ORG token once (shared by all chunks) and re-sends the chunk.
+    """
+
+    MAX_TOKEN_REFRESHES = 2
+
+    def __init__(self, org, token, batch_size=DEFAULT_WM_BATCH_SIZE, max_in_flight=DEFAULT_WM_IN_FLIGHT,
+                 max_retries=WM_CHUNK_RETRIES, stop_on_first_error=False):
+        self.org = org
+        self.token = token
+        self.target_size = max(MIN_WM_BATCH_SIZE, min(int(batch_size), MAX_WM_BATCH_SIZE))
+        self.current_size = self.target_size
+        self.max_in_flight = max(1, min(int(max_in_flight), MAX_WM_IN_FLIGHT))
+        self.max_retries = max(0, int(max_retries))
+        self.stop_on_first_error = stop_on_first_error
+        self.total = 0
+        self.failed_count = 0
+        self.trace_ids = []
+        self.messages = []
+        self.exceptions = []
+        self.chunks = []
+        self.requires_reauth = False
+        self.token_refreshes = 0
+
+    def _refresh_token(self, token_used):
+        """Make sure self.token is newer than token_used; False if no fresh token is available"""
+        if self.token != token_used:
+            return True
+        if self.token_refreshes >= self.MAX_TOKEN_REFRESHES:
+            return False
+        self.token_refreshes += 1
+        new_token = get_manhattan_token(self.org, stale_token=token_used)
+        if not new_token or new_token == token_used:
+            return False
+        self.token = new_token
+        return True
+
+    def _adapt(self, result):
+        if not result["success"] or result["duration"] > WM_SLOW_CHUNK_SECONDS:
+            self.current_size = max(MIN_WM_BATCH_SIZE, self.current_size // 2)
+        else:
+            self.current_size = min(self.target_size, self.current_size + max(1, self.target_size // 4))
+
+    def _record(self, chunk_id, items, attempt, result):
+        failed = len(result["exceptions"]) if result["success"] else len(items)
+        self.total += len(items)
+        self.failed_count += failed
+        if result["trace_id"] != "N/A" and result["trace_id"] not in self.trace_ids:
+            self.trace_ids.append(result["trace_id"])
+        self.messages.extend(result["messages"])
+        self.exceptions.extend(result["exceptions"])
+        if result["error"] and not result["exceptions"]:
+            self.exceptions.append(f"Chunk {chunk_id}: {result['error']}")
+        chunk = {
+            "chunk": chunk_id,
+            "count": len(items),
+            "success": result["success"],
+            "failed_count": failed,
+            "status_code": result["status_code"],
+            "trace_id": result["trace_id"],
+            "attempts": attempt,
+            "duration": result["duration"],
+            "error": result["error"]
+        }
+        self.chunks.append(chunk)
+        return dict(chunk, processed=self.total, next_batch_size=self.current_size)
+
+    def run(self, items):
+        """Import items, yielding ("chunk", info) per finished chunk and ("retry"/"reauth", info) per re-send"""
+        source = iter(items)
+        retry_queue = deque()
+        in_flight = {}
+        next_index = 1
+        exhausted = False
+
+        with ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="wms") as executor:
+            while True:
+                while not self.requires_reauth and len(in_flight) < self.max_in_flight:
+                    if retry_queue:
+                        chunk_id, batch, attempt = retry_queue.popleft()
+                    elif not exhausted:
+                        batch = list(islice(source, self.current_size))
+                        if not batch:
+                            exhausted = True
+                            continue
+                        chunk_id, attempt = str(next_index), 1
+                        next_index += 1
+                    else:
+                        break
+                    future = executor.submit(post_bulk_import_chunk, batch, wm_headers(self.org, self.token), self.stop_on_first_error)
+                    in_flight[future] = (chunk_id, batch, attempt, self.token)
+
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    chunk_id, batch, attempt, token_used = in_flight.pop(future)
+                    result = future.result()
+
+                    if result["requires_reauth"]:
+                        if self._refresh_token(token_used):
+                            retry_queue.appendleft((chunk_id, batch, attempt))
+                            record_upstream_retry("wms_api")
+                            yield "reauth", {"chunk": chunk_id, "attempt": attempt}
+                            continue
+                        self.requires_reauth = True
+                        yield "chunk", self._record(chunk_id, batch, attempt, result)
+                        continue
+
+                    self._adapt(result)
+                    if result["retryable"] and attempt <= self.max_retries:
+                        pieces = [batch[i:i + self.current_size] for i in range(0, len(batch), self.current_size)]
+                        for n, piece in enumerate(pieces, 1):
+                            piece_id = chunk_id if len(pieces) == 1 else f"{chunk_id}.{n}"
+                            retry_queue.append((piece_id, piece, attempt + 1))
+                        record_upstream_retry("wms_api")
+                        yield "retry", {"chunk": chunk_id, "attempt": attempt, "error": result["error"], "split_into": len(pieces)}
+                        continue
+
+                    yield "chunk", self._record(chunk_id, batch, attempt, result)
+
+        if self.requires_reauth:
+            # Anything not yet sent is reported as failed so totals still add up
+            for chunk_id, batch, _ in retry_queue:
+                self.total += len(batch)
+                self.failed_count += len(batch)
+            unsent = sum(1 for _ in source)
+            self.total += unsent
+            self.failed_count += unsent
+
+    def summary(self):
+        result = {
+            "success": not self.requires_reauth and all(c["success"] for c in self.chunks),
+            "total": self.total,
+            "success_count": self.total - self.failed_count,
+            "failed_count": self.failed_count,
+            "trace_id": ", ".join(self.trace_ids) or "N/A",
+            "trace_ids": self.trace_ids,
+            "messages": self.messages,
+            "exceptions": self.exceptions,
+            "chunks": self.chunks
+        }
+        if self.requires_reauth:
+            result.update({"error": "Token expired", "requires_reauth": True})
+        elif self.token_refreshes:
+            result["token"] = self.token  # Lets the browser replace its expired token
+        return result
+
+# =============================================================================
+# PRODUCT GENERATION (xAI Grok)
+# =============================================================================
+
+# Rough share of product names starting with each letter, used to size alphabetical shards
+GEN_LETTER_WEIGHTS = {
+    "A": 6, "B": 6, "C": 9, "D": 5, "E": 4, "F": 4, "G": 4, "H": 4, "I": 3, "J": 1, "K": 2, "L": 4, "M": 6,
+    "N": 3, "O": 3, "P": 7, "Q": 0.5, "R": 5, "S": 11, "T": 6, "U": 1.5, "V": 2, "W": 3, "X": 0.2, "Y": 0.5, "Z": 0.5
+}
+
+generate_cache = PersistentCache("generate_items", GENERATE_CACHE_TTL_SECONDS, GENERATE_CACHE_MAX_BYTES)
+
+def generate_cache_key(company, website, extra_prompt):
+    """Cache key for a product list; count is left out so one large list can serve smaller counts"""
+    normalized = {
+        "company": " ".join(company.lower().split()),
+        "website": clean_url(website).rstrip("/"),
+        "extra_prompt": " ".join(extra_prompt.split()),
+        "model": MODEL,
+        "temperature": GEN_TEMPERATURE
+    }
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode("utf-8")).hexdigest()
+
+def spread_sample(items, count):
+    """Up to count evenly spaced items, so a trimmed sorted list still spans the whole alphabet"""
+    if len(items) <= count:
+        return list(items)
+    return [items[i * len(items) // count] for i in range(count)]
+
+def cached_product_list(cache_key, count):
+    """Serve count products from a cached list holding at least that many
+
+    A list that came back short is only a hit for counts it can fill. Smaller
+    counts take an evenly spaced slice of the sorted list, so they still span
+    the whole alphabet.
+
+    Returns:
+        tuple: (product names or None on a miss, cache entry)
+    """
+    entry = generate_cache.get(cache_key, accept=lambda cached: len(cached["products"]) >= count)
+    if not entry:
+        return None, None
+    return spread_sample(entry["products"], count), entry
+
+def build_product_prompt(count, company_ref, extra_prompt, letters=None, exclude=()):
+    """The generate_items prompt, optionally limited to a letter range and excluding known names"""
+    scope = ""
+    if letters:
+        first, last = letters
+        scope = f" whose names start with {'a digit or ' if first == 'A' else ''}a letter from {first} to {last}"
+    prompt = f"""Return a Python list of exactly {count} {company_ref} products{scope} as strings, in this exact format:
+
+["Product1", "Product2", "Product3", ..., "Product{count}"]
+
+- Sort alphabetically
+- Double quotes
+- Comma + space
+- No extra text
+- One per entry
+- Natural spaces (e.g., "Running Shoe")"""
+
+    if exclude:
+        prompt += "\n- Do not repeat any of these: " + json.dumps(list(exclude))
+    if extra_prompt:
+        prompt += f"\n\n{extra_prompt}"
+    return prompt
+
+def parse_product_list(content, truncated=False):
+    """Pull product names out of a completion, or None if it holds no list
+
+    A truncated completion has no closing bracket; its names are kept except
+    the last one, which may be cut off.
+    """
+    list_match = re.search(r'\[\s*(.*?)\s*\]', content, re.DOTALL)
+    if list_match:
+        body = list_match.group(1)
+    elif truncated and "[" in content:
+        body = content.split("[", 1)[1].rsplit(",", 1)[0]
+    else:
+        return None
+    return [item.strip().strip('"\'') for item in re.split(r'\s*,\s*', body) if item.strip().strip('"\'')]
+
+def request_product_list(prompt):
+    """Run one chat completion and parse its product list
+
+    Returns:
+        list or None: product names (None when the reply holds no list)
+    Raises:
+        requests.exceptions.RequestException on network or HTTP errors
+    """
+    response = http_client("xai").post(
+        f"{BASE_URL_GEN}/chat/completions",
+        headers={"Authorization": f"Bearer {API_KEY_GEN}"},
+        json={
+            "model": MODEL,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": GEN_TEMPERATURE,
+            "max_tokens": GEN_MAX_TOKENS
+        },
+        timeout=60
+    )
+    response.raise_for_status()
+    choice = response.json()["choices"][0]
+    return parse_product_list(choice["message"]["content"].strip(), truncated=choice.get("finish_reason") == "length")
+
+def plan_letter_shards(shard_count):
+    """Split A-Z into shard_count contiguous ranges of roughly equal GEN_LETTER_WEIGHTS
+
+    Returns:
+        list: ((first, last), weight share) per shard
+    """
+    letters = list(GEN_LETTER_WEIGHTS)
+    shard_count = max(1, min(shard_count, len(letters)))
+    total = sum(GEN_LETTER_WEIGHTS.values())
+    shards = []
+    start = 0
+    for n in range(shard_count):
+        remaining_shards = shard_count - n
+        target = sum(GEN_LETTER_WEIGHTS[l] for l in letters[start:]) / remaining_shards
+        end = start
+        weight = GEN_LETTER_WEIGHTS[letters[end]]
+        # Leave at least one letter for every shard still to come
+        while end + 1 < len(letters) - (remaining_shards - 1) and weight + GEN_LETTER_WEIGHTS[letters[end + 1]] / 2 <= target:
+            end += 1
+            weight += GEN_LETTER_WEIGHTS[letters[end]]
+        if remaining_shards == 1:
+            end = len(letters) - 1
+            weight = sum(GEN_LETTER_WEIGHTS[l] for l in letters[start:])
+        shards.append(((letters[start], letters[end]), weight / total))
+        start = end + 1
+    return shards
+
+def generate_products_sharded(count, company_ref, extra_prompt):
+    """Generate a large product list from concurrent alphabetical shards
+
+    Every shard asks for its share of count within its letter range. Results
+    are merged, de-duplicated case-insensitively, sorted and trimmed evenly
+    to count. Names still
+    missing are re-requested from the shards that delivered in full (they
+    have room left), excluding what they already returned.
+
+    Returns:
+        tuple: (sorted product names, possibly fewer than count; completions requested)
     """
-    filename_base = re.sub(r'[\\/:*?"<>|]', "", item_id)
-    file_name = f"{filename_base}_{url_type.lower()}_placeholder"
-    
-    return {
-        "fileName": file_name,
-        "originalUrl": "",
-        "previewUrl": "",
-        "source": "Failed",
-        "shortDescription": f"{url_type} Image",
-        "description": f"{url_type} Image - Failed to load",
-        "itemId": item_id,
-        "isPlaceholder": True
-    }
+    shards = plan_letter_shards(math.ceil(count / GEN_SHARD_SIZE))
+    found = {}  # lowercased name -> name as first returned
+    returned = {letters: [] for letters, _ in shards}
+    requests_made = 0
+    last_error = None
+
+    def run_round(asks):
+        nonlocal requests_made, last_error
+        delivered = set()
+        workers = max(1, min(len(asks), GEN_SHARD_CONCURRENCY))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="generate") as executor:
+            futures = {
+                executor.submit(request_product_list, build_product_prompt(n, company_ref, extra_prompt, letters, returned[letters])): (letters, n)
+                for letters, n in asks
+            }
+            requests_made += len(futures)
+            for future in futures:
+                letters, n = futures[future]
+                try:
+                    names = future.result() or []
+                except Exception as e:
+                    last_error = e
+                    log_to_console(f"Product shard {letters[0]}-{letters[1]} failed: {str(e)[:80]}", "[WARNING]")
+                    continue
+                returned[letters].extend(names)
+                for name in names:
+                    found.setdefault(name.lower(), name)
+                if len(names) >= n:
+                    delivered.add(letters)
+        return delivered
+
+    asks = [(letters, min(GEN_SHARD_MAX_NAMES, max(5, math.ceil(count * share * GEN_SHARD_OVERSHOOT)))) for letters, share in shards]
+    delivered = run_round(asks)
+    if not found and last_error:
+        raise last_error
+
+    for _ in range(GEN_TOP_UP_ROUNDS):
+        missing = count - len(found)
+        if missing <= 0:
+            break
+        # Shards that came up short have probably run out of names in their range
+        candidates = [(letters, share) for letters, share in shards if letters in delivered] or shards
+        candidate_share = sum(share for _, share in candidates)
+        asks = [
+            (letters, min(GEN_SHARD_MAX_NAMES, max(5, math.ceil(missing * share / candidate_share * GEN_SHARD_OVERSHOOT))))
+            for letters, share in candidates
+        ]
+        log_to_console(f"Product shards returned {len(found)}/{count}; requesting {missing} more from {len(asks)} shards")
+        delivered = run_round(asks)
+
+    # Overshoot is spread across shards, so trim evenly rather than from the end
+    return spread_sample(sorted(found.values()), count), requests_made
 
 # =============================================================================
 # API ROUTES
 # =============================================================================
 
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.inc("todolist_http_requests_total", route=route, method=request.method, status=str(response.status_code))
+        metrics.observe("todolist_http_request_duration_seconds", time.perf_counter() - started, route=route)
+    return response
+
 @app.route('/api/app_opened', methods=['POST'])
 def app_opened():
     """Track app opened event"""
@@ -397,7 +3298,7 @@ def app_opened():
             "version": "v0.0.5",
             "timestamp": datetime.now().isoformat()
         }
-        requests.post(HA_WEBHOOK_URL, json=payload, timeout=5)
+        http_client("webhook").post(HA_WEBHOOK_URL, json=payload, timeout=5)
     except:
         pass
     return jsonify({"success": True})
@@ -420,7 +3321,12 @@ def auth():
 
 @app.route('/api/generate_items', methods=['POST'])
 def generate_items():
-    """Generate product list using xAI Grok API"""
+    """Generate product list using xAI Grok API
+
+    Lists are cached per company, website, extra prompt and model (see
+    generate_cache_key); "force_refresh": true regenerates and replaces the
+    cached list. Responses served from the cache carry "cached": true.
+    """
     data = request.json
     company = data.get('company', '').strip()
     website = clean_url(data.get('website', '').strip())
@@ -430,64 +3336,66 @@ def generate_items():
     if not company:
         return jsonify({"success": False, "error": "Company is required"})
 
+    # Large catalogs are split into concurrent alphabetical shards unless "sharded": false
+    sharded = data.get('sharded')
+    sharded = count > GEN_SHARD_THRESHOLD if sharded is None else bool(sharded)
+    force_refresh = bool(data.get('force_refresh', False))  # Skip the cached list; the new one replaces it
+
     try:
         company_ref = company + (f" ({website})" if website else "")
-        prompt = f"""Return a Python list of exactly {count} {company_ref} products as strings, in this exact format:
-
-["Product1", "Product2", "Product3", ..., "Product{count}"]
-
-- Sort alphabetically
-- Double quotes
-- Comma + space
-- No extra text
-- One per entry
-- Natural spaces (e.g., "Running Shoe")"""
-
-        if extra_prompt:
-            prompt += f"\n\n{extra_prompt}"
-
-        log_to_console(f"Calling xAI Grok API for {count} {company} products")
-        
-        client = requests.Session()
-        client.headers.update({"Authorization": f"Bearer {API_KEY_GEN}"})
-
-        response = client.post(
-            f"{BASE_URL_GEN}/chat/completions",
-            json={
-                "model": MODEL,
-                "messages": [{"role": "user", "content": prompt}],
-                "temperature": 0.1,
-                "max_tokens": 1000
-            },
-            timeout=60
-        )
-        response.raise_for_status()
-        content = response.json()["choices"][0]["message"]["content"].strip()
+        cache_key = generate_cache_key(company, website, extra_prompt)
+        products, entry = (None, None) if force_refresh else cached_product_list(cache_key, count)
+        cached = products is not None
+
+        if cached:
+            log_to_console(f"Serving {count} {company} products from the generate cache")
+            sharded = entry["sharded"]
+            requests_made = 0
+            generated_at = datetime.fromtimestamp(entry["generated"])
+        else:
+            if sharded:
+                log_to_console(f"Calling xAI Grok API for {count} {company} products in alphabetical shards")
+                products, requests_made = generate_products_sharded(count, company_ref, extra_prompt)
+            else:
+                log_to_console(f"Calling xAI Grok API for {count} {company} products")
+                products = request_product_list(build_product_prompt(count, company_ref, extra_prompt))
+                requests_made = 1
+                if products is None:
+                    return jsonify({"success": False, "error": "No valid list found in API response"})
+                products = sorted(set(products))[:count]
+            generated_at = datetime.now()
+            if products:
+                # Only real names are stored; filler is added per response
+                generate_cache.set(cache_key, {
+                    "products": products,
+                    "requested": count,
+                    "sharded": sharded,
+                    "generated": generated_at.timestamp()
+                })
 
-        list_match = re.search(r'\[\s*(.*?)\s*\]', content, re.DOTALL)
-        if not list_match:
-            return jsonify({"success": False, "error": "No valid list found in API response"})
-        
-        products = [item.strip().strip('"\'') for item in re.split(r'\s*,\s*', list_match.group(1)) if item.strip().strip('"\'')]
-        products = sorted(set(products))[:count]
+        products = list(products)
+        padded = max(0, count - len(products))
         while len(products) < count:
             products.append(f"{company} Item {len(products)+1}")
 
         formatted_list = '["' + '", "'.join(products) + '"]'
         output_text = f"""# {count} {company} Products (via xAI Grok API)
-# Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+# Generated: {generated_at.strftime('%Y-%m-%d %H:%M:%S')}
 # Reference: {company_ref}
 # Model: {MODEL}
 {formatted_list}
 """
 
-        log_to_console(f"Generated {len(products)} products successfully")
+        log_to_console(f"Generated {len(products)} products successfully ({requests_made} completions, {padded} padded)")
         
         return jsonify({
             "success": True,
             "products": products,
             "output_text": output_text,
-            "count": len(products)
+            "count": len(products),
+            "sharded": sharded,
+            "padded": padded,
+            "cached": cached
         })
     except Exception as e:
         log_to_console(f"Generate failed: {str(e)}", "[ERROR]")
@@ -497,175 +3405,33 @@ def generate_items():
 def download_images():
     """Download images for products using Google Custom Search"""
     data = request.json
-    products = data.get('products', [])
-    sites_str = data.get('sites', DEFAULT_SITES)
-    images_per_item = int(data.get('images_per_item', DEFAULT_IMAGES_PER_ITEM))
-    prefix = data.get('prefix', DEFAULT_PREFIX).strip()
-    item_numbers = data.get('item_numbers', [])
-    filter_str = data.get('image_filters', '').strip()
-    save_dir = data.get('save_dir', '').strip()
+    options, error = parse_download_options(data)
+    if error:
+        return jsonify({"success": False, "error": error})
 
-    if not products:
-        return jsonify({"success": False, "error": "No products provided"})
-
-    filters, filter_error = parse_image_filters(filter_str)
-    if filter_error:
-        return jsonify({"success": False, "error": filter_error})
+    stream_mode = data.get('stream', '')  # "zip" streams an application/zip response
+    queries = options["queries"]
+    images_per_item = options["images_per_item"]
+    item_numbers = options["item_numbers"]
+    prefix = options["prefix"]
 
     try:
         # Always use temporary directory on server (web apps can't write to user's local paths)
         # The save_dir from frontend is ignored - files will be returned as downloads
-        save_dir = tempfile.mkdtemp(prefix="item_gen_")
-
-        sites = clean_sites(sites_str)
-        site_query = " OR ".join(f"site:{s}" for s in sites)
-        queries = [f"{p} ({site_query})" for p in products]
-
-        csv_rows = []
-        item_counter = 0
-
-        for q_idx, q in enumerate(queries):
-            original_name = q.split(" (")[0].strip()
-            clean_name = re.sub(r'[\\/:*?"<>|]', "", original_name).strip().replace(" ", "_")
-            item_counter += 1
-
-            params = {
-                "key": API_KEY_DOWN,
-                "cx": CX,
-                "q": q,
-                "searchType": "image",
-                "num": images_per_item
-            }
-            if filters:
-                params.update(filters)
-
-            success = False
-            last_error = None
-            items = []
+        # Streaming mode builds the archive in flight and never touches disk
+        save_dir = tempfile.mkdtemp(prefix="item_gen_") if stream_mode != "zip" else None
 
-            for attempt in range(3):
-                try:
-                    r = requests.get(URL_DOWN, params=params, timeout=15)
-                    if r.status_code == 429:
-                        last_error = "Rate limited (429) - retrying"
-                        continue
-                    r.raise_for_status()
-                    data = r.json()
-                    items = data.get("items", [])
-                    success = True
-                    break
-                except requests.exceptions.Timeout:
-                    last_error = "Timeout - retrying"
-                except requests.exceptions.RequestException as e:
-                    last_error = f"API error: {str(e)[:60]}"
-                    break
-
-            if not success:
-                for i in range(1, images_per_item + 1):
-                    row = [""] * 16
-                    if item_counter <= len(item_numbers):
-                        row[0] = item_numbers[item_counter - 1]
-                    row[1] = original_name
-                    row[2] = original_name
-                    row[3] = f"FAILED: {last_error or 'Unknown'}"
-                    csv_rows.append(row)
-                continue
-
-            valid_count = 0
-            search_idx = 0
-
-            while valid_count < images_per_item and search_idx < len(items):
-                item = items[search_idx]
-                search_idx += 1
-                img_url = item["link"]
-
-                img_success = False
-                for _ in range(3):
-                    try:
-                        img_r = requests.get(img_url, timeout=20)
-                        img_r.raise_for_status()
-
-                        if len(img_r.content) < 1500:
-                            break
-
-                        ctype = img_r.headers.get("content-type", "")
-                        if not ctype.startswith("image/"):
-                            break
-
-                        if "gif" in ctype and len(img_r.content) < 8000:
-                            break
-
-                        ext = os.path.splitext(item.get("image", {}).get("thumbnailLink", ""))[1]
-                        if ext.lower() not in {'.jpg','.jpeg','.png','.gif','.webp'}:
-                            ext = ".jpg"
-
-                        base_fn = f"{clean_name}_v{valid_count + 1}{ext}"
-                        final_fn = base_fn
-                        counter = 1
-                        while os.path.exists(os.path.join(save_dir, final_fn)):
-                            name, e = os.path.splitext(base_fn)
-                            final_fn = f"{name}_copy{counter}{e}"
-                            counter += 1
-
-                        path = os.path.join(save_dir, final_fn)
-                        with open(path, "wb") as f:
-                            f.write(img_r.content)
-
-                        public_url = prefix + final_fn if prefix else ""
-                        item_id = item_numbers[item_counter - 1] if item_counter <= len(item_numbers) else f"ITEM{item_counter:03d}"
-
-                        row = [""] * 16
-                        row[0] = item_id
-                        row[1] = original_name
-                        row[2] = original_name
-                        row[3] = public_url
-                        from urllib.parse import urlparse
-                        row[15] = urlparse(img_url).netloc.lower().replace("www.", "")
-                        csv_rows.append(row)
-
-                        valid_count += 1
-                        img_success = True
-                        break
-
-                    except Exception:
-                        break
-
-                if not img_success:
-                    pass
-
-            while valid_count < images_per_item:
-                row = [""] * 16
-                if item_counter <= len(item_numbers):
-                    row[0] = item_numbers[item_counter - 1]
-                row[1] = original_name
-                row[2] = original_name
-                row[3] = "DL_FAILED: No valid image"
-                csv_rows.append(row)
-                valid_count += 1
-                item_counter += 1
+        product_results = iter_download_results(options)
 
-        for i in range(item_counter, len(item_numbers) + 1):
-            if i > len(item_numbers):
-                break
-            row = [""] * 16
-            row[0] = item_numbers[i - 1]
-            row[1] = ""
-            row[2] = ""
-            row[3] = ""
-            csv_rows.append(row)
+        if stream_mode == "zip":
+            return stream_download_zip(queries, product_results, images_per_item, item_numbers, prefix)
 
-        headers = [
-            "ItemId", "ShortDescription", "Description", "ImageUrl",
-            "", "", "", "", "", "", "", "", "", "", "", "Source"
-        ]
+        csv_rows = []
+        for final_fn, body in assemble_download_rows(queries, product_results, images_per_item, item_numbers, prefix, csv_rows):
+            body.save(os.path.join(save_dir, final_fn))
 
         # Create CSV in memory and on disk
-        csv_buffer = io.StringIO()
-        w = csv.writer(csv_buffer)
-        w.writerow(headers)
-        w.writerows(csv_rows)
-        csv_content = csv_buffer.getvalue()
-        csv_buffer.close()
+        csv_content = render_download_csv(csv_rows)
 
         csv_filename = "imagedownload.csv"
         csv_path = os.path.join(save_dir, csv_filename)
@@ -680,6 +3446,8 @@ def download_images():
         zip_filename = f"downloaded_items_{zip_unique}.zip"
         zip_path = os.path.join(save_dir, zip_filename)
 
+        import zipfile
+
         with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
             for entry in os.listdir(save_dir):
                 entry_path = os.path.join(save_dir, entry)
@@ -689,7 +3457,7 @@ def download_images():
         with open(zip_path, "rb") as zip_file:
             zip_base64 = base64.b64encode(zip_file.read()).decode("utf-8")
 
-        log_to_console(f"Downloaded images for {len(products)} products, created CSV with {len(csv_rows)} rows and ZIP package {zip_filename}")
+        log_to_console(f"Downloaded images for {len(queries)} products, created CSV with {len(csv_rows)} rows and ZIP package {zip_filename}")
 
         try:
             shutil.rmtree(save_dir, ignore_errors=True)
@@ -703,18 +3471,212 @@ def download_images():
             "zip_content": zip_base64,
             "zip_filename": zip_filename,
             "row_count": len(csv_rows),
-            "image_count": len([r for r in csv_rows if r[3] and not r[3].startswith("FAILED") and not r[3].startswith("DL_FAILED")])
+            "image_count": count_downloaded_images(csv_rows)
         })
     except Exception as e:
         log_to_console(f"Download failed: {str(e)}", "[ERROR]")
         return jsonify({"success": False, "error": str(e)})
 
+GALLERY_STREAM_MIMETYPES = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream"
+}
+
+def gallery_variant_payload(variant, with_placeholder=False):
+    """The variant fields the gallery page needs"""
+    payload = {
+        "fileName": variant["fileName"],
+        "previewUrl": variant["previewUrl"],
+        "originalUrl": variant["originalUrl"],
+        "source": variant["source"],
+        "shortDescription": variant["shortDescription"],
+        "description": variant["description"]
+    }
+    if with_placeholder:
+        payload["isPlaceholder"] = variant.get("isPlaceholder", False)
+    return payload
+
+def build_product_gallery_item(idx, product_name, item_numbers, sites, images_per_item, filters, start_index, use_cache, criteria):
+    """Search one legacy product and build its gallery record
+
+    Returns:
+        tuple: (item payload, missing-item entry or None)
+    """
+    reference_id = item_numbers[idx] if idx < len(item_numbers) else None
+    item_id = reference_id or f"gallery_item_{idx + 1}"
+
+    # More than 10 images are fetched as concurrent pages (start_index offsets the first page)
+    variants, last_error = fetch_paged_image_variants(product_name, item_id, sites, images_per_item, filters, start=start_index, use_cache=use_cache, criteria=criteria)
+
+    missing = None
+    if not variants:
+        missing = {
+            "itemId": item_id,
+            "productName": product_name,
+            "reason": last_error or "No valid images returned"
+        }
+
+    unique_sources = {v['source'] for v in variants if v.get('source')}
+    group_source = next(iter(unique_sources)) if len(unique_sources) == 1 else ""
+
+    return {
+        "itemId": item_id,
+        "productName": product_name,
+        "referenceId": reference_id,
+        "variants": [gallery_variant_payload(v) for v in variants],
+        "source": group_source
+    }, missing
+
+def build_pos_gallery_item(pos_item, sites, images_per_item, filters, start_index, use_cache, criteria):
+    """Download URL1/URL2 and search Google Images for one todo item
+
+    Returns:
+        tuple: (item payload or None, missing-item entry or None)
+    """
+    item_id = pos_item.get('itemId', '')
+    image_url1 = pos_item.get('imageURL1', '').strip()
+    image_url2 = pos_item.get('imageURL2', '').strip()
+    short_description = pos_item.get('shortDescription', item_id).strip()
+
+    if not item_id:
+        return None, {
+            "itemId": item_id or "Unknown",
+            "productName": short_description,
+            "reason": "Missing ItemID"
+        }
+
+    # Download ImageURL1
+    url1_variants = []
+    if image_url1:
+        variant, error = download_image_from_url(image_url1, item_id, "URL1")
+        if variant:
+            url1_variants.append(variant)
+        else:
+            # Create placeholder for failed URL1
+            url1_variants.append(create_placeholder_variant(item_id, "URL1"))
+            log_to_console(f"URL1 failed for {item_id}: {error}", "[WARNING]")
+    else:
+        # Create placeholder for empty URL1
+        url1_variants.append(create_placeholder_variant(item_id, "URL1"))
+        log_to_console(f"URL1 empty for {item_id}", "[WARNING]")
+
+    # Download ImageURL2
+    url2_variants = []
+    if image_url2:
+        variant, error = download_image_from_url(image_url2, item_id, "URL2")
+        if variant:
+            url2_variants.append(variant)
+        else:
+            # Create placeholder for failed URL2
+            url2_variants.append(create_placeholder_variant(item_id, "URL2"))
+            log_to_console(f"URL2 failed for {item_id}: {error}", "[WARNING]")
+    else:
+        # Create placeholder for empty URL2
+        url2_variants.append(create_placeholder_variant(item_id, "URL2"))
+        log_to_console(f"URL2 empty for {item_id}", "[WARNING]")
+
+    # Search Google Images using ShortDescription
+    google_variants = []
+    if short_description:
+        # Fetch Google Images variants (concurrent pages when images_per_item > 10)
+        google_variants, last_error = fetch_paged_image_variants(short_description, item_id, sites, images_per_item, filters, start=start_index, use_cache=use_cache, criteria=criteria)
+        logger.debug("Google search for %s (%r, start=%s) returned %s variants, error: %s",
+                     item_id, short_description, start_index, len(google_variants), last_error, extra=GOOGLE_LOG)
+    else:
+        logger.debug("No ShortDescription for %s, skipping Google Images search", item_id, extra=GOOGLE_LOG)
+
+    # Keep URL1 and URL2 separate, Google images separate
+    return {
+        "itemId": item_id,
+        "ShortDescription": pos_item.get("shortDescription", ""),  # Preserve ShortDescription from input
+        "url1Variants": [gallery_variant_payload(v, with_placeholder=True) for v in url1_variants],
+        "url2Variants": [gallery_variant_payload(v, with_placeholder=True) for v in url2_variants],
+        "googleVariants": [gallery_variant_payload(v, with_placeholder=True) for v in google_variants]
+    }, None
+
+def iter_gallery_events(entries, build_item):
+    """Yield ("item", info) / ("missing", info) events as each entry's record is built
+
+    build_item(idx, entry) returns (item payload or None, missing entry or None).
+    Every event carries the entry's index so clients can keep input order.
+    """
+    for idx, entry in enumerate(entries):
+        item, missing = build_item(idx, entry)
+        if item is not None:
+            yield "item", {"index": idx, "item": item}
+        if missing is not None:
+            yield "missing", {"index": idx, "missingItem": missing}
+
+def gallery_response(entries, build_item, stream_mode, error_label):
+    """Run build_item over entries and answer with one JSON body or an event stream
+
+    stream_mode "" collects everything into {"items", "missingItems"};
+    "ndjson" and "sse" send start, item, missing and complete events as they happen.
+    """
+    if not stream_mode:
+        items_payload = []
+        missing_items = []
+        try:
+            for event_type, info in iter_gallery_events(entries, build_item):
+                if event_type == "item":
+                    items_payload.append(info["item"])
+                else:
+                    missing_items.append(info["missingItem"])
+            return jsonify({
+                "success": True,
+                "items": items_payload,
+                "missingItems": missing_items
+            })
+        except Exception as e:
+            log_to_console(f"{error_label} failed: {str(e)}", "[ERROR]")
+            return jsonify({"success": False, "error": str(e)}), 500
+
+    def format_event(event):
+        if stream_mode == "sse":
+            return f"data: {json.dumps(event)}\n\n"
+        return json.dumps(event) + "\n"
+
+    def generate():
+        started = time.time()
+        item_count = 0
+        missing_items = []
+        yield format_event({"type": "start", "total": len(entries)})
+        try:
+            for event_type, info in iter_gallery_events(entries, build_item):
+                if event_type == "item":
+                    item_count += 1
+                else:
+                    missing_items.append(info["missingItem"])
+                yield format_event({"type": event_type, **info})
+        except Exception as e:
+            log_to_console(f"{error_label} stream failed: {str(e)}", "[ERROR]")
+            yield format_event({"type": "error", "message": str(e)})
+            return
+        yield format_event({
+            "type": "complete",
+            "success": True,
+            "total": len(entries),
+            "itemCount": item_count,
+            "missingCount": len(missing_items),
+            "missingItems": missing_items,
+            "duration": round(time.time() - started, 2)
+        })
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype=GALLERY_STREAM_MIMETYPES[stream_mode],
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.route('/api/gallery_generate', methods=['POST'])
 def gallery_generate():
     """Generate gallery metadata for stateless image selection
     
     Supports both legacy format (products array) and new todo items format (posItems array).
     For todo items, downloads ImageURL1 and ImageURL2, then searches Google Images using ShortDescription.
+
+    "stream": "ndjson" or "sse" sends each item as soon as it is ready instead
+    of one JSON body at the end (see gallery_response for the events).
     """
     data = request.json
     pos_items = data.get('posItems', [])  # New todo items format
@@ -724,10 +3686,17 @@ def gallery_generate():
     images_per_item = int(data.get('images_per_item', DEFAULT_IMAGES_PER_ITEM))
     filter_str = data.get('image_filters', '').strip()
     start_index = int(data.get('start_index', 1))  # For pagination (1-based)
+    use_cache = not data.get('bypass_cache', False)  # Skip the search cache for this request
+    stream_mode = str(data.get('stream', '') or '').strip().lower()
+    if stream_mode and stream_mode not in GALLERY_STREAM_MIMETYPES:
+        return jsonify({"success": False, "error": "stream must be \"ndjson\" or \"sse\""}), 400
+    criteria, criteria_error = parse_image_criteria(data)
+    if criteria_error:
+        return jsonify({"success": False, "error": criteria_error}), 400
 
     # Check if using new todo items format
     if pos_items:
-        return handle_pos_items_gallery(pos_items, sites_str, images_per_item, filter_str, start_index)
+        return handle_pos_items_gallery(pos_items, sites_str, images_per_item, filter_str, start_index, use_cache, criteria, stream_mode)
     
     # Legacy format handling
     if not products:
@@ -741,86 +3710,12 @@ def gallery_generate():
     images_per_item = max(1, images_per_item)
     sites = clean_sites(sites_str)
 
-    items_payload = []
-    missing_items = []
-
-    try:
-        for idx, product_name in enumerate(products):
-            reference_id = item_numbers[idx] if idx < len(item_numbers) else None
-            item_id = reference_id or f"gallery_item_{idx + 1}"
-
-            # If requesting more than 10 images, paginate through multiple API calls
-            all_variants = []
-            if images_per_item <= 10:
-                # Single API call (use start_index if provided for pagination)
-                variants, last_error = fetch_image_variants(product_name, item_id, sites, images_per_item, filters, start=start_index)
-                all_variants = variants
-            else:
-                # Multiple API calls with pagination
-                remaining = images_per_item
-                current_start = start_index
-                last_error = None
-                
-                while remaining > 0 and len(all_variants) < images_per_item:
-                    batch_size = min(10, remaining)  # Google API max is 10 per request
-                    variants, batch_error = fetch_image_variants(product_name, item_id, sites, batch_size, filters, start=current_start)
-                    
-                    if batch_error:
-                        last_error = batch_error
-                        if not variants:  # If no variants returned, stop paginating
-                            break
-                    
-                    all_variants.extend(variants)
-                    remaining -= len(variants)
-                    current_start += len(variants)
-                    
-                    # If we got fewer than requested, we've reached the end
-                    if len(variants) < batch_size:
-                        break
-                
-                # Limit to requested number
-                all_variants = all_variants[:images_per_item]
-            
-            variants = all_variants
-
-            if not variants:
-                missing_items.append({
-                    "itemId": item_id,
-                    "productName": product_name,
-                    "reason": last_error or "No valid images returned"
-                })
-
-            unique_sources = {v['source'] for v in variants if v.get('source')}
-            group_source = next(iter(unique_sources)) if len(unique_sources) == 1 else ""
-
-            items_payload.append({
-                "itemId": item_id,
-                "productName": product_name,
-                "referenceId": reference_id,
-                "variants": [
-                    {
-                        "fileName": v["fileName"],
-                        "previewUrl": v["previewUrl"],
-                        "originalUrl": v["originalUrl"],
-                        "source": v["source"],
-                        "shortDescription": v["shortDescription"],
-                        "description": v["description"]
-                    }
-                    for v in variants
-                ],
-                "source": group_source
-            })
+    def build_item(idx, product_name):
+        return build_product_gallery_item(idx, product_name, item_numbers, sites, images_per_item, filters, start_index, use_cache, criteria)
 
-        return jsonify({
-            "success": True,
-            "items": items_payload,
-            "missingItems": missing_items
-        })
-    except Exception as e:
-        log_to_console(f"Gallery generate failed: {str(e)}", "[ERROR]")
-        return jsonify({"success": False, "error": str(e)}), 500
+    return gallery_response(products, build_item, stream_mode, "Gallery generate")
 
-def handle_pos_items_gallery(pos_items, sites_str, images_per_item, filter_str, start_index):
+def handle_pos_items_gallery(pos_items, sites_str, images_per_item, filter_str, start_index, use_cache=True, criteria=None, stream_mode=""):
     """Handle gallery generation for todo items format
     
     For each POS item:
@@ -836,158 +3731,10 @@ def handle_pos_items_gallery(pos_items, sites_str, images_per_item, filter_str,
     images_per_item = max(1, images_per_item)
     sites = clean_sites(sites_str)
 
-    items_payload = []
-    missing_items = []
-
-    try:
-        for pos_item in pos_items:
-            item_id = pos_item.get('itemId', '')
-            image_url1 = pos_item.get('imageURL1', '').strip()
-            image_url2 = pos_item.get('imageURL2', '').strip()
-            short_description = pos_item.get('shortDescription', item_id).strip()
-
-            if not item_id:
-                missing_items.append({
-                    "itemId": item_id or "Unknown",
-                    "productName": short_description,
-                    "reason": "Missing ItemID"
-                })
-                continue
-
-            # Download ImageURL1
-            url1_variants = []
-            if image_url1:
-                variant, error = download_image_from_url(image_url1, item_id, "URL1")
-                if variant:
-                    url1_variants.append(variant)
-                else:
-                    # Create placeholder for failed URL1
-                    url1_variants.append(create_placeholder_variant(item_id, "URL1"))
-                    log_to_console(f"URL1 failed for {item_id}: {error}", "[WARNING]")
-            else:
-                # Create placeholder for empty URL1
-                url1_variants.append(create_placeholder_variant(item_id, "URL1"))
-                log_to_console(f"URL1 empty for {item_id}", "[WARNING]")
-
-            # Download ImageURL2
-            url2_variants = []
-            if image_url2:
-                variant, error = download_image_from_url(image_url2, item_id, "URL2")
-                if variant:
-                    url2_variants.append(variant)
-                else:
-                    # Create placeholder for failed URL2
-                    url2_variants.append(create_placeholder_variant(item_id, "URL2"))
-                    log_to_console(f"URL2 failed for {item_id}: {error}", "[WARNING]")
-            else:
-                # Create placeholder for empty URL2
-                url2_variants.append(create_placeholder_variant(item_id, "URL2"))
-                log_to_console(f"URL2 empty for {item_id}", "[WARNING]")
-
-            # Search Google Images using ShortDescription
-            google_variants = []
-            log_to_console(f"[GOOGLE] Starting Google Images search for {item_id}", "[INFO]")
-            log_to_console(f"[GOOGLE] ShortDescription: '{short_description}'", "[INFO]")
-            log_to_console(f"[GOOGLE] Images per item: {images_per_item}, Start index: {start_index}", "[INFO]")
-            log_to_console(f"[GOOGLE] Sites: {sites}, Filters: {filters}", "[INFO]")
-            
-            if short_description:
-                log_to_console(f"[GOOGLE] ShortDescription found, proceeding with Google Images search", "[INFO]")
-                # Fetch Google Images variants
-                if images_per_item <= 10:
-                    log_to_console(f"[GOOGLE] Single API call (images_per_item={images_per_item} <= 10)", "[INFO]")
-                    variants, last_error = fetch_image_variants(short_description, item_id, sites, images_per_item, filters, start=start_index)
-                    google_variants = variants
-                    log_to_console(f"[GOOGLE] Single call returned {len(variants)} variants, error: {last_error or 'None'}", "[INFO]" if not last_error else "[WARNING]")
-                else:
-                    log_to_console(f"[GOOGLE] Multiple API calls needed (images_per_item={images_per_item} > 10)", "[INFO]")
-                    # Multiple API calls with pagination
-                    remaining = images_per_item
-                    current_start = start_index
-                    last_error = None
-                    all_google_variants = []
-                    
-                    while remaining > 0 and len(all_google_variants) < images_per_item:
-                        batch_size = min(10, remaining)
-                        log_to_console(f"[GOOGLE] Batch call: batch_size={batch_size}, start={current_start}, remaining={remaining}", "[INFO]")
-                        variants, batch_error = fetch_image_variants(short_description, item_id, sites, batch_size, filters, start=current_start)
-                        log_to_console(f"[GOOGLE] Batch returned {len(variants)} variants, error: {batch_error or 'None'}", "[INFO]" if not batch_error else "[WARNING]")
-                        
-                        if batch_error:
-                            last_error = batch_error
-                            if not variants:
-                                log_to_console(f"[GOOGLE] Batch error and no variants, stopping pagination", "[WARNING]")
-                                break
-                        
-                        all_google_variants.extend(variants)
-                        remaining -= len(variants)
-                        current_start += len(variants)
-                        
-                        if len(variants) < batch_size:
-                            log_to_console(f"[GOOGLE] Received fewer variants than requested ({len(variants)} < {batch_size}), stopping", "[INFO]")
-                            break
-                    
-                    google_variants = all_google_variants[:images_per_item]
-                    log_to_console(f"[GOOGLE] Total Google variants collected: {len(google_variants)}", "[INFO]")
-                
-                if not google_variants:
-                    log_to_console(f"[GOOGLE] No Google Images found for {item_id} (search: '{short_description}')", "[WARNING]")
-                else:
-                    log_to_console(f"[GOOGLE] ✓ Successfully fetched {len(google_variants)} Google Images for {item_id}", "[SUCCESS]")
-            else:
-                log_to_console(f"[GOOGLE] No ShortDescription for {item_id}, skipping Google Images search", "[WARNING]")
-
-            # Keep URL1 and URL2 separate, Google images separate
-            # Build item payload with separate arrays
-            items_payload.append({
-                "itemId": item_id,
-                "ShortDescription": pos_item.get("shortDescription", ""),  # Preserve ShortDescription from input
-                "url1Variants": [
-                    {
-                        "fileName": v["fileName"],
-                        "previewUrl": v["previewUrl"],
-                        "originalUrl": v["originalUrl"],
-                        "source": v["source"],
-                        "shortDescription": v["shortDescription"],
-                        "description": v["description"],
-                        "isPlaceholder": v.get("isPlaceholder", False)
-                    }
-                    for v in url1_variants
-                ],
-                "url2Variants": [
-                    {
-                        "fileName": v["fileName"],
-                        "previewUrl": v["previewUrl"],
-                        "originalUrl": v["originalUrl"],
-                        "source": v["source"],
-                        "shortDescription": v["shortDescription"],
-                        "description": v["description"],
-                        "isPlaceholder": v.get("isPlaceholder", False)
-                    }
-                    for v in url2_variants
-                ],
-                "googleVariants": [
-                    {
-                        "fileName": v["fileName"],
-                        "previewUrl": v["previewUrl"],
-                        "originalUrl": v["originalUrl"],
-                        "source": v["source"],
-                        "shortDescription": v["shortDescription"],
-                        "description": v["description"],
-                        "isPlaceholder": v.get("isPlaceholder", False)
-                    }
-                    for v in google_variants
-                ]
-            })
+    def build_item(idx, pos_item):
+        return build_pos_gallery_item(pos_item, sites, images_per_item, filters, start_index, use_cache, criteria)
 
-        return jsonify({
-            "success": True,
-            "items": items_payload,
-            "missingItems": missing_items
-        })
-    except Exception as e:
-        log_to_console(f"Todo items gallery generate failed: {str(e)}", "[ERROR]")
-        return jsonify({"success": False, "error": str(e)}), 500
+    return gallery_response(pos_items, build_item, stream_mode, "Todo items gallery generate")
 
 @app.route('/api/gallery_finalize', methods=['POST'])
 def gallery_finalize():
@@ -1013,9 +3760,17 @@ def gallery_finalize():
     #     if missing_required:
     #         return jsonify({"success": False, "error": f"Missing selections for: {', '.join(missing_required)}"}), 400
 
+    if data.get('stream', '') == "zip":
+        # Validate up front: once the archive starts streaming the status code is fixed
+        selection_map, error = parse_finalize_selections(selections)
+        if error:
+            return jsonify({"success": False, "error": error}), 400
+        return stream_gallery_zip(selection_map)
+
     temp_dir = tempfile.mkdtemp(prefix="gallery_finalize_")
     # csv_rows = []  # Commented out - CSV generation disabled
     image_files = []
+    failed = []
 
     try:
         for item_id, selection in selection_map.items():
@@ -1030,13 +3785,13 @@ def gallery_finalize():
             if not original_url:
                 raise ValueError(f"No image URL provided for {item_id}")
 
-            img_r = requests.get(original_url, timeout=20)
-            img_r.raise_for_status()
+            try:
+                body = fetch_image_body(original_url)
+            except requests.exceptions.RequestException as e:
+                failed.append({"itemId": item_id, "error": f"Failed to download: {str(e)[:80]}"})
+                continue
 
-            extension = get_extension_from_headers(img_r.headers.get("content-type", ""), ".jpg")
-            if not file_name.lower().endswith(extension):
-                file_name = re.sub(r'\.[^.]+$', '', file_name)
-                file_name = f"{file_name}{extension}"
+            file_name = gallery_image_name(file_name, body.content_type)
 
             # base_slug_source = product_name or short_desc or item_id  # Commented out - CSV only
             # base_slug = re.sub(r'[^A-Za-z0-9]+', '_', base_slug_source).strip('_')  # Commented out - CSV only
@@ -1049,8 +3804,7 @@ def gallery_finalize():
             # safe_name = f"{safe_base}{extension}"  # Commented out - CSV only
             safe_name = file_name  # Use file_name directly for ZIP
             file_path = os.path.join(temp_dir, safe_name)
-            with open(file_path, "wb") as f:
-                f.write(img_r.content)
+            body.save(file_path)
 
             image_files.append(file_path)
 
@@ -1099,6 +3853,7 @@ def gallery_finalize():
         timestamp = datetime.now().strftime('%y%m%d-%H%M')
         zip_filename = f"downloaded_items_{timestamp}.zip"
         zip_path = os.path.join(temp_dir, zip_filename)
+        import zipfile
         with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
             for image_path in image_files:
                 zipf.write(image_path, arcname=os.path.basename(image_path))
@@ -1106,16 +3861,17 @@ def gallery_finalize():
         with open(zip_path, "rb") as zip_file:
             zip_base64 = base64.b64encode(zip_file.read()).decode("utf-8")
 
-        log_to_console(f"Gallery finalize complete for {len(selection_map)} items (ZIP only, CSV disabled)", "[API]")
+        log_to_console(f"Gallery finalize complete: {len(image_files)} images ({len(failed)} failed) (ZIP only, CSV disabled)", "[API]")
 
         return jsonify({
-            "success": True,
+            "success": not failed,
             # "csv_content": csv_base64,  # Commented out - CSV generation disabled
             # "csv_filename": csv_filename,  # Commented out - CSV generation disabled
             "zip_content": zip_base64,
             "zip_filename": zip_filename,
             # "row_count": len(csv_rows)  # Commented out - CSV generation disabled
-            "image_count": len(image_files)
+            "image_count": len(image_files),
+            "failed": failed
         })
     except Exception as e:
         log_to_console(f"Gallery finalize failed: {str(e)}", "[ERROR]")
@@ -1126,6 +3882,169 @@ def gallery_finalize():
         except Exception:
             pass
 
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """Start a download_images or gallery_finalize run in the background and return its job id"""
+    data = request.json or {}
+    kind = data.get('kind', '')
+    if kind not in JOB_KINDS:
+        return jsonify({"success": False, "error": f"Unknown job kind: '{kind}'. Use one of: {', '.join(JOB_KINDS)}"}), 400
+
+    parse_options, runner = JOB_KINDS[kind]
+    options, error = parse_options(data.get('payload') or {})
+    if error:
+        return jsonify({"success": False, "error": error}), 400
+
+    job = job_manager.submit(kind, runner, options)
+    return jsonify({
+        "success": True,
+        "job_id": job.id,
+        "status_url": f"/api/jobs/{job.id}",
+        "events_url": f"/api/jobs/{job.id}/events",
+        "archive_url": f"/api/jobs/{job.id}/archive"
+    }), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Poll a job's status, progress, result and the artifacts produced so far"""
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({"success": False, "error": "Job not found or expired"}), 404
+    return jsonify(dict(job.snapshot(), success=True))
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Stream job events over SSE; reconnecting clients resume after Last-Event-ID (or ?since=)"""
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({"success": False, "error": "Job not found or expired"}), 404
+    try:
+        last_id = max(0, int(request.headers.get('Last-Event-ID') or request.args.get('since', 0) or 0))
+    except ValueError:
+        return jsonify({"success": False, "error": "Last-Event-ID and since must be integer event ids"}), 400
+
+    def generate(job, last_id):
+        while True:
+            events = job.wait_for_events(last_id, JOB_KEEPALIVE_SECONDS)
+            for event in events:
+                last_id = event["id"]
+                yield f"id: {event['id']}\ndata: {json.dumps(event)}\n\n"
+            if job.finished and len(job.events) <= last_id:
+                return
+            if not events:
+                yield ": keep-alive\n\n"
+            if not job.live:
+                job = job_manager.get(job_id) or job
+
+    return Response(generate(job, last_id), mimetype='text/event-stream', headers={"Cache-Control": "no-cache"})
+
+@app.route('/api/jobs/<job_id>/artifacts/<path:name>', methods=['GET'])
+def job_artifact(job_id, name):
+    """Download a single artifact (complete or from a still-running job)"""
+    job = job_manager.get(job_id)
+    if not job or name not in job.artifacts():
+        return jsonify({"success": False, "error": "Artifact not found"}), 404
+    return send_from_directory(job.artifact_dir, name, as_attachment=True)
+
+@app.route('/api/jobs/<job_id>/archive', methods=['GET'])
+def job_archive(job_id):
+    """Stream a ZIP of every artifact produced so far (partial results while running)"""
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({"success": False, "error": "Job not found or expired"}), 404
+
+    def entries():
+        for name in job.artifacts():
+            with open(os.path.join(job.artifact_dir, name), "rb") as f:
+                yield name, iter(lambda: f.read(ZIP_STREAM_CHUNK_SIZE), b"")
+        manifest = dict(job.snapshot(), partial=not job.finished)
+        yield ZIP_MANIFEST_NAME, (json.dumps(manifest, indent=2).encode("utf-8"),)
+
+    return zip_stream_response(entries(), f"job_{job.id[:8]}_{job.status}.zip")
+
+@app.route('/api/thumb', methods=['GET'])
+def thumb():
+    """Serve a resized JPEG/WebP copy of an image URL for gallery tiles
+
+    Query params: url (required), sig (required, from thumbnail_url),
+    w (width, default THUMB_DEFAULT_WIDTH), fmt (webp|jpeg).
+    Without Pillow installed this redirects to the original; without
+    THUMB_SIGNING_KEY the route is disabled.
+    """
+    if not THUMB_SIGNING_KEY:
+        return jsonify({"success": False, "error": "Thumbnail proxy is disabled"}), 404
+    image_url = request.args.get('url', '').strip()
+    if not image_url or urlparse(image_url).scheme not in ("http", "https"):
+        return jsonify({"success": False, "error": "A http(s) image url is required"}), 400
+    if not hmac.compare_digest(thumbnail_signature(image_url).encode(), request.args.get('sig', '').encode()):
+        return jsonify({"success": False, "error": "Invalid thumbnail signature"}), 403
+
+    width = thumbnail_width(request.args.get('w'))
+    fmt = "jpeg" if request.args.get('fmt', 'webp').lower() in ("jpg", "jpeg") else "webp"
+    key = thumbnail_key(image_url, width, fmt)
+    etag = key[:32]
+    headers = {"Cache-Control": f"public, max-age={THUMB_MAX_AGE_SECONDS}, immutable", "ETag": f'"{etag}"'}
+
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+
+    if load_pillow() is None:
+        return redirect(image_url, code=302)
+
+    data = thumb_cache.get(key)
+    if data is None:
+        try:
+            data = thumb_flight.do(key, render_thumbnail, image_url, width, fmt, key)
+        except ImageRejected as e:
+            log_to_console(f"Thumbnail source rejected for {image_url}: {str(e)[:80]}", "[WARNING]")
+            return jsonify({"success": False, "error": "Not a supported image"}), 415
+        except requests.exceptions.RequestException as e:
+            log_to_console(f"Thumbnail fetch failed for {image_url}: {str(e)[:80]}", "[WARNING]")
+            return jsonify({"success": False, "error": "Could not fetch image"}), 502
+        except (ValueError, OSError) as e:
+            log_to_console(f"Thumbnail render failed for {image_url}: {str(e)[:80]}", "[WARNING]")
+            return jsonify({"success": False, "error": "Not a supported image"}), 415
+
+    return Response(data, mimetype=f"image/{fmt}", headers=headers)
+
+@app.route('/api/stats', methods=['GET'])
+def stats():
+    """Report connection pool and cache statistics"""
+    return jsonify({
+        "success": True,
+        "http_pools": http_pool_stats(),
+        "rate_limits": {"google_cse": cse_governor.stats()},
+        "caches": {
+            "cse_search": search_cache.stats(),
+            "cloudinary_manifest": cloudinary_manifest.stats(),
+            "image_probe": image_probe_cache.stats(),
+            "thumbnails": thumb_cache.stats(),
+            "generate_items": generate_cache.stats()
+        }
+    })
+
+def cache_metric_samples():
+    caches = {
+        "cse_search": search_cache,
+        "cloudinary_manifest": cloudinary_manifest,
+        "image_probe": image_probe_cache,
+        "thumbnails": thumb_cache,
+        "generate_items": generate_cache
+    }
+    for name, cache in caches.items():
+        cache_stats = cache.stats()
+        yield "todolist_cache_hits_total", {"cache": name}, cache_stats["hits"]
+        yield "todolist_cache_misses_total", {"cache": name}, cache_stats["misses"]
+        yield "todolist_cache_hit_ratio", {"cache": name}, cache_stats["hit_ratio"]
+        yield "todolist_cache_bytes", {"cache": name}, cache_stats["bytes"]
+
+metrics.register_collector(cache_metric_samples)
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Expose route, upstream and cache metrics in the Prometheus text format"""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 @app.route('/api/cleanup_csv', methods=['POST'])
 def cleanup_csv():
     """Clean up and align CSV with item numbers"""
@@ -1137,16 +4056,14 @@ def cleanup_csv():
 def upload_cloudinary():
     """Upload images to Cloudinary"""
     try:
-        # Configure Cloudinary
-        cloudinary.config(
-            cloud_name=CLOUD_NAME,
-            api_key=API_KEY_CLOUD,
-            api_secret=API_SECRET_CLOUD
-        )
+        configure_cloudinary()
         
         # Get form data
         upload_folder = request.form.get('folder', '').strip()
         upload_preset = request.form.get('preset', '').strip()
+        parallel = form_flag(request.form.get('parallel'))
+        concurrency = int(request.form.get('concurrency', DEFAULT_UPLOAD_CONCURRENCY))
+        dedup = request.form.get('dedup') is None or form_flag(request.form.get('dedup'))
         
         # Get uploaded files
         if 'files' not in request.files:
@@ -1156,14 +4073,7 @@ def upload_cloudinary():
         if not files or files[0].filename == '':
             return jsonify({"success": False, "error": "No files selected"})
         
-        # Filter image files only
-        image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp'}
-        image_files = []
-        for f in files:
-            filename = f.filename.lower()
-            if any(filename.endswith(ext) for ext in image_extensions):
-                image_files.append(f)
-        
+        image_files = filter_image_files(files)
         if not image_files:
             return jsonify({"success": False, "error": "No valid image files found. Supported formats: JPG, PNG, GIF, WebP, BMP"})
         
@@ -1173,87 +4083,16 @@ def upload_cloudinary():
         
         log_to_console(f"Starting upload of {len(image_files)} images to Cloudinary...")
         
-        for idx, img_file in enumerate(image_files):
-            file_start_time = datetime.now()
-            try:
-                filename = img_file.filename
-                # Extract just the filename (basename) to ignore any directory structure
-                # This ensures files are uploaded directly to the specified folder
-                filename_only = os.path.basename(filename)
-                log_to_console(f"Uploading {idx + 1}/{len(image_files)}: {filename_only} (from {filename})")
-                
-                # Prepare upload options
-                upload_options = {}
-                if upload_folder:
-                    # Use folder in public_id: "folder/filename" (without extension)
-                    # Only use the filename, not any directory path
-                    name_without_ext = os.path.splitext(filename_only)[0]
-                    upload_options['public_id'] = f"{upload_folder}/{name_without_ext}"
-                else:
-                    # No folder, use just the filename without extension
-                    upload_options['public_id'] = os.path.splitext(filename_only)[0]
-                
-                if upload_preset:
-                    upload_options['upload_preset'] = upload_preset
-                
-                # Read file content
-                img_file.seek(0)
-                file_content = img_file.read()
-                
-                # Upload to Cloudinary
-                result = cloudinary.uploader.upload(
-                    file_content,
-                    **upload_options
-                )
-                
-                file_end_time = datetime.now()
-                duration = (file_end_time - file_start_time).total_seconds()
-                
-                cloudinary_url = result.get('secure_url') or result.get('url', '')
-                
-                uploaded_results.append({
-                    "filename": filename,
-                    "filename_only": filename_only,
-                    "cloudinary_url": cloudinary_url,
-                    "public_id": result.get('public_id', ''),
-                    "success": True,
-                    "duration": round(duration, 2),
-                    "index": idx + 1,
-                    "total": len(image_files)
-                })
-                
-                log_to_console(f"✓ Successfully uploaded {idx + 1}/{len(image_files)}: {filename_only} ({duration:.2f}s)")
-                
-            except cloudinary.exceptions.Error as e:
-                file_end_time = datetime.now()
-                duration = (file_end_time - file_start_time).total_seconds()
-                error_msg = str(e)
-                filename_only = os.path.basename(filename) if filename else "unknown"
-                log_to_console(f"✗ Failed to upload {idx + 1}/{len(image_files)}: {filename_only} ({duration:.2f}s) - {error_msg}", "[ERROR]")
-                failed_uploads.append({
-                    "filename": filename,
-                    "filename_only": filename_only,
-                    "error": error_msg,
-                    "success": False,
-                    "duration": round(duration, 2),
-                    "index": idx + 1,
-                    "total": len(image_files)
-                })
-            except Exception as e:
-                file_end_time = datetime.now()
-                duration = (file_end_time - file_start_time).total_seconds()
-                error_msg = str(e)
-                filename_only = os.path.basename(filename) if filename else "unknown"
-                log_to_console(f"✗ Error uploading {idx + 1}/{len(image_files)}: {filename_only} ({duration:.2f}s) - {error_msg}", "[ERROR]")
-                failed_uploads.append({
-                    "filename": filename,
-                    "filename_only": filename_only,
-                    "error": error_msg,
-                    "success": False,
-                    "duration": round(duration, 2),
-                    "index": idx + 1,
-                    "total": len(image_files)
-                })
+        for event_type, result in iter_cloudinary_uploads(image_files, upload_folder, upload_preset, parallel, concurrency, dedup):
+            if event_type != "result":
+                continue
+            if result["success"]:
+                uploaded_results.append(result)
+            else:
+                failed_uploads.append(result)
+        
+        uploaded_results.sort(key=lambda r: r["index"])
+        failed_uploads.sort(key=lambda r: r["index"])
         
         upload_end_time = datetime.now()
         total_duration = (upload_end_time - upload_start_time).total_seconds()
@@ -1265,7 +4104,8 @@ def upload_cloudinary():
             "failed": failed_uploads,
             "total": len(image_files),
             "successful": len(uploaded_results),
-            "failed_count": len(failed_uploads)
+            "failed_count": len(failed_uploads),
+            "deduplicated_count": len([r for r in uploaded_results if r.get("deduplicated")])
         })
         
     except Exception as e:
@@ -1277,16 +4117,14 @@ def upload_cloudinary_stream():
     """Upload images to Cloudinary with Server-Sent Events for real-time progress"""
     def generate():
         try:
-            # Configure Cloudinary
-            cloudinary.config(
-                cloud_name=CLOUD_NAME,
-                api_key=API_KEY_CLOUD,
-                api_secret=API_SECRET_CLOUD
-            )
+            configure_cloudinary()
             
             # Get form data
             upload_folder = request.form.get('folder', '').strip()
             upload_preset = request.form.get('preset', '').strip()
+            parallel = form_flag(request.form.get('parallel'))
+            concurrency = int(request.form.get('concurrency', DEFAULT_UPLOAD_CONCURRENCY))
+            dedup = request.form.get('dedup') is None or form_flag(request.form.get('dedup'))
             
             # Get uploaded files
             if 'files' not in request.files:
@@ -1298,14 +4136,7 @@ def upload_cloudinary_stream():
                 yield f"data: {json.dumps({'type': 'error', 'message': 'No files selected'})}\n\n"
                 return
             
-            # Filter image files only
-            image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp'}
-            image_files = []
-            for f in files:
-                filename = f.filename.lower()
-                if any(filename.endswith(ext) for ext in image_extensions):
-                    image_files.append(f)
-            
+            image_files = filter_image_files(files)
             if not image_files:
                 yield f"data: {json.dumps({'type': 'error', 'message': 'No valid image files found. Supported formats: JPG, PNG, GIF, WebP, BMP'})}\n\n"
                 return
@@ -1318,107 +4149,151 @@ def upload_cloudinary_stream():
             uploaded_results = []
             failed_uploads = []
             
-            for idx, img_file in enumerate(image_files):
-                file_start_time = datetime.now()
-                try:
-                    filename = img_file.filename
-                    filename_only = os.path.basename(filename)
-                    
-                    # Send progress event
-                    yield f"data: {json.dumps({'type': 'progress', 'index': idx + 1, 'total': len(image_files), 'filename': filename_only, 'status': 'uploading'})}\n\n"
-                    
-                    # Prepare upload options
-                    upload_options = {}
-                    if upload_folder:
-                        name_without_ext = os.path.splitext(filename_only)[0]
-                        upload_options['public_id'] = f"{upload_folder}/{name_without_ext}"
-                    else:
-                        upload_options['public_id'] = os.path.splitext(filename_only)[0]
-                    
-                    if upload_preset:
-                        upload_options['upload_preset'] = upload_preset
-                    
-                    # Read file content
-                    img_file.seek(0)
-                    file_content = img_file.read()
-                    
-                    # Upload to Cloudinary
-                    result = cloudinary.uploader.upload(
-                        file_content,
-                        **upload_options
-                    )
-                    
-                    file_end_time = datetime.now()
-                    duration = (file_end_time - file_start_time).total_seconds()
-                    
-                    cloudinary_url = result.get('secure_url') or result.get('url', '')
-                    
-                    uploaded_results.append({
-                        "filename": filename,
-                        "filename_only": filename_only,
-                        "cloudinary_url": cloudinary_url,
-                        "public_id": result.get('public_id', ''),
-                        "success": True,
-                        "duration": round(duration, 2),
-                        "index": idx + 1,
-                        "total": len(image_files)
-                    })
-                    
-                    # Send success event
-                    yield f"data: {json.dumps({'type': 'success', 'index': idx + 1, 'total': len(image_files), 'filename': filename_only, 'cloudinary_url': cloudinary_url, 'duration': round(duration, 2)})}\n\n"
-                    
-                except cloudinary.exceptions.Error as e:
-                    file_end_time = datetime.now()
-                    duration = (file_end_time - file_start_time).total_seconds()
-                    error_msg = str(e)
-                    filename_only = os.path.basename(filename) if filename else "unknown"
-                    
-                    failed_uploads.append({
-                        "filename": filename,
-                        "filename_only": filename_only,
-                        "error": error_msg,
-                        "success": False,
-                        "duration": round(duration, 2),
-                        "index": idx + 1,
-                        "total": len(image_files)
-                    })
-                    
-                    # Send error event
-                    yield f"data: {json.dumps({'type': 'error', 'index': idx + 1, 'total': len(image_files), 'filename': filename_only, 'error': error_msg, 'duration': round(duration, 2)})}\n\n"
-                    
-                except Exception as e:
-                    file_end_time = datetime.now()
-                    duration = (file_end_time - file_start_time).total_seconds()
-                    error_msg = str(e)
-                    filename_only = os.path.basename(filename) if filename else "unknown"
-                    
-                    failed_uploads.append({
-                        "filename": filename,
-                        "filename_only": filename_only,
-                        "error": error_msg,
-                        "success": False,
-                        "duration": round(duration, 2),
-                        "index": idx + 1,
-                        "total": len(image_files)
-                    })
-                    
-                    # Send error event
-                    yield f"data: {json.dumps({'type': 'error', 'index': idx + 1, 'total': len(image_files), 'filename': filename_only, 'error': error_msg, 'duration': round(duration, 2)})}\n\n"
+            # Events arrive in completion order; every event carries its file's index
+            for event_type, info in iter_cloudinary_uploads(image_files, upload_folder, upload_preset, parallel, concurrency, dedup):
+                if event_type == "progress":
+                    yield f"data: {json.dumps({'type': 'progress', 'index': info['index'], 'total': info['total'], 'filename': info['filename_only'], 'status': 'uploading'})}\n\n"
+                elif info["success"]:
+                    uploaded_results.append(info)
+                    yield f"data: {json.dumps({'type': 'success', 'status': info['status'], 'index': info['index'], 'total': info['total'], 'filename': info['filename_only'], 'cloudinary_url': info['cloudinary_url'], 'duration': info['duration']})}\n\n"
+                else:
+                    failed_uploads.append(info)
+                    yield f"data: {json.dumps({'type': 'error', 'index': info['index'], 'total': info['total'], 'filename': info['filename_only'], 'error': info['error'], 'duration': info['duration']})}\n\n"
+            
+            uploaded_results.sort(key=lambda r: r["index"])
+            failed_uploads.sort(key=lambda r: r["index"])
             
             upload_end_time = datetime.now()
             total_duration = (upload_end_time - upload_start_time).total_seconds()
             
             # Send complete event
-            yield f"data: {json.dumps({'type': 'complete', 'successful': len(uploaded_results), 'failed': len(failed_uploads), 'total': len(image_files), 'total_duration': round(total_duration, 2), 'uploaded': uploaded_results, 'failed': failed_uploads})}\n\n"
+            deduplicated_count = len([r for r in uploaded_results if r.get("deduplicated")])
+            yield f"data: {json.dumps({'type': 'complete', 'successful': len(uploaded_results), 'failed': len(failed_uploads), 'deduplicated': deduplicated_count, 'total': len(image_files), 'total_duration': round(total_duration, 2), 'uploaded': uploaded_results, 'failed': failed_uploads})}\n\n"
             
         except Exception as e:
             yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
     
     return Response(stream_with_context(generate()), mimetype='text/event-stream')
 
+@app.route('/api/cloudinary_sign', methods=['POST'])
+def cloudinary_sign():
+    """Issue signed parameters for direct browser-to-Cloudinary uploads
+
+    Body: {"folder", "preset", "dedup" (default true), "files": [{"filename", "hash"}]}.
+    The browser posts each file with its "fields" to upload_url, then relays
+    Cloudinary's responses to /api/cloudinary_upload_complete.
+    """
+    data = request.json or {}
+    files = data.get('files', [])
+    if not files:
+        return jsonify({"success": False, "error": "No files provided"}), 400
+    if len(files) > MAX_SIGNED_UPLOADS_PER_REQUEST:
+        return jsonify({"success": False, "error": f"At most {MAX_SIGNED_UPLOADS_PER_REQUEST} files can be signed per request"}), 400
+    if not API_KEY_CLOUD or not API_SECRET_CLOUD:
+        return jsonify({"success": False, "error": "Cloudinary credentials are not configured"}), 500
+
+    upload_folder = str(data.get('folder', '')).strip()
+    upload_preset = str(data.get('preset', '')).strip()
+    dedup = data.get('dedup') is None or form_flag(data.get('dedup'))
+    try:
+        signed = sign_cloudinary_uploads(files, upload_folder, upload_preset, dedup)
+    except Exception as e:
+        log_to_console(f"Cloudinary signing failed: {str(e)}", "[ERROR]")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+    counts = {}
+    for upload in signed["uploads"]:
+        counts[upload["status"]] = counts.get(upload["status"], 0) + 1
+    log_to_console(f"Signed direct uploads for folder '{upload_folder}': {counts}")
+    return jsonify(dict(signed, success=True, folder=upload_folder, preset=upload_preset))
+
+@app.route('/api/cloudinary_upload_complete', methods=['POST'])
+def cloudinary_upload_complete():
+    """Record direct uploads: {"uploads": [Cloudinary upload responses]}
+
+    Each response's signature is checked against our API secret; the etags
+    for the dedup manifest are then looked up from Cloudinary in one batch.
+    """
+    data = request.json or {}
+    results = data.get('uploads', [])
+    if not results:
+        return jsonify({"success": False, "error": "No uploads provided"}), 400
+
+    recorded = []
+    rejected = []
+    for result in results:
+        error = verify_direct_upload(result or {})
+        if error:
+            rejected.append({"public_id": (result or {}).get("public_id", ""), "error": error})
+        else:
+            recorded.append(str(result["public_id"]))
+    if recorded:
+        record_direct_uploads(recorded)
+
+    log_to_console(f"Direct upload callback: {len(recorded)} recorded, {len(rejected)} rejected")
+    return jsonify({"success": not rejected, "recorded": recorded, "rejected": rejected})
+
+def import_wm_csv_upload():
+    """update_wm for a raw text/csv body or a multipart "file" upload
+
+    org, token and the chunked options come from form fields (multipart) or
+    query parameters (raw body); the token may also be an Authorization: Bearer
+    header. The CSV is parsed while its chunks are being imported.
+    """
+    multipart = request.mimetype == 'multipart/form-data'
+    params = request.form if multipart else request.args
+    org = params.get('org', '').strip()
+    token = params.get('token', '').strip()
+    auth_header = request.headers.get('Authorization', '')
+    if not token and auth_header.lower().startswith('bearer '):
+        token = auth_header[len('bearer '):].strip()
+
+    if not org or not token:
+        return jsonify({"success": False, "error": "ORG and token required"})
+
+    if multipart:
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            return jsonify({"success": False, "error": "No CSV file provided"})
+        binary_stream = upload.stream
+    else:
+        binary_stream = request.stream
+
+    text_stream = io.TextIOWrapper(binary_stream, encoding="utf-8-sig", errors="replace", newline="")
+    ingest = WmCsvIngest(text_stream)
+    try:
+        importer = ChunkedBulkImporter(org, token, **chunked_import_options(params))
+        log_to_console(f"Streaming CSV upload to WMS for ORG: {org} in chunks of up to {importer.target_size}")
+        for _ in importer.run(ingest.items()):
+            pass
+        result = importer.summary()
+        if not importer.total and not importer.requires_reauth:
+            result.update(success=False, error="No valid items in CSV data")
+        result.update(ingest.report())
+        log_to_console(f"WM Update complete: {result['success_count']} success, {result['failed_count']} failed, {ingest.rejected_count} rows rejected")
+        return jsonify(result)
+    except Exception as e:
+        log_to_console(f"WM Update failed: {str(e)}", "[ERROR]")
+        return jsonify(dict(ingest.report(), success=False, error=str(e)))
+    finally:
+        text_stream.detach()  # Werkzeug closes the underlying stream
+
 @app.route('/api/update_wm', methods=['POST'])
 def update_wm():
-    """Bulk import items to Manhattan WMS"""
+    """Bulk import items to Manhattan WMS
+
+    By default the whole CSV is sent as one bulkImport request. With
+    "chunked": true (or a batch_size) it is sent as concurrent, retried,
+    adaptively sized chunks and the per-chunk results are merged.
+
+    Instead of JSON rows the CSV itself can be posted, as a text/csv body or
+    a multipart "file" field (see import_wm_csv_upload). It is always imported
+    in chunks, and rejected rows come back with their line numbers. Other
+    content types get the usual unsupported-media error.
+    """
+    if request.mimetype in ('text/csv', 'multipart/form-data'):
+        return import_wm_csv_upload()
+
     data = request.json
     org = data.get('org', '').strip()
     token = data.get('token', '').strip()
@@ -1431,61 +4306,57 @@ def update_wm():
         return jsonify({"success": False, "error": "No CSV data provided"})
 
     try:
-        data_payload = []
-        for row in csv_data:
-            if len(row) >= 4 and row[0].strip() and row[3].strip():
-                data_payload.append({
-                    "ItemId": row[0].strip(),
-                    "ShortDescription": row[1].strip(),
-                    "Description": row[2].strip(),
-                    "ImageUrl": row[3].strip()
-                })
+        data_payload = build_wm_payload(csv_data)
 
         if not data_payload:
             return jsonify({"success": False, "error": "No valid items in CSV data"})
 
-        headers_dict = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json",
-            "selectedOrganization": org.upper(),
-            "selectedLocation": f"{org.upper()}-DM1"
-        }
+        if data.get('chunked') or data.get('batch_size'):
+            importer = ChunkedBulkImporter(org, token, **chunked_import_options(data))
+            log_to_console(f"Uploading {len(data_payload)} items to WMS for ORG: {org} in chunks of up to {importer.target_size}")
+            for _ in importer.run(data_payload):
+                pass
+            summary = importer.summary()
+            log_to_console(f"WM Update complete: {summary['success_count']} success, {summary['failed_count']} failed in {len(summary['chunks'])} chunks")
+            return jsonify(summary)
 
         log_to_console(f"Uploading {len(data_payload)} items to WMS for ORG: {org}")
 
-        r = requests.post(
+        r = http_client("wms_api").post(
             BULK_IMPORT_URL,
             json={"Data": data_payload},
-            headers=headers_dict,
+            headers=wm_headers(org, token),
             timeout=60,
             verify=False
         )
 
-        trace_id = r.headers.get("CP-TRACE-ID", "N/A")
-        success = False
-        messages = []
-        exceptions = []
-
+        refreshed_token = None
         if r.status_code == 401:
-            return jsonify({"success": False, "error": "Token expired", "requires_reauth": True})
+            # Refresh once server-side and retry instead of bouncing back to the browser
+            refreshed_token = get_manhattan_token(org, stale_token=token)
+            if not refreshed_token or refreshed_token == token:
+                return jsonify({"success": False, "error": "Token expired", "requires_reauth": True})
+            log_to_console(f"WMS token expired for ORG: {org}, retrying with refreshed token")
+            record_upstream_retry("wms_api")
+            r = http_client("wms_api").post(
+                BULK_IMPORT_URL,
+                json={"Data": data_payload},
+                headers=wm_headers(org, refreshed_token),
+                timeout=60,
+                verify=False
+            )
+            if r.status_code == 401:
+                return jsonify({"success": False, "error": "Token expired", "requires_reauth": True})
 
-        try:
-            resp_json = r.json()
-            success = bool(resp_json.get("success"))
-            msg_list = resp_json.get("messages", {}).get("Message", [])
-            messages = [m.get("Description", "") for m in msg_list if m.get("Description")]
-            exceptions = [
-                f"{e.get('messageKey', 'Error')}: {e.get('message', '')}"
-                for e in resp_json.get("exceptions", [])
-            ]
-        except:
-            messages = [r.text[:500]]
+        trace_id = r.headers.get("CP-TRACE-ID", "N/A")
+
+        success, messages, exceptions = parse_bulk_import_response(r)
 
         failed_count = len(exceptions) if success else len(data_payload)
 
         log_to_console(f"WM Update complete: {len(data_payload) - failed_count} success, {failed_count} failed")
 
-        return jsonify({
+        result = {
             "success": success,
             "total": len(data_payload),
             "success_count": len(data_payload) - failed_count,
@@ -1493,11 +4364,43 @@ def update_wm():
             "trace_id": trace_id,
             "messages": messages,
             "exceptions": exceptions
-        })
+        }
+        if refreshed_token:
+            result["token"] = refreshed_token  # Lets the browser replace its expired token
+        return jsonify(result)
     except Exception as e:
         log_to_console(f"WM Update failed: {str(e)}", "[ERROR]")
         return jsonify({"success": False, "error": str(e)})
 
+@app.route('/api/update_wm_stream', methods=['POST'])
+def update_wm_stream():
+    """Chunked WMS bulk import with Server-Sent Events for per-chunk progress"""
+    data = request.json
+    org = data.get('org', '').strip()
+    token = data.get('token', '').strip()
+    csv_data = data.get('csv_data', [])
+
+    def generate():
+        if not org or not token:
+            yield f"data: {json.dumps({'type': 'error', 'message': 'ORG and token required'})}\n\n"
+            return
+        try:
+            data_payload = build_wm_payload(csv_data)
+            if not data_payload:
+                yield f"data: {json.dumps({'type': 'error', 'message': 'No valid items in CSV data'})}\n\n"
+                return
+
+            importer = ChunkedBulkImporter(org, token, **chunked_import_options(data))
+            yield f"data: {json.dumps({'type': 'start', 'total': len(data_payload), 'batch_size': importer.target_size, 'max_in_flight': importer.max_in_flight})}\n\n"
+            for event_type, info in importer.run(data_payload):
+                yield f"data: {json.dumps(dict(info, type=event_type))}\n\n"
+            yield f"data: {json.dumps(dict(importer.summary(), type='complete'))}\n\n"
+        except Exception as e:
+            log_to_console(f"WM Update stream failed: {str(e)}", "[ERROR]")
+            yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream')
+
 if __name__ == '__main__':
     app.run(debug=True)
 
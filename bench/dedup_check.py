@@ -0,0 +1,81 @@
+# bench/dedup_check.py
+"""Check Cloudinary upload dedup against the stand-in
+
+Usage (from the repo root):
+    python bench/dedup_check.py
+
+Uploads through /api/upload_cloudinary (dedup on) and fails (exit 1) when:
+- uploading A, then B, then A again to the same public_id skips the third
+  upload (the manifest still remembered A),
+- a file that already sits on Cloudinary is re-sent after the local
+  manifest is lost (the Admin API lookup path),
+- a changed file is skipped by that lookup path.
+"""
+import io
+import os
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from run_bench import load_app  # noqa: E402
+from stand_ins import JPEG_HEADER, CloudinaryHandler, StandInServer  # noqa: E402
+
+FILE_A = JPEG_HEADER + b"A" * 4096
+FILE_B = JPEG_HEADER + b"B" * 4096
+
+
+def upload(client, content, name="x.jpg", folder="f"):
+    """Upload one file and return its result entry"""
+    response = client.post("/api/upload_cloudinary", data={
+        "folder": folder,
+        "files": [(io.BytesIO(content), name)]
+    }, content_type="multipart/form-data")
+    body = response.get_json()
+    results = body.get("uploaded", []) + body.get("failed", [])
+    if not results:
+        raise SystemExit(f"upload_cloudinary returned no results: {body}")
+    return results[0]
+
+
+def main():
+    os.environ["CACHE_DIR"] = tempfile.mkdtemp(prefix="todolist_dedup_")
+    cloudinary = StandInServer(CloudinaryHandler).start()
+    index = load_app({"cloudinary": cloudinary, "cse": cloudinary, "xai": cloudinary, "wms": cloudinary}, 1000)
+    client = index.app.test_client()
+    failures = []
+
+    def expect(label, result, deduplicated, uploads):
+        seen = cloudinary.stats.get("uploads", 0)
+        if bool(result.get("deduplicated")) != deduplicated or seen != uploads:
+            failures.append(f"{label}: deduplicated={bool(result.get('deduplicated'))}, "
+                            f"{seen} uploads reached Cloudinary (expected {deduplicated}, {uploads})")
+
+    expect("A", upload(client, FILE_A), False, 1)
+    expect("B over A", upload(client, FILE_B), False, 2)
+    expect("A over B", upload(client, FILE_A), False, 3)
+    expect("A again", upload(client, FILE_A), True, 3)
+
+    # Forget the local manifest so only the Admin API lookup can dedup
+    index.cloudinary_manifest = index.PersistentCache(
+        "cloudinary_manifest", index.CLOUDINARY_MANIFEST_TTL_SECONDS, index.CLOUDINARY_MANIFEST_MAX_BYTES,
+        cache_dir=tempfile.mkdtemp(prefix="todolist_dedup_")
+    )
+    expect("A via lookup", upload(client, FILE_A), True, 3)
+    expect("B via lookup", upload(client, FILE_B), False, 4)
+    if not cloudinary.stats.get("lookups"):
+        failures.append("the Admin API lookup was never called")
+
+    cloudinary.stop()
+    if failures:
+        print("Dedup check failed:")
+        for failure in failures:
+            print(f"  - {failure}")
+        return 1
+    print(f"Dedup check OK ({cloudinary.stats.get('uploads', 0)} uploads, {cloudinary.stats.get('lookups', 0)} lookups)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+# bench/import_budget.py
+"""Check the cold-start import cost of api/index.py
+
+Usage (from the repo root):
+    python bench/import_budget.py
+    python bench/import_budget.py --runs 5 --self-budget-ms 30 --total-budget-ms 500
+
+Runs `python -X importtime -c "import index"` in fresh interpreters and
+fails (exit 1) when:
+- a module that must load lazily (cloudinary, PIL, zoneinfo) is imported at all,
+- index imports csv or zipfile itself (dependencies may still load them),
+- the module body or the whole import takes longer than its budget (median of --runs).
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+API_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "api")
+
+NEVER_AT_IMPORT = ("cloudinary", "PIL", "zoneinfo")
+NOT_DIRECTLY_IMPORTED = ("csv", "zipfile")
+DEFAULT_SELF_BUDGET_MS = 40
+DEFAULT_TOTAL_BUDGET_MS = 600
+
+
+def parse_importtime(stderr):
+    """Return [(depth, self_us, cumulative_us, module)] from -X importtime output"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        rows.append((depth, int(self_us), int(cumulative_us), name.strip()))
+    return rows
+
+
+def direct_imports(rows, module):
+    """Modules imported directly by module (children are printed before their parent)"""
+    children = []
+    for depth, _, _, name in rows:
+        if depth == 0:
+            if name == module:
+                return children
+            children = []
+        elif depth == 1:
+            children.append(name)
+    return []
+
+
+def measure_once():
+    env = dict(os.environ, CACHE_DIR=tempfile.mkdtemp(prefix="todolist_import_"), LOG_LEVEL="WARNING")
+    # Deployments import from bytecode, so let the warm-up run write it
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import index"],
+        cwd=API_DIR, env=env, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise SystemExit(f"import index failed:\n{proc.stderr[-2000:]}")
+    return parse_importtime(proc.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--self-budget-ms", type=float, default=DEFAULT_SELF_BUDGET_MS, help="Budget for index's own module body")
+    parser.add_argument("--total-budget-ms", type=float, default=DEFAULT_TOTAL_BUDGET_MS, help="Budget for import index including dependencies")
+    parser.add_argument("--top", type=int, default=10, help="Heaviest direct imports to list")
+    options = parser.parse_args(argv)
+
+    # The first run warms the bytecode cache and is not counted
+    measure_once()
+    runs = [measure_once() for _ in range(max(1, options.runs))]
+
+    index_rows = [[row for row in rows if row[0] == 0 and row[3] == "index"][0] for rows in runs]
+    self_ms = statistics.median(row[1] for row in index_rows) / 1000
+    total_ms = statistics.median(row[2] for row in index_rows) / 1000
+    last = runs[-1]
+
+    failures = []
+    loaded = {name.split(".")[0] for _, _, _, name in last}
+    for module in NEVER_AT_IMPORT:
+        if module in loaded:
+            failures.append(f"{module} is imported at module load; import it where it is used")
+    direct = direct_imports(last, "index")
+    for module in NOT_DIRECTLY_IMPORTED:
+        if module in direct:
+            failures.append(f"index imports {module} at module load; import it where it is used")
+    if self_ms > options.self_budget_ms:
+        failures.append(f"index module body took {self_ms:.1f} ms (budget {options.self_budget_ms:.0f} ms)")
+    if total_ms > options.total_budget_ms:
+        failures.append(f"import index took {total_ms:.1f} ms (budget {options.total_budget_ms:.0f} ms)")
+
+    print(f"import index: {total_ms:.1f} ms total, {self_ms:.1f} ms module body (median of {len(runs)} runs)")
+    heaviest = sorted(
+        ((cumulative, name) for depth, _, cumulative, name in last if depth == 1 and name in direct),
+        reverse=True
+    )[:options.top]
+    for cumulative, name in heaviest:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    if failures:
+        print("\nImport budget exceeded:")
+        for failure in failures:
+            print(f"  - {failure}")
+        return 1
+    print("Import budget OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,269 @@
+# bench/run_bench.py
+"""Benchmark the heavy API routes against local stand-in upstreams
+
+Usage (from the repo root):
+    python bench/run_bench.py
+    python bench/run_bench.py --scenarios download_images,update_wm --sizes 10,100 --repeat 5
+    python bench/run_bench.py --parallel --concurrency 4 --json results.json
+
+Every scenario/size pair runs in a fresh subprocess, so caches start cold
+and peak RSS belongs to that pair alone. Requests go through Flask's test
+client; all upstream traffic goes to the servers in stand_ins.py.
+"""
+import argparse
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(os.path.dirname(BENCH_DIR), "api")
+
+DEFAULT_SIZES = [10, 50]
+DEFAULT_REPEAT = 3
+
+
+def load_app(stand_ins, cse_rate):
+    """Import api/index.py with its upstream constants pointed at the stand-ins"""
+    os.environ.setdefault("CACHE_DIR", tempfile.mkdtemp(prefix="todolist_bench_"))
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ["CSE_RATE_PER_SECOND"] = str(cse_rate)
+    os.environ["CSE_BURST"] = str(max(1, int(cse_rate)))
+    os.environ.setdefault("GOOGLE_API_KEY", "bench")
+    os.environ.setdefault("CLOUDINARY_CLOUD_NAME", "bench")
+    os.environ.setdefault("CLOUDINARY_API_KEY", "bench")
+    os.environ.setdefault("CLOUDINARY_API_SECRET", "bench")
+    os.environ.setdefault("MANHATTAN_PASSWORD", "bench")
+    os.environ.setdefault("MANHATTAN_SECRET", "bench")
+    os.environ.setdefault("XAI_API_KEY", "bench")
+    os.environ.setdefault("THUMB_SIGNING_KEY", "bench")
+    sys.path.insert(0, API_DIR)
+
+    import index
+    import cloudinary
+
+    index.URL_DOWN = f"{stand_ins['cse'].base_url}/customsearch/v1"
+    index.BASE_URL_GEN = f"{stand_ins['xai'].base_url}/v1"
+    index.AUTH_URL = f"{stand_ins['wms'].base_url}/oauth/token"
+    index.BULK_IMPORT_BASE_URL = f"{stand_ins['wms'].base_url}/bulkImport"
+    index.BULK_IMPORT_URL = f"{index.BULK_IMPORT_BASE_URL}?stopOnFirstError=true"
+    index.configure_cloudinary()
+    cloudinary.config(upload_prefix=stand_ins["cloudinary"].base_url)
+    return index
+
+
+def product_names(size):
+    return [f"Bench Product {i:04d}" for i in range(size)]
+
+
+def read_body(response):
+    """Drain a (possibly streamed) response and return its size in bytes"""
+    total = 0
+    for chunk in response.response:
+        total += len(chunk)
+    response.close()
+    return total
+
+
+def run_download_images(client, size, options, stand_ins):
+    payload = {
+        "products": product_names(size),
+        "images_per_item": 3,
+        "sites": "bench.example",
+        "prefix": "",
+        "parallel": options.parallel
+    }
+    if options.stream:
+        payload["stream"] = "zip"
+    return client.post("/api/download_images", json=payload)
+
+
+def run_gallery_generate(client, size, options, stand_ins):
+    payload = {
+        "products": product_names(size),
+        "images_per_item": 12,
+        "sites": "",
+        "bypass_cache": True
+    }
+    if options.stream:
+        payload["stream"] = "ndjson"
+    return client.post("/api/gallery_generate", json=payload)
+
+
+def run_gallery_finalize(client, size, options, stand_ins):
+    image_base = stand_ins["images"].base_url
+    payload = {
+        "selections": [
+            {"itemId": f"ITEM{i:04d}", "fileName": f"ITEM{i:04d}_v01", "originalUrl": f"{image_base}/img/finalize_{i}.jpg"}
+            for i in range(size)
+        ]
+    }
+    if options.stream:
+        payload["stream"] = "zip"
+    return client.post("/api/gallery_finalize", json=payload)
+
+
+def run_upload_cloudinary_stream(client, size, options, stand_ins):
+    body = b"\xff\xd8\xff\xe0" + bytes(60000)
+    data = {
+        "folder": "bench",
+        "parallel": "true" if options.parallel else "false",
+        "dedup": "false",
+        "files": [(io.BytesIO(body + str(i).encode("ascii")), f"bench_{i:04d}.jpg") for i in range(size)]
+    }
+    return client.post("/api/upload_cloudinary_stream", data=data, content_type="multipart/form-data")
+
+
+def run_update_wm(client, size, options, stand_ins):
+    payload = {
+        "org": "BENCH",
+        "token": "bench-token",
+        "csv_data": [
+            [f"ITEM{i:05d}", f"Bench item {i}", f"Bench item {i}", f"https://res.cloudinary.invalid/bench/ITEM{i:05d}.jpg"]
+            for i in range(size)
+        ]
+    }
+    if options.parallel:
+        payload["chunked"] = True
+    return client.post("/api/update_wm", json=payload)
+
+
+def run_generate_items(client, size, options, stand_ins):
+    payload = {"company": "Bench", "website": "bench.example", "count": size}
+    if options.parallel:
+        payload["sharded"] = True
+    return client.post("/api/generate_items", json=payload)
+
+
+SCENARIOS = {
+    "download_images": run_download_images,
+    "gallery_generate": run_gallery_generate,
+    "gallery_finalize": run_gallery_finalize,
+    "upload_cloudinary_stream": run_upload_cloudinary_stream,
+    "update_wm": run_update_wm,
+    "generate_items": run_generate_items
+}
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[rank]
+
+
+def run_child(scenario, size, options):
+    """Run one scenario/size pair in this process and print its result as JSON"""
+    sys.path.insert(0, BENCH_DIR)
+    from stand_ins import start_stand_ins
+
+    stand_ins = start_stand_ins()
+    index = load_app(stand_ins, options.cse_rate)
+    client = index.app.test_client()
+    run = SCENARIOS[scenario]
+
+    def one_request():
+        started = time.perf_counter()
+        response = run(client, size, options, stand_ins)
+        body_bytes = read_body(response)
+        return time.perf_counter() - started, response.status_code, body_bytes
+
+    latencies = []
+    statuses = {}
+    body_bytes = 0
+    wall_started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=options.concurrency) as executor:
+        for _ in range(options.repeat):
+            for elapsed, status, size_out in executor.map(lambda _: one_request(), range(options.concurrency)):
+                latencies.append(elapsed)
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+                body_bytes += size_out
+    wall = time.perf_counter() - wall_started
+
+    requests_made = len(latencies)
+    result = {
+        "scenario": scenario,
+        "size": size,
+        "requests": requests_made,
+        "statuses": statuses,
+        "items_per_second": round(size * requests_made / wall, 2) if wall else 0.0,
+        "p50_seconds": round(percentile(latencies, 50), 4),
+        "p99_seconds": round(percentile(latencies, 99), 4),
+        "response_bytes": body_bytes,
+        # ru_maxrss is KiB on Linux and bytes on macOS
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1),
+        "upstream_calls": {name: server.stats for name, server in stand_ins.items()}
+    }
+    for server in stand_ins.values():
+        server.stop()
+    print(json.dumps(result))
+
+
+def run_all(options):
+    results = []
+    for scenario in options.scenarios:
+        for size in options.sizes:
+            cmd = [
+                sys.executable, os.path.abspath(__file__), "--child", scenario, str(size),
+                "--repeat", str(options.repeat), "--concurrency", str(options.concurrency),
+                "--cse-rate", str(options.cse_rate)
+            ]
+            if options.parallel:
+                cmd.append("--parallel")
+            if options.stream:
+                cmd.append("--stream")
+            proc = subprocess.run(cmd, capture_output=True, text=True)
+            lines = [line for line in proc.stdout.splitlines() if line.startswith("{\"scenario\"")]
+            if proc.returncode != 0 or not lines:
+                print(f"{scenario} size={size} failed:\n{proc.stderr[-2000:]}", file=sys.stderr)
+                continue
+            result = json.loads(lines[-1])
+            results.append(result)
+            print(
+                f"{scenario:<26} size={size:<5} items/s={result['items_per_second']:<9} "
+                f"p50={result['p50_seconds']:<8} p99={result['p99_seconds']:<8} "
+                f"peak_rss={result['peak_rss_mb']}MB statuses={result['statuses']}"
+            )
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated scenario names")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="Comma-separated catalog sizes")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Rounds per scenario/size")
+    parser.add_argument("--concurrency", type=int, default=1, help="Simultaneous requests per round")
+    parser.add_argument("--parallel", action="store_true", help="Use the parallel/chunked/sharded options of each route")
+    parser.add_argument("--stream", action="store_true", help="Stream responses (ZIPs for download_images/gallery_finalize, NDJSON for gallery_generate)")
+    parser.add_argument("--cse-rate", type=float, default=1000.0, help="CSE governor rate (requests per second)")
+    parser.add_argument("--json", help="Also write the results to this file")
+    parser.add_argument("--child", nargs=2, metavar=("SCENARIO", "SIZE"), help=argparse.SUPPRESS)
+    options = parser.parse_args(argv)
+    if isinstance(options.scenarios, str):
+        options.scenarios = [s.strip() for s in options.scenarios.split(",") if s.strip()]
+    options.sizes = [int(s) for s in str(options.sizes).split(",") if s.strip()]
+    unknown = [s for s in options.scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenario(s): {', '.join(unknown)}. Choose from {', '.join(SCENARIOS)}")
+    return options
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    if options.child:
+        run_child(options.child[0], int(options.child[1]), options)
+        return
+    results = run_all(options)
+    if options.json:
+        with open(options.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
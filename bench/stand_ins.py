@@ -0,0 +1,356 @@
+# bench/stand_ins.py
+"""Local stand-ins for the upstream services api/index.py talks to
+
+Each server runs on 127.0.0.1 in a daemon thread and mimics just enough of
+the real API for the benchmark routes:
+
+- Google CSE image search (pagination, injected 429s, latency)
+- arbitrary image hosts (sizes, slow responses, wrong content types, Range)
+- Cloudinary upload and the Admin resources_by_ids / resource details endpoints
+- Manhattan WMS oauth/token and item bulkImport
+- xAI chat completions that return product lists
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+JPEG_HEADER = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00"
+
+
+class StandInServer:
+    """Run a request handler class on a free local port in a background thread"""
+
+    def __init__(self, handler_cls, **settings):
+        handler = type(handler_cls.__name__, (handler_cls,), {"settings": settings, "stats": {}, "state": {}, "lock": threading.Lock()})
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.httpd.daemon_threads = True
+        self.handler = handler
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    @property
+    def stats(self):
+        with self.handler.lock:
+            return dict(self.handler.stats)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    settings = {}
+    stats = {}
+    state = {}  # Per-server data the stand-in keeps between calls
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] = self.stats.get(name, 0) + 1
+            return self.stats[name]
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def send_body(self, status, body, content_type="application/json", headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def pause(self, key):
+        delay = self.settings.get(key, 0)
+        if delay:
+            time.sleep(delay)
+
+
+class CSEHandler(StandInHandler):
+    """GET /customsearch/v1 - image results that point at the image host stand-in
+
+    Settings: image_base, latency, rate_limit_every (every Nth call gets a 429), max_results
+    """
+
+    def do_GET(self):
+        call = self.count("requests")
+        self.pause("latency")
+        every = self.settings.get("rate_limit_every", 0)
+        if every and call % every == 0:
+            self.count("rate_limited")
+            self.send_body(429, {"error": {"code": 429, "message": "Rate Limit Exceeded"}}, headers={"Retry-After": "0"})
+            return
+
+        query = parse_qs(urlparse(self.path).query)
+        start = int(query.get("start", ["1"])[0])
+        num = int(query.get("num", ["10"])[0])
+        if num > 10 or start + num - 1 > self.settings.get("max_results", 100):
+            self.send_body(400, {"error": {"code": 400, "message": "Invalid argument"}})
+            return
+
+        slug = re.sub(r"[^a-z0-9]+", "_", query.get("q", ["item"])[0].split(" (")[0].lower()).strip("_") or "item"
+        image_base = self.settings["image_base"]
+        items = []
+        for position in range(start, start + num):
+            name = f"{slug}_{position}"
+            items.append({
+                "link": f"{image_base}/img/{name}.jpg",
+                "mime": "image/jpeg",
+                "image": {
+                    "thumbnailLink": f"{image_base}/img/{name}.jpg?size=4000",
+                    "width": 800 + (position % 5) * 100,
+                    "height": 800,
+                    "byteSize": self.settings.get("image_size", 60000)
+                }
+            })
+        self.send_body(200, {"items": items, "searchInformation": {"totalResults": "100"}})
+
+
+class ImageHostHandler(StandInHandler):
+    """GET /img/<name>?size=N - JPEG-looking bodies, with slow and wrong-type outliers
+
+    Settings: image_size, latency, slow_every/slow_latency, wrong_type_every
+    (outliers are picked from a hash of the name, so repeats behave the same)
+    """
+
+    def do_GET(self):
+        self.count("requests")
+        parsed = urlparse(self.path)
+        query = parse_qs(parsed.query)
+        name = parsed.path.rsplit("/", 1)[-1]
+        bucket = int(hashlib.md5(name.encode("utf-8")).hexdigest()[:8], 16)
+        size = int(query.get("size", [self.settings.get("image_size", 60000)])[0])
+
+        self.pause("latency")
+        slow_every = self.settings.get("slow_every", 0)
+        if slow_every and bucket % slow_every == 0:
+            self.count("slow")
+            time.sleep(self.settings.get("slow_latency", 0.3))
+
+        wrong_every = self.settings.get("wrong_type_every", 0)
+        if wrong_every and bucket % wrong_every == 1:
+            self.count("wrong_type")
+            self.send_body(200, b"<html><body>Not found</body></html>" + b" " * 2000, "text/html")
+            return
+
+        body = JPEG_HEADER + bytes(max(0, size - len(JPEG_HEADER)))
+        etag = f'"{name}-{size}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        headers = {"ETag": etag, "Accept-Ranges": "bytes"}
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if match:
+            first = int(match.group(1))
+            last = min(int(match.group(2) or len(body) - 1), len(body) - 1)
+            headers["Content-Range"] = f"bytes {first}-{last}/{len(body)}"
+            self.send_body(206, body[first:last + 1], "image/jpeg", headers)
+            return
+        self.send_body(200, body, "image/jpeg", headers)
+
+
+class CloudinaryHandler(StandInHandler):
+    """POST /v1_1/<cloud>/image/upload, GET /v1_1/<cloud>/resources/image/upload[/<public_id>]
+
+    Uploads are stored by public_id, so a later upload overwrites the earlier
+    bytes as on the real service. Like the real listing, resources_by_ids
+    returns no etag; the details endpoint does.
+
+    Settings: latency, per_mb_latency
+    """
+
+    @staticmethod
+    def form_fields(content_type, body):
+        boundary = re.search(r'boundary="?([^";]+)"?', content_type or "")
+        fields = {}
+        if not boundary:
+            return fields
+        for part in body.split(b"--" + boundary.group(1).encode("latin-1")):
+            head, sep, value = part.partition(b"\r\n\r\n")
+            name = re.search(rb'name="([^"]*)"', head)
+            if sep and name:
+                fields[name.group(1).decode("utf-8")] = value[:-2] if value.endswith(b"\r\n") else value
+        return fields
+
+    def do_POST(self):
+        self.count("uploads")
+        body = self.read_body()
+        self.pause("latency")
+        per_mb = self.settings.get("per_mb_latency", 0)
+        if per_mb:
+            time.sleep(per_mb * len(body) / (1024 * 1024))
+        fields = self.form_fields(self.headers.get("Content-Type"), body)
+        content = fields.get("file", body)
+        public_id = fields["public_id"].decode("utf-8") if "public_id" in fields else hashlib.md5(content).hexdigest()
+        with self.lock:
+            self.stats["bytes"] = self.stats.get("bytes", 0) + len(body)
+            resources = self.state.setdefault("resources", {})
+            version = resources.get(public_id, {}).get("version", 0) + 1
+            resource = resources[public_id] = {
+                "public_id": public_id,
+                "version": version,
+                "etag": hashlib.md5(content).hexdigest(),
+                "bytes": len(content),
+                "url": f"http://res.cloudinary.invalid/v{version}/{public_id}",
+                "secure_url": f"https://res.cloudinary.invalid/v{version}/{public_id}"
+            }
+        self.send_body(200, resource)
+
+    def do_GET(self):
+        self.count("lookups")
+        self.pause("latency")
+        parsed = urlparse(self.path)
+        prefix, _, public_id = parsed.path.partition("/resources/image/upload/")
+        with self.lock:
+            resources = dict(self.state.get("resources", {}))
+        if public_id:
+            resource = resources.get(unquote(public_id))
+            if resource is None:
+                self.send_body(404, {"error": {"message": f"Resource not found - {unquote(public_id)}"}})
+            else:
+                self.send_body(200, resource)
+            return
+        query = parse_qs(parsed.query)
+        # The SDK sends public_ids[0]=...&public_ids[1]=...
+        wanted = [value for key, values in query.items() if key.startswith("public_ids") for value in values]
+        self.send_body(200, {"resources": [
+            {key: value for key, value in resources[public_id].items() if key != "etag"}
+            for public_id in wanted if public_id in resources
+        ]})
+
+
+class WMSHandler(StandInHandler):
+    """POST /oauth/token and POST /bulkImport
+
+    Settings: latency, per_item_latency (bulkImport time grows with chunk size),
+    error_every (every Nth bulkImport call answers 503)
+    """
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        body = self.read_body()
+        if path.endswith("/oauth/token"):
+            call = self.count("tokens")
+            self.send_body(200, {"access_token": f"bench-token-{call}", "token_type": "bearer", "expires_in": 3600})
+            return
+
+        call = self.count("bulk_imports")
+        items = json.loads(body or b"{}").get("Data", [])
+        with self.lock:
+            self.stats["items"] = self.stats.get("items", 0) + len(items)
+        self.pause("latency")
+        per_item = self.settings.get("per_item_latency", 0)
+        if per_item:
+            time.sleep(per_item * len(items))
+        every = self.settings.get("error_every", 0)
+        if every and call % every == 0:
+            self.send_body(503, {"success": False, "error": "Service Unavailable"})
+            return
+        self.send_body(200, {
+            "success": True,
+            "messages": {"Message": [{"Description": f"Imported {len(items)} items"}]},
+            "exceptions": []
+        }, headers={"CP-TRACE-ID": f"bench-{call}"})
+
+
+class XAIHandler(StandInHandler):
+    """POST /v1/chat/completions - product name lists for generate_items prompts
+
+    Honours "exactly N", "from X to Y" letter ranges and "Do not repeat" lists.
+    Every letter has a limited supply of names (names_per_letter, less for rare
+    letters) and replies longer than max_tokens are cut off with
+    finish_reason "length", like the real model.
+
+    Settings: latency, per_token_latency, tokens_per_name, names_per_letter
+    """
+
+    RARE_LETTERS = "JQUXYZ"
+
+    def do_POST(self):
+        self.count("completions")
+        request = json.loads(self.read_body() or b"{}")
+        prompt = request["messages"][0]["content"]
+        max_tokens = request.get("max_tokens", 1000)
+
+        wanted = int(re.search(r"exactly (\d+)", prompt).group(1))
+        letter_range = re.search(r"from ([A-Z]) to ([A-Z])", prompt)
+        first, last = letter_range.groups() if letter_range else ("A", "Z")
+        excluded = set()
+        exclude_match = re.search(r"Do not repeat any of these: (\[.*?\])\n", prompt + "\n")
+        if exclude_match:
+            excluded = set(json.loads(exclude_match.group(1)))
+
+        supply = self.settings.get("names_per_letter", 40)
+        names = []
+        for code in range(ord(first), ord(last) + 1):
+            letter = chr(code)
+            for k in range(1, (supply // 4 if letter in self.RARE_LETTERS else supply) + 1):
+                name = f"{letter}-Series Model {k:03d}"
+                if name not in excluded:
+                    names.append(name)
+        names = names[:wanted]
+
+        tokens_per_name = self.settings.get("tokens_per_name", 7)
+        fits = max(0, (max_tokens - 10) // tokens_per_name)
+        truncated = len(names) > fits
+        if truncated:
+            content = "[" + ", ".join(f'"{n}"' for n in names[:fits]) + ', "' + names[fits][:4]
+        else:
+            content = "[" + ", ".join(f'"{n}"' for n in names) + "]"
+        tokens = 10 + tokens_per_name * min(len(names), fits)
+        with self.lock:
+            self.stats["tokens"] = self.stats.get("tokens", 0) + tokens
+        self.pause("latency")
+        time.sleep(self.settings.get("per_token_latency", 0) * tokens)
+        self.send_body(200, {
+            "choices": [{"message": {"role": "assistant", "content": content}, "finish_reason": "length" if truncated else "stop"}],
+            "usage": {"completion_tokens": tokens}
+        })
+
+
+def start_stand_ins(profile=None):
+    """Start every stand-in and return them by name
+
+    profile overrides per-server settings, e.g. {"cse": {"latency": 0.05}}.
+    """
+    profile = profile or {}
+    images = StandInServer(ImageHostHandler, **{
+        "image_size": 60000, "latency": 0.01, "slow_every": 7, "slow_latency": 0.25, "wrong_type_every": 11,
+        **profile.get("images", {})
+    }).start()
+    cse = StandInServer(CSEHandler, **{
+        "image_base": images.base_url, "latency": 0.08, "rate_limit_every": 25, "image_size": 60000,
+        **profile.get("cse", {})
+    }).start()
+    cloudinary = StandInServer(CloudinaryHandler, **{
+        "latency": 0.05, "per_mb_latency": 0.02, **profile.get("cloudinary", {})
+    }).start()
+    wms = StandInServer(WMSHandler, **{
+        "latency": 0.05, "per_item_latency": 0.0005, "error_every": 0, **profile.get("wms", {})
+    }).start()
+    xai = StandInServer(XAIHandler, **{
+        "latency": 0.2, "per_token_latency": 0.002, "tokens_per_name": 7, "names_per_letter": 40,
+        **profile.get("xai", {})
+    }).start()
+    return {"images": images, "cse": cse, "cloudinary": cloudinary, "wms": wms, "xai": xai}